@@ -12,9 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+from unittest import mock
+
 import pytest
 
-from zubbi.scraper.connections.gerrit import CGitUrlBuilder, GitwebUrlBuilder
+from zubbi.scraper.connections.gerrit import (
+    CGitUrlBuilder,
+    GerritConnection,
+    GitwebUrlBuilder,
+)
 
 
 @pytest.mark.parametrize(
@@ -67,3 +74,76 @@ def test_url_for_file_gitweb(
     url_builder = GitwebUrlBuilder(gerrit_url)
     file_url = url_builder.build_file_url(repo_name, file_path, highlight_start, None)
     assert file_url == expected
+
+
+def test_get_events_command(tmp_path):
+    gerrit_con = GerritConnection(
+        "https://gerrit.example.com", user="zubbi", workspace=str(tmp_path)
+    )
+    assert gerrit_con.get_events_command() is None
+
+    gerrit_con.stream_events = True
+    assert gerrit_con.get_events_command() == [
+        "ssh",
+        "-p",
+        "29418",
+        "-o",
+        "BatchMode=yes",
+        "zubbi@gerrit.example.com",
+        "gerrit",
+        "stream-events",
+        "-s",
+        "ref-updated",
+    ]
+
+    gerrit_con.events_command = "cat 'gerrit events.json'"
+    assert gerrit_con.get_events_command() == ["cat", "gerrit events.json"]
+
+
+def test_get_head_shas(tmp_path, requests_mock):
+    gerrit_con = GerritConnection(
+        "https://gerrit.example.com",
+        user="zubbi",
+        password="secret",
+        workspace=str(tmp_path),
+        rest_url="https://gerrit.example.com/r",
+    )
+    listing = requests_mock.get(
+        "https://gerrit.example.com/r/a/projects/?b=master",
+        text=")]}'\n"
+        + json.dumps(
+            {
+                "orga/repo1": {"id": "orga%2Frepo1", "branches": {"master": "a" * 40}},
+                "orga/repo2": {"id": "orga%2Frepo2", "branches": {"master": "b" * 40}},
+            }
+        ),
+    )
+
+    heads = gerrit_con.get_head_shas()
+    assert heads.shas == {"orga/repo1": "a" * 40, "orga/repo2": "b" * 40}
+    assert listing.last_request.headers["Authorization"].startswith("Basic ")
+
+    # The listing is cached for all projects
+    assert gerrit_con.get_head_sha("orga/repo2") == "b" * 40
+    assert gerrit_con.get_head_sha("orga/missing") is None
+    assert listing.call_count == 1
+
+    gerrit_con.heads_ttl = 0
+    assert gerrit_con.get_head_shas() is not heads
+    assert listing.call_count == 2
+
+
+def test_get_head_shas_failure(tmp_path, requests_mock):
+    gerrit_con = GerritConnection("https://gerrit.example.com", workspace=str(tmp_path))
+    # The bulk listing is only used if the REST API is configured
+    assert gerrit_con.get_head_shas() is None
+
+    gerrit_con.rest_url = "https://gerrit.example.com"
+    requests_mock.get("https://gerrit.example.com/projects/?b=master", status_code=500)
+    assert gerrit_con.get_head_shas() is None
+    with mock.patch(
+        "zubbi.scraper.connections.git.GitConnection.get_head_sha",
+        return_value="c" * 40,
+    ) as ls_remote_mock:
+        assert gerrit_con.get_head_sha("orga/repo1") == "c" * 40
+    ls_remote_mock.assert_called_once_with("orga/repo1", "master")
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from unittest import mock
+
 import pytest
 from git import Repo
 
@@ -53,6 +55,17 @@ def test_get_repo_object_failure(tmpdir):
     assert git_repo._repo is None
 
 
+def test_get_repo_object_error(tmpdir):
+    git_url = "https://localhost/git"
+    git_con = GitConnection(git_url, workspace=tmpdir)
+
+    with mock.patch.object(git_con, "get_remote_url", side_effect=ValueError):
+        with pytest.raises(ValueError):
+            GitRepository("foo", git_con)
+    # The clone is not kept in use by the failed repository
+    assert not git_con.workspace._in_use("foo")
+
+
 def test_file_contents(mock_git_repo, tmpdir):
     git_url = "https://localhost/git"
     repo_name = "foo"
@@ -91,6 +104,9 @@ def test_directory_contents(mock_git_repo, tmpdir):
         readme_contents = contents["README"]
         assert isinstance(readme_contents, FileContent)
         assert readme_contents.path == "README"
+        assert readme_contents.type == "file"
+        # The blob SHA is used to detect unchanged files on the next scraping
+        assert readme_contents.sha == git_repo._repo.git.rev_parse("master:README")
 
 
 def test_non_existing_directory_contents(mock_git_repo, tmpdir):
@@ -104,3 +120,43 @@ def test_non_existing_directory_contents(mock_git_repo, tmpdir):
         with pytest.raises(CheckoutError) as excinfo:
             git_repo.directory_contents("/non-existing-directory")
         assert "Failed to check out '/non-existing-directory/'" in str(excinfo.value)
+
+
+def test_get_head_sha(mock_git_repo, tmpdir):
+    git_url = "file://{}".format(tmpdir)
+    repo_name = "foo"
+
+    with mock_git_repo(tmpdir, repo_name, git_url) as repo:
+        git_con = GitConnection(git_url)
+        head_sha = git_con.get_head_sha(repo_name, branch=repo.active_branch.name)
+        assert head_sha == repo.head.commit.hexsha
+
+        # Unknown repositories don't have a HEAD
+        assert git_con.get_head_sha("bar") is None
+
+
+def test_partial_clone(mock_git_repo, tmpdir):
+    remote_dir = tmpdir / "remote"
+    git_url = "file://{}".format(remote_dir)
+    repo_name = "foo"
+
+    with mock_git_repo(remote_dir, repo_name, git_url) as remote:
+        with remote.config_writer() as config:
+            config.set_value("uploadpack", "allowfilter", True)
+        git_con = GitConnection(git_url, workspace=tmpdir / "workspace")
+        git_repo = GitRepository(repo_name, git_con)
+
+        def _missing_files():
+            output = git_repo._repo.git.rev_list(
+                "--objects", "--missing=print", "master"
+            )
+            return [line for line in output.splitlines() if line.startswith("?")]
+
+        # The clone doesn't contain any files, but they can still be listed
+        readme = git_repo.directory_contents("/")["README"]
+        assert _missing_files() == ["?{}".format(readme.sha)]
+
+        # Prefetching the files makes them available locally
+        git_repo.prefetch([readme])
+        assert _missing_files() == []
+        assert git_repo.file_contents("README") == "Repository: foo"
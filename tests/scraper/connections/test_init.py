@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+from pathlib import Path
 from unittest import mock
 
 import pytest
@@ -23,6 +24,7 @@ from zubbi.scraper.connections.git import GitConnection
 from zubbi.scraper.connections.github import GitHubConnection
 from zubbi.scraper.exceptions import ScraperConfigurationError
 from zubbi.scraper.main import init_connections
+from zubbi.scraper.workspace import Workspace
 
 
 @pytest.fixture(scope="function")
@@ -54,6 +56,12 @@ def test_init_gerrit_con(patch_es):
         "base_url": "https://localhost/gerrit",
         "gitweb_url": "https://localhost/gerrit-web",
         "gitweb_type": "cgit",
+        "stream_events": False,
+        "ssh_port": 29418,
+        "events_command": None,
+        "rest_url": None,
+        "heads_ttl": 60,
+        "_heads": None,
     }
 
     connections = init_connections(config)
@@ -63,8 +71,11 @@ def test_init_gerrit_con(patch_es):
     assert isinstance(gerrit_con.web_url_builder, CGitUrlBuilder)
 
     con_data = vars(gerrit_con)
-    # That one is already checked via isinstance
+    # Those are already checked via isinstance
     con_data.pop("web_url_builder")
+    assert isinstance(con_data.pop("workspace"), Workspace)
+    # The lock only guards the cached project listing
+    con_data.pop("_heads_lock")
     assert con_data == expected_con_data
 
 
@@ -145,7 +156,11 @@ def test_init_git_con(patch_es):
     git_con = connections["git_con"]
 
     assert isinstance(git_con, GitConnection)
-    assert expected_con_data == git_con.__dict__
+    con_data = dict(git_con.__dict__)
+    workspace = con_data.pop("workspace")
+    assert expected_con_data == con_data
+    assert workspace.path == Path("/tmp/zubbi_working_dir")
+    assert workspace.max_size is None
 
 
 def test_init_con_invalid_provider(patch_es):
@@ -0,0 +1,592 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from elasticsearch.exceptions import ApiError, NotFoundError
+
+import zubbi.models
+from zubbi.models import GitRepo, ZubbiDoc, ZuulJob
+from zubbi.scraper.engine import (
+    AsyncScrapeEngine,
+    ScrapeEngine,
+    ScrapeIntervalPolicy,
+)
+from zubbi.scraper.exceptions import CheckoutError
+from zubbi.scraper.main import _scrape_repo_map
+from zubbi.scraper.repo_cache import RepoCache
+from zubbi.scraper.repos import Repository
+from zubbi.scraper.scraper import REPO_ROOT
+
+# The real bulk_save(), as the fixture below replaces it
+BULK_SAVE = ZubbiDoc.bulk_save
+
+JOB_CONTENT = """
+- job:
+    name: {}-job
+    description: Job in repo {}.
+"""
+
+
+class StubContents:
+    def __init__(self, path, type, sha=None):
+        self.name = path.split("/")[-1]
+        self.path = path
+        self.type = type
+        self.sha = sha
+
+
+class StubRepository(Repository):
+    """Repository providing a single job file, but no roles."""
+
+    # Only some repository implementations provide the SHA of a file
+    provide_shas = False
+    file_checkouts = 0
+    job_content = JOB_CONTENT
+    job_files = ["zuul.yaml"]
+
+    def __init__(self, repo_name, con):
+        self.repo_name = repo_name
+        # An unknown repo can't be initialized
+        self._repo = None if repo_name == "orga/unknown" else repo_name
+
+    def file_contents(self, file_path):
+        if file_path not in self.job_files:
+            raise CheckoutError(file_path, "File does not exist in repo.")
+        StubRepository.file_checkouts += 1
+        return self._content()
+
+    def directory_contents(self, directory_path):
+        if directory_path != REPO_ROOT:
+            raise CheckoutError(directory_path, "Directory does not exist in repo.")
+        sha = None
+        if self.provide_shas:
+            sha = hashlib.sha1(str.encode(self._content())).hexdigest()
+        return {path: StubContents(path, "file", sha) for path in self.job_files}
+
+    def _content(self):
+        short_name = self.repo_name.split("/")[-1]
+        return self.job_content.format(short_name, self.repo_name)
+
+    def last_changed(self, path):
+        return "2018-09-17 15:15:15"
+
+    def blame(self, path):
+        return []
+
+    def url_for_file(self, file_path, highlight_start=None, highlight_end=None):
+        return None
+
+    def url_for_directory(self, directory_path):
+        return None
+
+    @property
+    def url(self):
+        return None
+
+    @property
+    def private(self):
+        return False
+
+    @property
+    def name(self):
+        return self.repo_name
+
+
+class StubConnection:
+    provider = "stub"
+
+
+@pytest.fixture(scope="function")
+def stub_repos():
+    with mock.patch.dict("zubbi.scraper.engine.REPOS", {"stub": StubRepository}):
+        yield
+
+
+@pytest.fixture(scope="function")
+def mock_bulk_save():
+    # Collect the saved documents per class
+    saved = {"jobs": [], "roles": []}
+
+    def _bulk_save(name):
+        def _save(docs, **kwargs):
+            saved.setdefault(name, []).extend(docs)
+
+        return _save
+
+    def _bulk_save_blocks(docs, **kwargs):
+        # Jobs and roles are streamed to the same bulk request
+        for doc in docs:
+            name = "jobs" if isinstance(doc, ZuulJob) else "roles"
+            saved.setdefault(name, []).append(doc)
+
+    def _known_shas(name, key, sha_field):
+        def _get(repo_name):
+            return {
+                getattr(doc, key): getattr(doc, sha_field)
+                for doc in saved.get(name, [])
+                if doc.repo == repo_name and getattr(doc, sha_field, None)
+            }
+
+        return _get
+
+    def _carry_over(name):
+        def _update(repo_name, keys, repo_tenants, scrape_time):
+            saved.setdefault(name, []).append((repo_name, dict(keys), scrape_time))
+            return len(keys)
+
+        return _update
+
+    def _get_repo(id):
+        # Return the latest stored version of the repo
+        for repo in reversed(saved.get("repos", [])):
+            if repo.meta.id == id:
+                return repo
+        raise NotFoundError("Not found", meta=None, body=None)
+
+    with (
+        mock.patch("zubbi.scraper.engine.ZubbiDoc.bulk_save", _bulk_save_blocks),
+        mock.patch("zubbi.scraper.engine.GitRepo.bulk_save", _bulk_save("repos")),
+        mock.patch("zubbi.scraper.engine.GitRepo.get", _get_repo),
+        mock.patch(
+            "zubbi.scraper.engine.ZuulJob.known_shas",
+            _known_shas("jobs", "file_path", "file_sha"),
+        ),
+        mock.patch(
+            "zubbi.scraper.engine.AnsibleRole.known_shas",
+            _known_shas("roles", "role_name", "tree_sha"),
+        ),
+        mock.patch(
+            "zubbi.scraper.engine.ZuulJob.carry_over", _carry_over("carried_jobs")
+        ),
+        mock.patch(
+            "zubbi.scraper.engine.AnsibleRole.carry_over", _carry_over("carried_roles")
+        ),
+    ):
+        yield saved
+
+
+def _repo_map(*repo_names):
+    return {
+        repo_name: {
+            "tenants": {"jobs": ["foo"], "roles": ["foo"]},
+            "connection_name": "stub",
+        }
+        for repo_name in repo_names
+    }
+
+
+@pytest.mark.parametrize("engine_class", [ScrapeEngine, AsyncScrapeEngine])
+def test_engine_scrape(engine_class, stub_repos, mock_bulk_save):
+    scrape_time = datetime.now(timezone.utc)
+    repo_map = _repo_map("orga/repo1", "orga/repo2", "orga/unknown", "orga/repo3")
+
+    engine = engine_class({"stub": StubConnection()}, reusable_repos=["orga/repo2"])
+    engine.scrape(repo_map, scrape_time)
+
+    # The order might differ for the async engine
+    jobs = {job.job_name: job for job in mock_bulk_save["jobs"]}
+    assert sorted(jobs) == ["repo1-job", "repo2-job", "repo3-job"]
+    assert jobs["repo2-job"].reusable is True
+    assert jobs["repo3-job"].reusable is False
+    assert all(job.scrape_time == scrape_time for job in jobs.values())
+    assert mock_bulk_save["roles"] == []
+
+    # The repo which couldn't be initialized must not be stored
+    repos = {repo.repo_name: repo for repo in mock_bulk_save["repos"]}
+    assert sorted(repos) == ["orga/repo1", "orga/repo2", "orga/repo3"]
+    assert all(repo.provider == "stub" for repo in repos.values())
+    # The tenant config is stored to detect its changes on the next start
+    assert repos["orga/repo1"].to_dict()["tenant_config"] == repo_map["orga/repo1"]
+
+
+def test_async_engine_concurrency(stub_repos, mock_bulk_save):
+    repo_names = ["orga/repo{}".format(i) for i in range(20)]
+    engine = AsyncScrapeEngine(
+        {"stub": StubConnection()}, reusable_repos=[], concurrency=3
+    )
+    engine.scrape(_repo_map(*repo_names), datetime.now(timezone.utc))
+
+    assert len(mock_bulk_save["jobs"]) == 20
+    assert len(mock_bulk_save["repos"]) == 20
+
+
+class BrokenRepository(StubRepository):
+    """Repository whose files can't be fetched (e.g. due to a network error)."""
+
+    def file_contents(self, file_path):
+        if self.repo_name == "orga/broken":
+            raise ConnectionError("Connection reset by peer")
+        return super().file_contents(file_path)
+
+
+def test_async_engine_failed_repos(stub_repos, mock_bulk_save):
+    bulk_save = ZubbiDoc.bulk_save
+
+    def _bulk_save(docs, **kwargs):
+        docs = list(docs)
+        if any(doc.repo == "orga/unindexable" for doc in docs):
+            raise ConnectionError("Bulk request failed")
+        return bulk_save(docs, **kwargs)
+
+    repo_map = _repo_map("orga/repo1", "orga/broken", "orga/unindexable", "orga/repo2")
+    engine = AsyncScrapeEngine({"stub": StubConnection()}, [], concurrency=4)
+    with (
+        mock.patch.dict("zubbi.scraper.engine.REPOS", {"stub": BrokenRepository}),
+        mock.patch.object(ZubbiDoc, "bulk_save", _bulk_save),
+        # Collect the documents of all repos in a single bulk request
+        mock.patch("zubbi.scraper.engine.INDEX_CHUNK_SIZE", 100),
+    ):
+        results = engine.scrape(repo_map, datetime.now(timezone.utc))
+
+    # The failed repos are neither finished nor do they fail the other ones
+    assert sorted(results) == ["orga/repo1", "orga/repo2"]
+    jobs = sorted(job.job_name for job in mock_bulk_save["jobs"])
+    assert jobs == ["repo1-job", "repo2-job"]
+    repos = sorted(repo.repo_name for repo in mock_bulk_save["repos"])
+    assert repos == ["orga/repo1", "orga/repo2"]
+
+
+# Mapping of the jobs index as created by the first version of Zubbi
+BASELINE_JOB_PROPERTIES = {
+    "job_name": {"type": "text", "analyzer": "whitespace"},
+    "parent": {"type": "text", "analyzer": "whitespace"},
+    "line_start": {"type": "integer"},
+    "line_end": {"type": "integer"},
+    "name_suggest": {
+        "type": "completion",
+        "contexts": [
+            {"name": "private", "type": "category", "path": "private"},
+            {"name": "tenants", "type": "category", "path": "tenants"},
+        ],
+    },
+    "repo": {"type": "text", "analyzer": "whitespace"},
+    "tenants": {"type": "text", "analyzer": "whitespace"},
+    "private": {"type": "text"},
+    "url": {"type": "text"},
+    "description": {"type": "text", "analyzer": "whitespace"},
+    "description_html": {"type": "text"},
+    "platforms": {"type": "text", "analyzer": "whitespace"},
+    "last_updated": {"type": "date"},
+    "reusable": {"type": "boolean"},
+    "scrape_time": {"type": "date"},
+}
+
+
+def test_scrape_into_baseline_index(stub_repos, mock_bulk_save):
+    es = mock.Mock()
+    es.indices.exists.side_effect = lambda index: index == "zuul-jobs"
+    es.indices.get_mapping.side_effect = lambda index: {
+        index: {"mappings": {"properties": BASELINE_JOB_PROPERTIES}}
+    }
+    indexed = []
+
+    def _bulk(client, actions, **kwargs):
+        indexed.extend(actions)
+        return len(indexed), []
+
+    class ShaRepository(StubRepository):
+        provide_shas = True
+
+    engine = ScrapeEngine({"stub": StubConnection()}, [])
+    try:
+        zubbi.models.init_elasticsearch_documents(using=es)
+        with (
+            mock.patch.dict("zubbi.scraper.engine.REPOS", {"stub": ShaRepository}),
+            mock.patch.object(ZubbiDoc, "bulk_save", BULK_SAVE),
+            mock.patch("zubbi.models.bulk", _bulk),
+            mock.patch("zubbi.models.connections.get_connection"),
+        ):
+            engine.scrape(_repo_map("orga/repo1"), datetime.now(timezone.utc))
+    finally:
+        zubbi.models.OUTDATED_INDICES.clear()
+
+    # The new fields of the jobs are added, so they are not mapped dynamically
+    added = {
+        call.kwargs["index"]: call.kwargs["body"]["properties"]
+        for call in es.indices.put_mapping.call_args_list
+    }
+    assert added["zuul-jobs"]["file_path"] == {"type": "keyword"}
+    mapped = set(BASELINE_JOB_PROPERTIES) | set(added["zuul-jobs"])
+    assert indexed
+    for action in indexed:
+        assert action["_index"] == "zuul-jobs"
+        assert set(action["_source"]) <= mapped
+    # The fields which need the new analyzers are left for the migration
+    es.indices.close.assert_not_called()
+    assert "zubbi_ngram" not in str(added)
+
+
+@pytest.mark.parametrize("engine_class", [ScrapeEngine, AsyncScrapeEngine])
+def test_engine_rejected_bulk_request(engine_class, stub_repos, mock_bulk_save):
+    indexed = []
+
+    def _bulk(client, actions, **kwargs):
+        actions = list(actions)
+        if any(a["_source"]["repo"] == "orga/rejected" for a in actions):
+            # E.g. Elasticsearch is overloaded
+            raise ApiError("Too Many Requests", meta=mock.Mock(status=429), body={})
+        indexed.extend(a["_source"]["job_name"] for a in actions)
+        return len(actions), []
+
+    repo_map = _repo_map("orga/repo1", "orga/rejected", "orga/repo2")
+    engine = engine_class({"stub": StubConnection()}, [])
+    with (
+        # Use the real bulk_save(), but not the real Elasticsearch
+        mock.patch.object(ZubbiDoc, "bulk_save", BULK_SAVE),
+        mock.patch("zubbi.models.bulk", _bulk),
+        mock.patch("zubbi.models.connections.get_connection"),
+    ):
+        results = engine.scrape(repo_map, datetime.now(timezone.utc))
+
+    # The rejected repo is not finished, so its previous data is kept
+    assert sorted(results) == ["orga/repo1", "orga/repo2"]
+    assert sorted(indexed) == ["repo1-job", "repo2-job"]
+    repos = sorted(repo.repo_name for repo in mock_bulk_save["repos"])
+    assert repos == ["orga/repo1", "orga/repo2"]
+
+
+@mock.patch("zubbi.scraper.main.delete_outdated")
+@mock.patch("zubbi.scraper.main.ZuulTenant.bulk_save")
+def test_keep_data_of_failed_repos(
+    tenant_save_mock, delete_mock, stub_repos, mock_bulk_save
+):
+    engine = AsyncScrapeEngine({"stub": StubConnection()}, [])
+    with mock.patch.dict("zubbi.scraper.engine.REPOS", {"stub": BrokenRepository}):
+        _scrape_repo_map(
+            _repo_map("orga/repo1", "orga/broken"),
+            [],
+            {"stub": StubConnection()},
+            [],
+            datetime.now(timezone.utc),
+            RepoCache(),
+            delete_only=False,
+            engine=engine,
+        )
+
+    # Only the outdated data of the scraped repo is deleted
+    for call in delete_mock.call_args_list:
+        terms = call[1]["extra_filter"].to_dict()["terms"]
+        assert list(terms.values()) == [["orga/repo1"]]
+
+
+def test_engine_prefetch(stub_repos, mock_bulk_save):
+    created = []
+
+    class PrefetchedRepository(StubRepository):
+        def __init__(self, repo_name, con):
+            super().__init__(repo_name, con)
+            created.append((repo_name, threading.current_thread().name))
+
+    repo_names = ["orga/repo{}".format(i) for i in range(5)]
+    with mock.patch.dict("zubbi.scraper.engine.REPOS", {"stub": PrefetchedRepository}):
+        engine = ScrapeEngine({"stub": StubConnection()}, [], prefetch=2)
+        engine.scrape(_repo_map(*repo_names), datetime.now(timezone.utc))
+
+    # Each repo is only created once. All but the first one are created in
+    # the background.
+    assert sorted(name for name, _ in created) == repo_names
+    threads = dict(created)
+    assert not threads["orga/repo0"].startswith("zubbi-prefetch")
+    assert all(threads[name].startswith("zubbi-prefetch") for name in repo_names[1:])
+    assert len(mock_bulk_save["jobs"]) == 5
+
+
+def _intervals(results):
+    return {name: result.scrape_interval for name, result in results.items()}
+
+
+def test_adaptive_scrape_interval(stub_repos, mock_bulk_save):
+    policy = ScrapeIntervalPolicy(
+        minimum=timedelta(hours=12), maximum=timedelta(hours=240)
+    )
+    engine = ScrapeEngine({"stub": StubConnection()}, [], interval_policy=policy)
+    repo_map = _repo_map("orga/repo1")
+    first_scrape = datetime(2018, 9, 1, tzinfo=timezone.utc)
+
+    # A new repo is scraped with the minimum interval
+    results = engine.scrape(repo_map, first_scrape)
+    assert _intervals(results) == {"orga/repo1": timedelta(hours=12)}
+    assert results["orga/repo1"].changed_at == first_scrape
+
+    # The longer the repo doesn't change, the less often it's scraped
+    results = engine.scrape(repo_map, first_scrape + timedelta(days=4))
+    assert _intervals(results) == {"orga/repo1": timedelta(days=2)}
+    results = engine.scrape(repo_map, first_scrape + timedelta(days=30))
+    assert _intervals(results) == {"orga/repo1": timedelta(hours=240)}
+    repo = mock_bulk_save["repos"][-1]
+    assert repo.changed_at == first_scrape
+    assert repo.scrape_interval == 240 * 3600
+
+    # A change resets the interval
+    with mock.patch.object(StubRepository, "head_sha", return_value="abc"):
+        results = engine.scrape(repo_map, first_scrape + timedelta(days=31))
+    assert _intervals(results) == {"orga/repo1": timedelta(hours=12)}
+    assert results["orga/repo1"].head_sha == "abc"
+    assert mock_bulk_save["repos"][-1].head_sha == "abc"
+
+
+@mock.patch("zubbi.scraper.engine.GitRepo.get")
+@mock.patch("zubbi.scraper.engine.GitRepo.touch")
+@mock.patch("zubbi.scraper.engine.AnsibleRole.touch_repo")
+@mock.patch("zubbi.scraper.engine.ZuulJob.touch_repo")
+def test_engine_touch(job_touch_mock, role_touch_mock, repo_touch_mock, get_mock):
+    get_mock.return_value = GitRepo(repo_name="orga/repo1", reusable=False)
+    engine = ScrapeEngine({}, [])
+    scrape_time = datetime(2018, 9, 17, tzinfo=timezone.utc)
+
+    interval = engine.touch("orga/repo1", scrape_time, scrape_time - timedelta(days=4))
+
+    assert interval == timedelta(days=2)
+    job_touch_mock.assert_called_once_with("orga/repo1", scrape_time)
+    role_touch_mock.assert_called_once_with("orga/repo1", scrape_time)
+    repo_touch_mock.assert_called_once_with(scrape_time, scrape_interval=2 * 86400)
+
+    # The repo must be scraped if it became reusable in the meantime
+    engine = ScrapeEngine({}, ["orga/repo1"])
+    assert engine.touch("orga/repo1", scrape_time, scrape_time) is None
+    assert job_touch_mock.call_count == 1
+
+
+def test_scrape_changed_settings(stub_repos, mock_bulk_save):
+    repo_map = _repo_map("orga/repo1")
+    first_scrape = datetime(2018, 9, 1, tzinfo=timezone.utc)
+
+    with mock.patch.object(StubRepository, "provide_shas", True):
+        ScrapeEngine({"stub": StubConnection()}, []).scrape(repo_map, first_scrape)
+        assert mock_bulk_save["repos"][-1].reusable is False
+
+        # The unchanged file must be parsed again to update its jobs
+        engine = ScrapeEngine({"stub": StubConnection()}, ["orga/repo1"])
+        engine.scrape(repo_map, first_scrape + timedelta(days=1))
+        assert "carried_jobs" not in mock_bulk_save
+        assert [job.reusable for job in mock_bulk_save["jobs"]] == [False, True]
+        assert mock_bulk_save["repos"][-1].reusable is True
+
+        with mock.patch.object(StubRepository, "private", True):
+            engine.scrape(repo_map, first_scrape + timedelta(days=2))
+        assert [job.private for job in mock_bulk_save["jobs"]] == [False, False, True]
+
+        # Otherwise, the jobs are carried over
+        with mock.patch.object(StubRepository, "private", True):
+            engine.scrape(repo_map, first_scrape + timedelta(days=3))
+        assert len(mock_bulk_save["jobs"]) == 3
+        assert len(mock_bulk_save["carried_jobs"]) == 1
+
+
+def test_scrape_only_changed_files(stub_repos, mock_bulk_save):
+    engine = ScrapeEngine({"stub": StubConnection()}, [])
+    repo_map = _repo_map("orga/repo1")
+    first_scrape = datetime(2018, 9, 1, tzinfo=timezone.utc)
+
+    with (
+        mock.patch.object(StubRepository, "provide_shas", True),
+        mock.patch.object(StubRepository, "file_checkouts", 0),
+    ):
+        engine.scrape(repo_map, first_scrape)
+        assert StubRepository.file_checkouts == 1
+        job = mock_bulk_save["jobs"][0]
+        assert job.file_path == "zuul.yaml"
+        assert job.file_sha is not None
+
+        # The unchanged file is neither checked out nor parsed again, but
+        # its jobs are carried over to the current scrape.
+        second_scrape = first_scrape + timedelta(days=1)
+        engine.scrape(repo_map, second_scrape)
+        assert StubRepository.file_checkouts == 1
+        assert len(mock_bulk_save["jobs"]) == 1
+        assert mock_bulk_save["carried_jobs"] == [
+            ("orga/repo1", {"zuul.yaml": job.file_sha}, second_scrape)
+        ]
+        assert mock_bulk_save["repos"][-1].changed_at == first_scrape
+
+        # A changed file is scraped again
+        with mock.patch.object(
+            StubRepository, "job_content", JOB_CONTENT + "    voting: false\n"
+        ):
+            engine.scrape(repo_map, first_scrape + timedelta(days=2))
+        assert StubRepository.file_checkouts == 2
+        assert len(mock_bulk_save["jobs"]) == 2
+        assert mock_bulk_save["jobs"][-1].file_sha != job.file_sha
+        assert len(mock_bulk_save["carried_jobs"]) == 1
+        assert mock_bulk_save["repos"][-1].changed_at == first_scrape + timedelta(
+            days=2
+        )
+
+
+@mock.patch.object(ScrapeEngine, "_has_all_shas", return_value=True)
+def test_limited_scrape_keeps_head(has_all_shas_mock, stub_repos, mock_bulk_save):
+    engine = ScrapeEngine({"stub": StubConnection()}, [])
+    repo_map = _repo_map("orga/repo1")
+    first_scrape = datetime(2018, 9, 1, tzinfo=timezone.utc)
+
+    with mock.patch.object(StubRepository, "provide_shas", True):
+        with mock.patch.object(StubRepository, "head_sha", return_value="abc"):
+            engine.scrape(repo_map, first_scrape)
+
+        # Only the pushed files are scraped, so other changes might be missed
+        with mock.patch.object(StubRepository, "head_sha", return_value="def"):
+            results = engine.scrape(
+                repo_map,
+                first_scrape + timedelta(hours=1),
+                paths={"orga/repo1": {"zuul.yaml"}},
+            )
+            assert results["orga/repo1"].limited is True
+            assert results["orga/repo1"].head_sha == "abc"
+            assert mock_bulk_save["repos"][-1].head_sha == "abc"
+
+            # The HEAD is only stored by a scrape of the whole repo
+            results = engine.scrape(repo_map, first_scrape + timedelta(hours=2))
+            assert results["orga/repo1"].head_sha == "def"
+            assert mock_bulk_save["repos"][-1].head_sha == "def"
+
+
+def test_engine_streams_files(stub_repos, mock_bulk_save):
+    engine = ScrapeEngine({"stub": StubConnection()}, [])
+    events = []
+
+    file_contents = StubRepository.file_contents
+    bulk_save = ZubbiDoc.bulk_save
+
+    def _file_contents(self, file_path):
+        events.append(("fetch", file_path))
+        return file_contents(self, file_path)
+
+    def _bulk_save(docs, **kwargs):
+        def _track():
+            for doc in docs:
+                events.append(("index", doc.file_path))
+                yield doc
+
+        return bulk_save(_track(), **kwargs)
+
+    with (
+        mock.patch.object(StubRepository, "job_files", ["zuul.yaml", ".zuul.yaml"]),
+        mock.patch.object(StubRepository, "file_contents", _file_contents),
+        mock.patch.object(ZubbiDoc, "bulk_save", _bulk_save),
+    ):
+        results = engine.scrape(_repo_map("orga/repo1"), datetime.now(timezone.utc))
+
+    # Each file is indexed before the next one is fetched
+    assert events == [
+        ("fetch", "zuul.yaml"),
+        ("index", "zuul.yaml"),
+        ("fetch", ".zuul.yaml"),
+        ("index", ".zuul.yaml"),
+    ]
+    assert results["orga/repo1"].documents == 2
@@ -12,12 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import json
 from unittest import mock
 
 import pytest
+import zmq
 
 from zubbi.scraper.connections.github import GitHubConnection
-from zubbi.scraper.main import event_installation, event_push, handle_event
+from zubbi.scraper.main import (
+    apply_tenant_diff,
+    event_gerrit_ref_updated,
+    event_installation,
+    event_push,
+    handle_event,
+    receive_events,
+    stored_tenant_diff,
+)
+from zubbi.scraper.tenant_parser import TenantDiff, TenantParser
+from zubbi.scraper.work_queue import (
+    PRIORITY_INSTALLATION,
+    PRIORITY_PUSH,
+    ScrapeQueue,
+)
 
 
 @pytest.fixture(scope="function")
@@ -33,53 +50,55 @@ def patched_connections():
     return connections
 
 
+def _pop_all(scrape_queue):
+    requests = []
+    while scrape_queue:
+        request = scrape_queue.pop()
+        requests.append((request.repo_name, request.priority, request.delete_only))
+    return requests
+
+
 def test_unknown_event(patched_connections):
     # An unknown event shouldn't do anything, neither throw an exception
+    scrape_queue = ScrapeQueue()
     handle_event(
         "unknown",
         None,
         patched_connections,
-        reusable_repos=[],
         tenant_parser=None,
-        repo_cache=None,
+        scrape_queue=scrape_queue,
     )
+    assert len(scrape_queue) == 0
 
 
-@mock.patch("zubbi.scraper.main.scrape_repo_list")
 def test_event_installation_created(
-    scrape_mock, patched_connections, payload_webhook_installation_created
+    patched_connections, payload_webhook_installation_created
 ):
     # NOTE (felix): When testing the event handling, it should be enough to
-    # check if the correct methods are called in the correct ways. The
-    # functionality of those methods should be tested somewhere else.
+    # check if the correct repositories are queued in the correct ways. The
+    # scraping itself should be tested somewhere else.
+    scrape_queue = ScrapeQueue()
     event_installation(
         payload_webhook_installation_created,
         patched_connections,
-        reusable_repos=[],
         tenant_parser=None,
-        repo_cache=None,
+        scrape_queue=scrape_queue,
     )
 
-    # Ensure that the scrape method is called with the correct list of repositories
-    assert scrape_mock.call_args == mock.call(
-        [
-            "zubbi-oss/testsub1",
-            "zubbi-oss/testsub2",
-            "zubbi-oss/testbase1",
-            "zubbi-oss/demo",
-            "playground/testsub3",
-        ],
-        patched_connections,
-        [],
-        None,
-        repo_cache=None,
-    )
+    # Ensure that the correct list of repositories is queued for scraping
+    assert _pop_all(scrape_queue) == [
+        ("zubbi-oss/testsub1", PRIORITY_INSTALLATION, False),
+        ("zubbi-oss/testsub2", PRIORITY_INSTALLATION, False),
+        ("zubbi-oss/testbase1", PRIORITY_INSTALLATION, False),
+        ("zubbi-oss/demo", PRIORITY_INSTALLATION, False),
+        ("playground/testsub3", PRIORITY_INSTALLATION, False),
+    ]
 
 
-@mock.patch("zubbi.scraper.main.scrape_repo_list")
 def test_event_installation_deleted(
-    scrape_mock, patched_connections, payload_webhook_installation_deleted
+    patched_connections, payload_webhook_installation_deleted
 ):
+    scrape_queue = ScrapeQueue()
     # Ensure that some repositories can be looked up for this installation as they
     # are not part of the payload for a delete event.
     with mock.patch(
@@ -89,42 +108,158 @@ def test_event_installation_deleted(
         event_installation(
             payload_webhook_installation_deleted,
             patched_connections,
-            reusable_repos=[],
             tenant_parser=None,
-            repo_cache=None,
+            scrape_queue=scrape_queue,
         )
 
-    # Ensure that the scrape method is called with the correct list of repos
-    # and the delete_only flag.
-    assert scrape_mock.call_args == mock.call(
-        ["org/foo", "org/bar"],
-        patched_connections,
-        [],
-        None,
-        repo_cache=None,
-        delete_only=True,
-    )
+    # Ensure that the correct list of repos is queued with the delete_only flag.
+    assert _pop_all(scrape_queue) == [
+        ("org/foo", PRIORITY_INSTALLATION, True),
+        ("org/bar", PRIORITY_INSTALLATION, True),
+    ]
 
 
-@mock.patch("zubbi.scraper.main.scrape_repo_list")
-def test_event_push(scrape_mock, patched_connections, payload_webhook_push):
+def test_event_push(patched_connections, payload_webhook_push):
     # Ensure that the repository from the payload is part of our GitHub connection
     # and has a valid default branch.
     gh_con = patched_connections.get("github")
     gh_con.installation_map = {"zubbi-oss/testsub1": {"default_branch": "master"}}
 
+    tenant_parser = TenantParser(
+        sources_file="tests/testdata/tenant_configs/tenant-config.yaml"
+    )
+    scrape_queue = ScrapeQueue()
     event_push(
         payload_webhook_push,
         patched_connections,
-        reusable_repos=[],
-        tenant_parser=None,
-        repo_cache=None,
+        tenant_parser=tenant_parser,
+        scrape_queue=scrape_queue,
+    )
+
+    # Ensure that the repository is queued with the highest priority
+    assert _pop_all(scrape_queue) == [("zubbi-oss/testsub1", PRIORITY_PUSH, False)]
+
+
+def test_event_push_changed_paths(patched_connections, payload_webhook_push):
+    gh_con = patched_connections.get("github")
+    gh_con.installation_map = {"zubbi-oss/testsub1": {"default_branch": "master"}}
+    payload_webhook_push["commits"] = [
+        {"added": ["zuul.d/new.yaml"], "modified": ["README.md"], "removed": []},
+        {"added": [], "modified": [], "removed": ["roles/foo/tasks/main.yaml"]},
+    ]
+
+    scrape_queue = ScrapeQueue()
+    event_push(
+        payload_webhook_push,
+        patched_connections,
+        tenant_parser=TenantParser(
+            sources_file="tests/testdata/tenant_configs/tenant-config.yaml"
+        ),
+        scrape_queue=scrape_queue,
+    )
+    assert scrape_queue.pop().paths == {
+        "zuul.d/new.yaml",
+        "README.md",
+        "roles/foo/tasks/main.yaml",
+    }
+
+    # GitHub lists at most 20 commits, so the changed paths might be incomplete
+    payload_webhook_push["commits"] *= 10
+    event_push(
+        payload_webhook_push,
+        patched_connections,
+        tenant_parser=TenantParser(
+            sources_file="tests/testdata/tenant_configs/tenant-config.yaml"
+        ),
+        scrape_queue=scrape_queue,
+    )
+    assert scrape_queue.pop().paths is None
+
+
+@mock.patch("zubbi.scraper.main.update_tenants", return_value=[])
+def test_event_push_tenant_sources_repo(
+    update_tenants_mock, patched_connections, payload_webhook_push
+):
+    gh_con = patched_connections.get("github")
+    gh_con.installation_map = {"zubbi-oss/testsub1": {"default_branch": "master"}}
+
+    def _repo_data(tenants, extra_config_paths=None):
+        repo_tenants = {"jobs": tenants, "roles": tenants}
+        if extra_config_paths:
+            repo_tenants["extra_config_paths"] = extra_config_paths
+        return {"tenants": repo_tenants, "connection_name": "github"}
+
+    old_repo_map = {
+        "orga/removed": _repo_data(["foo"]),
+        "orga/changed": _repo_data(["foo"]),
+        "orga/extra": _repo_data(["foo"]),
+    }
+    new_repo_map = {
+        "orga/added": _repo_data(["foo"]),
+        "orga/changed": _repo_data(["bar"]),
+        "orga/extra": _repo_data(["foo"], {"zuul-extra.d": ["bar"]}),
+    }
+
+    tenant_parser = mock.Mock(spec=TenantParser)
+    tenant_parser.sources_repo = mock.Mock(repo_name="zubbi-oss/testsub1")
+    tenant_parser.repo_map = new_repo_map
+    tenant_parser.refresh.return_value = TenantDiff(
+        old_repo_map, new_repo_map, old_tenants=["foo"], new_tenants=["foo", "bar"]
+    )
+    scrape_queue = ScrapeQueue()
+    event_push(
+        payload_webhook_push,
+        patched_connections,
+        tenant_parser=tenant_parser,
+        scrape_queue=scrape_queue,
     )
 
-    # Ensure that the scrape method is called with the correct list of repositories
-    assert scrape_mock.call_args == mock.call(
-        ["zubbi-oss/testsub1"], patched_connections, [], None, repo_cache=None
+    # A push to the tenant sources repo must reload the tenant sources
+    tenant_parser.refresh.assert_called_once_with(fetch=True)
+    # Only the tenants changed for this repo, so it's updated in place
+    update_tenants_mock.assert_called_once_with(["orga/changed"], new_repo_map, None)
+    # The other repos must be scraped or deleted. The extra config path
+    # requires to scrape other files of the repo.
+    assert _pop_all(scrape_queue) == [
+        ("zubbi-oss/testsub1", PRIORITY_PUSH, False),
+        ("orga/added", PRIORITY_INSTALLATION, False),
+        ("orga/extra", PRIORITY_INSTALLATION, False),
+        ("orga/removed", PRIORITY_INSTALLATION, True),
+    ]
+
+
+@mock.patch("zubbi.scraper.main.update_tenants", return_value=[])
+@mock.patch("zubbi.scraper.main.GitRepo.stored_repo_map")
+def test_stored_tenant_diff(stored_repo_map_mock, update_tenants_mock):
+    tenant_parser = TenantParser(
+        sources_file="tests/testdata/tenant_configs/tenant-config.yaml"
     )
+    tenant_parser.refresh()
+
+    # The tenant sources changed while the scraper was down
+    stored_repo_map = copy.deepcopy(tenant_parser.repo_map)
+    del stored_repo_map["orga2/repo3"]
+    stored_repo_map["orga/removed"] = {
+        "tenants": {"jobs": ["foo"], "roles": ["foo"]},
+        "connection_name": "github",
+    }
+    stored_repo_map["orga1/repo2"]["tenants"]["jobs"] = ["bar"]
+    del stored_repo_map["orga1/repo1"]["tenants"]["extra_config_paths"]
+    # Repos which were stored without tenant config are considered unchanged
+    stored_repo_map["orga1/repo3"] = None
+    stored_repo_map_mock.return_value = stored_repo_map
+
+    scrape_queue = ScrapeQueue()
+    apply_tenant_diff(stored_tenant_diff(tenant_parser), tenant_parser, scrape_queue)
+
+    update_tenants_mock.assert_called_once_with(
+        ["orga1/repo2"], tenant_parser.repo_map, None
+    )
+    assert _pop_all(scrape_queue) == [
+        ("orga2/repo3", PRIORITY_INSTALLATION, False),
+        ("orga1/repo1", PRIORITY_INSTALLATION, False),
+        ("orga/removed", PRIORITY_INSTALLATION, True),
+    ]
 
 
 @mock.patch("zubbi.scraper.connections.github.GitHubConnection._prime_install_map")
@@ -134,9 +269,8 @@ def test_event_push_missing_repo(
     event_push(
         payload_webhook_push,
         patched_connections,
-        reusable_repos=[],
         tenant_parser=None,
-        repo_cache=None,
+        scrape_queue=ScrapeQueue(),
     )
 
     # As we did not add the required repository to our GitHub connection, it should
@@ -144,23 +278,80 @@ def test_event_push_missing_repo(
     assert scrape_reprime.call_count == 1
 
 
-@mock.patch("zubbi.scraper.main.scrape_repo_list")
-def test_event_push_invalid_branch(
-    scrape_mock, patched_connections, payload_webhook_push
-):
+def test_event_push_invalid_branch(patched_connections, payload_webhook_push):
     # Ensure that the repository from the payload is part of our GitHub connection and has
     # a default branch other than "master".
     gh_con = patched_connections.get("github")
     gh_con.installation_map = {"zubbi-oss/testsub1": {"default_branch": "not-master"}}
 
+    scrape_queue = ScrapeQueue()
     event_push(
         payload_webhook_push,
         patched_connections,
-        reusable_repos=[],
         tenant_parser=None,
-        repo_cache=None,
+        scrape_queue=scrape_queue,
     )
 
     # As the branch from the payload is different from the default branch we defined above,
-    # the event shouldn't be handled, and thus the scrape method shouldn't have been called.
-    assert not scrape_mock.called
+    # the event shouldn't be handled, and thus nothing should have been queued.
+    assert len(scrape_queue) == 0
+
+
+@pytest.mark.parametrize(
+    "ref_name, connection_name, expected",
+    [
+        ("refs/heads/master", "gerrit", [("orga/repo1", PRIORITY_PUSH, False)]),
+        # Older Gerrit versions send the plain branch name
+        ("master", "gerrit", [("orga/repo1", PRIORITY_PUSH, False)]),
+        ("refs/heads/feature", "gerrit", []),
+        ("refs/changes/01/1/1", "gerrit", []),
+        # The repo is scraped via another connection
+        ("refs/heads/master", "other-gerrit", []),
+    ],
+)
+def test_event_gerrit_ref_updated(ref_name, connection_name, expected):
+    tenant_parser = mock.Mock(spec=TenantParser)
+    tenant_parser.sources_repo = None
+    tenant_parser.repo_map = {
+        "orga/repo1": {"tenants": {}, "connection_name": "gerrit"},
+    }
+    payload = {
+        "type": "ref-updated",
+        "refUpdate": {
+            "oldRev": "a" * 40,
+            "newRev": "b" * 40,
+            "refName": ref_name,
+            "project": "orga/repo1",
+        },
+        "connection_name": connection_name,
+    }
+
+    scrape_queue = ScrapeQueue()
+    event_gerrit_ref_updated(
+        payload, connections={}, tenant_parser=tenant_parser, scrape_queue=scrape_queue
+    )
+    assert _pop_all(scrape_queue) == expected
+
+    # Unknown repos are not scraped at all
+    payload["refUpdate"]["project"] = "orga/unknown"
+    event_gerrit_ref_updated(
+        payload, connections={}, tenant_parser=tenant_parser, scrape_queue=scrape_queue
+    )
+    assert len(scrape_queue) == 0
+
+
+@mock.patch("zubbi.scraper.main.handle_event")
+def test_receive_duplicate_delivery(handle_event_mock):
+    payload = json.dumps({"ref": "refs/heads/master", "delivery_id": "foo"})
+    message = (b"push", payload.encode("utf-8"))
+    socket = mock.Mock()
+    socket.poll.return_value = True
+    socket.recv_multipart.side_effect = [message, message, zmq.error.Again()]
+
+    scrape_queue = ScrapeQueue()
+    receive_events(socket, 10, {}, None, scrape_queue)
+
+    # The redelivered event is skipped, and the delivery ID is not passed on
+    handle_event_mock.assert_called_once_with(
+        "push", {"ref": "refs/heads/master"}, {}, None, scrape_queue
+    )
@@ -0,0 +1,62 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from zubbi.scraper.fetch_pool import FetchPool
+
+
+def test_prefetch_and_take():
+    pool = FetchPool(2)
+    repos = {name: mock.Mock(name=name) for name in ("foo", "bar", "baz")}
+    for name, repo in repos.items():
+        pool.prefetch(name, lambda repo=repo: repo)
+
+    # Only as many repos as the pool size are prefetched
+    assert "baz" not in pool
+    assert pool.take("foo") is repos["foo"]
+    assert pool.take("foo") is None
+    assert pool.take("baz") is None
+    pool.shutdown()
+
+
+def test_outdated_prefetch():
+    pool = FetchPool(2)
+    old_repo, new_repo = mock.Mock(), mock.Mock()
+    pool.prefetch("foo", lambda: old_repo, token=1)
+    # The same token doesn't prefetch the repo again
+    pool.prefetch("foo", lambda: new_repo, token=1)
+    pool.prefetch("bar", mock.Mock, token=1)
+    # A new token replaces the outdated repo
+    pool.prefetch("foo", lambda: new_repo, token=2)
+    assert pool.take("foo") is new_repo
+
+    # Discarded repos are closed
+    pool.retain(["foo"])
+    assert "bar" not in pool
+    pool.shutdown()
+    assert old_repo.close.called
+    assert not new_repo.close.called
+
+
+def test_failed_prefetch():
+    pool = FetchPool(1)
+
+    def _fail():
+        raise RuntimeError("Clone failed")
+
+    pool.prefetch("foo", _fail)
+    # The caller has to create the repo itself
+    assert pool.take("foo") is None
+    pool.shutdown()
@@ -0,0 +1,70 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from unittest import mock
+
+from zubbi.scraper.gerrit_events import GerritEventStream
+from zubbi.scraper.main import create_zmq_socket, receive_events
+from zubbi.scraper.tenant_parser import TenantParser
+from zubbi.scraper.work_queue import PRIORITY_PUSH, ScrapeQueue
+
+
+def _ref_updated(project, ref_name):
+    return {
+        "type": "ref-updated",
+        "refUpdate": {
+            "oldRev": "a" * 40,
+            "newRev": "b" * 40,
+            "refName": ref_name,
+            "project": project,
+        },
+    }
+
+
+def test_event_stream(tmp_path):
+    # A local file serves as stand-in for Gerrit's SSH event stream
+    events_file = tmp_path / "events.json"
+    events = [
+        {"type": "patchset-created", "project": "orga/repo2"},
+        "not a json event",
+        _ref_updated("orga/repo1", "refs/heads/master"),
+    ]
+    events_file.write_text(
+        "\n".join(e if isinstance(e, str) else json.dumps(e) for e in events) + "\n"
+    )
+
+    tenant_parser = mock.Mock(spec=TenantParser)
+    tenant_parser.sources_repo = None
+    tenant_parser.repo_map = {
+        "orga/repo1": {"tenants": {}, "connection_name": "gerrit"},
+        "orga/repo2": {"tenants": {}, "connection_name": "gerrit"},
+    }
+    scrape_queue = ScrapeQueue()
+
+    socket = create_zmq_socket(None, 10, local_events=True)
+    event_stream = GerritEventStream(
+        "gerrit", ["cat", str(events_file)], retry_delay=60
+    )
+    event_stream.start()
+    try:
+        receive_events(socket, 10, {}, tenant_parser, scrape_queue)
+    finally:
+        event_stream.stop()
+        socket.close()
+
+    # Only the ref update is forwarded to the scraper
+    request = scrape_queue.pop()
+    assert (request.repo_name, request.priority) == ("orga/repo1", PRIORITY_PUSH)
+    assert len(scrape_queue) == 0
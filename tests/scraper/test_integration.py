@@ -15,6 +15,7 @@
 from unittest import mock
 
 from zubbi.scraper.exceptions import CheckoutError
+from zubbi.scraper.repo_parser import RepoParser
 from zubbi.scraper.repos.github import GitHubRepository
 from zubbi.scraper.scraper import REPO_ROOT, Scraper
 from zubbi.scraper.tenant_parser import TenantParser
@@ -327,6 +328,87 @@ def test_scrape():
         assert (job_files, role_files) == expected[repo]
 
 
+def test_scrape_required_info_only():
+    requests = []
+
+    class CountingRepository(MockGitHubRepository):
+        # Each of those methods results in (at least) one GitHub API request
+        def directory_contents(self, directory_path):
+            requests.append(("directory_contents", directory_path))
+            return super().directory_contents(directory_path)
+
+        def file_contents(self, file_path):
+            requests.append(("file_contents", file_path))
+            return super().file_contents(file_path)
+
+        def last_changed(self, path):
+            requests.append(("last_changed", path))
+            return super().last_changed(path)
+
+        def blame(self, path):
+            requests.append(("blame", path))
+            return super().blame(path)
+
+    gh_repo = CountingRepository("orga1/repo1")
+    Scraper(gh_repo).scrape()
+    all_requests = list(requests)
+
+    requests.clear()
+    job_files, role_files = Scraper(
+        gh_repo, item_info=RepoParser.required_info
+    ).scrape()
+
+    # The last change of a job file is not used by the parser
+    assert sorted(job_files["zuul.d/jobs.yaml"]) == ["blame", "content"]
+    assert "last_changed" in role_files["docker-run"]
+    assert ("last_changed", "zuul.d/jobs.yaml") in all_requests
+    assert ("last_changed", "zuul.d/jobs.yaml") not in requests
+    assert len(requests) == len(all_requests) - 1
+
+
+def test_scrape_changed_paths():
+    gh_repo = MockGitHubRepository("orga1/repo2")
+    known_roles = {
+        "bar": "sha-bar",
+        "empty-dir": "sha-empty-dir",
+        "foo": "sha-foo",
+        "foobar": "sha-foobar",
+        "foobaz/baz": "sha-foobaz-baz",
+    }
+    scraper = Scraper(gh_repo, known_roles=known_roles)
+    job_files, role_files = scraper.scrape(
+        ["README.md", "roles/foo/README.md", "roles/foobaz/baz/vars/main.yaml"]
+    )
+
+    # Only the affected roles are scraped, the others are unchanged
+    assert job_files == {}
+    assert sorted(role_files) == ["foo", "foobaz/baz"]
+    assert sorted(scraper.unchanged_roles) == ["bar", "empty-dir", "foobar"]
+
+    # A new role requires to scrape the whole repository
+    scraper = Scraper(gh_repo, known_roles=known_roles)
+    assert scraper.affected_by(["roles/new/tasks/main.yaml"]) is None
+
+
+def test_scrape_changed_paths_removed_file():
+    gh_repo = MockGitHubRepository("orga1/repo1")
+    known_job_files = {"zuul.d/jobs.yaml": "sha-jobs", "zuul.d/old.yaml": "sha-old"}
+    scraper = Scraper(
+        gh_repo, known_job_files=known_job_files, known_roles={"docker-run": "sha"}
+    )
+    job_files, role_files = scraper.scrape(["zuul.d/jobs.yaml", "zuul.d/old.yaml"])
+
+    # The removed file is neither scraped nor unchanged, so its jobs are
+    # deleted afterwards.
+    assert list(job_files) == ["zuul.d/jobs.yaml"]
+    assert role_files == {}
+    assert scraper.unchanged_job_files == {}
+    assert scraper.unchanged_roles == {"docker-run": "sha"}
+
+    # A new zuul config location requires to scrape the whole repository
+    assert scraper.affected_by([".zuul.yaml"]) is None
+
+
 def test_scrape_not_github():
     tenant_parser = TenantParser(sources_file="tests/testdata/test.bar.yaml")
     tenant_parser.parse()
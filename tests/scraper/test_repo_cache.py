@@ -0,0 +1,296 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from elasticsearch.exceptions import ApiError
+
+from zubbi.scraper.connections.gerrit import ProjectHeads
+from zubbi.scraper.main import _scrape_repo_map, queue_moved, queue_outdated
+from zubbi.scraper.repo_cache import RepoCache
+from zubbi.scraper.work_queue import ScrapeQueue
+
+NOW = datetime(2018, 9, 17, 15, 15, 15, tzinfo=timezone.utc)
+
+
+def test_pop_due():
+    repo_cache = RepoCache(timedelta(hours=24))
+    repo_cache.update("orga/repo1", NOW - timedelta(hours=30), "github")
+    repo_cache.update("orga/repo2", NOW - timedelta(hours=2), "github")
+    repo_cache.update("orga/repo3", NOW - timedelta(hours=25), "github")
+    # Repos without a provider are never scraped periodically
+    repo_cache.update("orga/repo4", NOW - timedelta(hours=48))
+
+    assert repo_cache.pop_due(NOW) == ["orga/repo1", "orga/repo3"]
+    # The due repos are scheduled again, in case they are not scraped
+    assert repo_cache.pop_due(NOW) == []
+    assert repo_cache.seconds_until_due(NOW) == 22 * 3600
+    assert repo_cache.pop_due(NOW + timedelta(hours=24)) == [
+        "orga/repo2",
+        "orga/repo1",
+        "orga/repo3",
+    ]
+
+
+def test_update_reschedules():
+    repo_cache = RepoCache(timedelta(hours=24))
+    repo_cache.update("orga/repo1", NOW - timedelta(hours=30), "github")
+    repo_cache.update("orga/repo2", NOW - timedelta(hours=20), "github")
+
+    # A scrape (e.g. due to a push event) moves the next periodic scrape
+    repo_cache.update("orga/repo1", NOW)
+    assert repo_cache.get("orga/repo1").provider == "github"
+    assert repo_cache.pop_due(NOW) == []
+    assert repo_cache.seconds_until_due(NOW) == 4 * 3600
+
+    repo_cache.remove("orga/repo2")
+    assert "orga/repo2" not in repo_cache
+    assert repo_cache.seconds_until_due(NOW) == 24 * 3600
+    assert repo_cache.pop_due(NOW + timedelta(hours=25)) == ["orga/repo1"]
+
+
+def test_empty_cache():
+    repo_cache = RepoCache()
+    assert repo_cache.seconds_until_due() is None
+    assert repo_cache.pop_due() == []
+    assert len(repo_cache) == 0
+
+
+def test_queue_outdated():
+    repo_cache = RepoCache(timedelta(hours=24))
+    now = datetime.now(timezone.utc)
+    repo_cache.update("orga/repo1", now - timedelta(hours=30), "github")
+    repo_cache.update("orga/repo2", now - timedelta(hours=2), "github")
+
+    scrape_queue = ScrapeQueue()
+    queue_outdated({"FORCE_SCRAPE_INTERVAL": 24}, repo_cache, scrape_queue)
+
+    assert len(scrape_queue) == 1
+    assert "orga/repo1" in scrape_queue
+
+
+def test_queue_moved():
+    repo_cache = RepoCache(timedelta(hours=24))
+    for repo_name, head_sha in [
+        ("orga/moved", "a" * 40),
+        ("orga/unchanged", "b" * 40),
+        ("orga/rescraped", "a" * 40),
+    ]:
+        repo_cache.update(
+            repo_name, NOW - timedelta(hours=1), "gerrit", head_sha=head_sha
+        )
+    # This repo was scraped after the HEADs were listed
+    repo_cache.update("orga/rescraped", NOW + timedelta(minutes=1))
+
+    gerrit_con = mock.Mock()
+    gerrit_con.get_head_shas.return_value = ProjectHeads(
+        "master",
+        {
+            "orga/moved": "c" * 40,
+            "orga/unchanged": "b" * 40,
+            "orga/rescraped": "c" * 40,
+            "orga/unknown": "c" * 40,
+        },
+        NOW,
+    )
+    tenant_parser = mock.Mock()
+    tenant_parser.repo_map = {
+        repo_name: {"connection_name": "gerrit"}
+        for repo_name in ["orga/moved", "orga/unchanged", "orga/rescraped"]
+    }
+    # Connections without a bulk listing are skipped
+    connections = {"gerrit": gerrit_con, "git": object()}
+
+    scrape_queue = ScrapeQueue()
+    list_times = {}
+    queue_moved(connections, tenant_parser, repo_cache, scrape_queue, list_times)
+    assert len(scrape_queue) == 1
+    assert "orga/moved" in scrape_queue
+    assert list_times == {"gerrit": NOW}
+
+    # The same listing isn't checked again
+    scrape_queue = ScrapeQueue()
+    tenant_parser.repo_map = mock.MagicMock(wraps=tenant_parser.repo_map)
+    queue_moved(connections, tenant_parser, repo_cache, scrape_queue, list_times)
+    assert len(scrape_queue) == 0
+    tenant_parser.repo_map.items.assert_not_called()
+
+    # A new listing is checked again
+    gerrit_con.get_head_shas.return_value = ProjectHeads(
+        "master", {"orga/unchanged": "d" * 40}, NOW + timedelta(minutes=5)
+    )
+    queue_moved(connections, tenant_parser, repo_cache, scrape_queue, list_times)
+    assert len(scrape_queue) == 1
+    assert "orga/unchanged" in scrape_queue
+
+
+def test_jitter_spreads_due_times():
+    interval = timedelta(hours=24)
+    repo_cache = RepoCache(interval, jitter=0.5)
+    repo_names = ["orga/repo{}".format(i) for i in range(100)]
+    # All repos were scraped at the same time, e.g. during a full scrape
+    for repo_name in repo_names:
+        repo_cache.update(repo_name, NOW, "github")
+
+    due_times = [repo_cache.get(r).due for r in repo_names]
+    assert all(NOW + interval / 2 <= due <= NOW + interval for due in due_times)
+    # The due times are spread over the whole jitter range
+    due_hours = {int((due - NOW).total_seconds() // 3600) for due in due_times}
+    assert due_hours == set(range(12, 24))
+
+    # The offset is the same for another instance of the cache
+    other_cache = RepoCache(interval, jitter=0.5)
+    other_cache.update("orga/repo1", NOW, "github")
+    assert other_cache.get("orga/repo1").due == repo_cache.get("orga/repo1").due
+
+
+def test_jitter_keeps_phase():
+    interval = timedelta(hours=24)
+    repo_cache = RepoCache(interval, jitter=0.5)
+    repo_names = ["orga/repo{}".format(i) for i in range(20)]
+    for repo_name in repo_names:
+        repo_cache.update(repo_name, NOW, "github")
+
+    # Simulate the main loop over several intervals
+    scrape_times = {repo_name: [] for repo_name in repo_names}
+    now = NOW
+    while now < NOW + 5 * interval:
+        for repo_name in repo_cache.pop_due(now):
+            scrape_times[repo_name].append(now)
+            repo_cache.update(repo_name, now)
+        now += timedelta(minutes=10)
+
+    # Each repo keeps its phase, so it's scraped once per interval
+    for times in scrape_times.values():
+        assert len(times) >= 4
+        for previous, current in zip(times, times[1:]):
+            assert interval - timedelta(minutes=10) <= current - previous <= interval
+
+
+def test_limit_per_window():
+    repo_cache = RepoCache(timedelta(hours=24), limit=2, window=timedelta(minutes=5))
+    for i in range(5):
+        repo_cache.update("orga/repo{}".format(i), NOW - timedelta(days=2), "github")
+
+    assert repo_cache.pop_due(NOW) == ["orga/repo0", "orga/repo1"]
+    # Further repos are postponed to the next window
+    assert repo_cache.pop_due(NOW + timedelta(minutes=1)) == []
+    assert repo_cache.seconds_until_due(NOW + timedelta(minutes=1)) == 4 * 60
+    assert repo_cache.pop_due(NOW + timedelta(minutes=5)) == [
+        "orga/repo2",
+        "orga/repo3",
+    ]
+    assert repo_cache.pop_due(NOW + timedelta(minutes=10)) == ["orga/repo4"]
+
+
+def test_individual_interval():
+    repo_cache = RepoCache(timedelta(hours=24))
+    repo_cache.update("orga/active", NOW, "github", interval=timedelta(hours=12))
+    repo_cache.update("orga/dormant", NOW, "github", interval=timedelta(days=10))
+    repo_cache.update("orga/unknown", NOW, "github")
+
+    assert repo_cache.pop_due(NOW + timedelta(hours=12)) == ["orga/active"]
+    assert repo_cache.pop_due(NOW + timedelta(hours=24)) == [
+        "orga/active",
+        "orga/unknown",
+    ]
+    # The interval is kept when the repo is updated without one
+    repo_cache.update("orga/dormant", NOW + timedelta(days=1))
+    assert repo_cache.get("orga/dormant").due == NOW + timedelta(days=11)
+
+
+@mock.patch("zubbi.scraper.main.delete_outdated")
+@mock.patch("zubbi.scraper.main.ZuulTenant.bulk_save")
+def test_skip_unchanged_repos(tenant_save_mock, delete_mock):
+    scrape_time = datetime.now(timezone.utc)
+    changed_at = scrape_time - timedelta(days=4)
+    repo_cache = RepoCache(timedelta(hours=24))
+    for repo_name in ["orga/unchanged", "orga/changed"]:
+        repo_cache.update(
+            repo_name,
+            scrape_time - timedelta(days=1),
+            "github",
+            head_sha="abc",
+            changed_at=changed_at,
+        )
+
+    con = mock.Mock()
+    con.get_head_sha.side_effect = lambda repo_name: {
+        "orga/unchanged": "abc",
+        "orga/changed": "def",
+    }[repo_name]
+    engine = mock.Mock()
+    engine.touch.return_value = timedelta(days=2)
+    engine.scrape.return_value = {}
+    repo_map = {
+        "orga/unchanged": {"tenants": {}, "connection_name": "github"},
+        "orga/changed": {"tenants": {}, "connection_name": "github"},
+    }
+
+    _scrape_repo_map(
+        repo_map,
+        [],
+        {"github": con},
+        [],
+        scrape_time,
+        repo_cache,
+        delete_only=False,
+        engine=engine,
+        skip_unchanged=True,
+    )
+
+    # Only the changed repo is scraped, the other one is just touched
+    engine.touch.assert_called_once_with("orga/unchanged", scrape_time, changed_at)
+    assert list(engine.scrape.call_args[0][0].keys()) == ["orga/changed"]
+    assert repo_cache.get("orga/unchanged").interval == timedelta(days=2)
+
+
+@mock.patch("zubbi.scraper.main.delete_outdated")
+@mock.patch("zubbi.scraper.main.ZuulTenant.bulk_save")
+def test_skip_unchanged_repos_touch_failed(tenant_save_mock, delete_mock):
+    scrape_time = datetime.now(timezone.utc)
+    repo_cache = RepoCache(timedelta(hours=24))
+    repo_cache.update(
+        "orga/unchanged",
+        scrape_time - timedelta(days=1),
+        "github",
+        head_sha="abc",
+        changed_at=scrape_time - timedelta(days=4),
+    )
+
+    con = mock.Mock()
+    con.get_head_sha.return_value = "abc"
+    engine = mock.Mock()
+    engine.touch.side_effect = ApiError("Timeout", meta=None, body=None)
+    # The scraping fails as well
+    engine.scrape.return_value = {}
+
+    _scrape_repo_map(
+        {"orga/unchanged": {"tenants": {}, "connection_name": "github"}},
+        [],
+        {"github": con},
+        [],
+        scrape_time,
+        repo_cache,
+        delete_only=False,
+        engine=engine,
+        skip_unchanged=True,
+    )
+
+    # The repo is scraped instead, but its data must be kept
+    assert list(engine.scrape.call_args[0][0].keys()) == ["orga/unchanged"]
+    for call in delete_mock.call_args_list:
+        terms = call[1]["extra_filter"].to_dict()["terms"]
+        assert list(terms.values()) == [[]]
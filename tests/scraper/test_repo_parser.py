@@ -14,6 +14,7 @@
 
 from datetime import datetime, timezone
 
+from zubbi.models import ZuulJob
 from zubbi.scraper.repo_parser import RepoParser
 
 JOB_1_SHA = "83bf1474a8a84cc1dddc8da435e2e4d9f4bbdeb1"
@@ -58,6 +59,7 @@ def test_parse(repo_data):
         "description_html": "<p>This is just a job for testing purposes.</p>\n",
         "parent": "cool-base-job",
         "url": "https://github/zuul.d/jobs.yaml",
+        "file_path": "zuul.d/jobs.yaml",
         "private": False,
         "platforms": ["linux"],
         "reusable": True,
@@ -75,6 +77,7 @@ def test_parse(repo_data):
         "description_html": "<p>This time without a playbook and a parent.</p>\n",
         "parent": "base",
         "url": "https://github/zuul.d/jobs.yaml",
+        "file_path": "zuul.d/jobs.yaml",
         "private": False,
         "platforms": [],
         "reusable": False,
@@ -92,6 +95,7 @@ def test_parse(repo_data):
         "description_html": "<p>This is a base job with explicitly no parent.</p>\n",
         "parent": None,
         "url": "https://github/zuul.d/jobs.yaml",
+        "file_path": "zuul.d/jobs.yaml",
         "private": False,
         "platforms": [],
         "reusable": False,
@@ -107,6 +111,7 @@ def test_parse(repo_data):
         "tenants": ["foo"],
         "parent": None,
         "url": "https://github/zuul.d/jobs.yaml",
+        "file_path": "zuul.d/jobs.yaml",
         "private": False,
         "reusable": False,
         "line_start": 23,
@@ -123,6 +128,7 @@ def test_parse(repo_data):
         "description_html": "<p>Job in custom directory, without a playbook or parent.</p>\n",
         "parent": "base",
         "url": "https://github/zuul-extra.d/extra-jobs.yaml",
+        "file_path": "zuul-extra.d/extra-jobs.yaml",
         "private": False,
         "platforms": [],
         "reusable": False,
@@ -290,3 +296,26 @@ def test_parse_reusable_repo(repo_data):
     assert job_4.to_dict(skip_empty=False)["reusable"]
     assert role_1.to_dict(skip_empty=False)["reusable"]
     assert role_2.to_dict(skip_empty=False)["reusable"]
+
+
+def test_parse_overlapping_extra_config_paths(repo_data):
+    repo, tenants, job_files, role_files = repo_data
+    # Both paths contain the extra jobs, the first one wins
+    tenants = dict(
+        tenants, extra_config_paths={"zuul-extra.d": ["bar"], "zuul-extra": ["baz"]}
+    )
+    file_path = "zuul-extra.d/extra-jobs.yaml"
+
+    jobs, _ = RepoParser(
+        repo,
+        tenants,
+        {file_path: job_files[file_path]},
+        {},
+        datetime.now(timezone.utc),
+        is_reusable_repo=False,
+    ).parse()
+
+    assert {tuple(job.tenants) for job in jobs} == {("bar",)}
+    # Updating the tenants in place must result in the same tenants
+    params = ZuulJob._tenant_params(tenants, [file_path])
+    assert params["file_tenants"] == {file_path: ["bar"]}
@@ -0,0 +1,64 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+import pytest
+
+from zubbi.scraper.exceptions import ScraperConfigurationError
+from zubbi.scraper.main import scrape_repo_list
+from zubbi.scraper.shard import Shard
+from zubbi.scraper.tenant_parser import TenantParser
+
+REPO_NAMES = ["orga{}/repo{}".format(i % 7, i) for i in range(200)]
+
+
+@pytest.mark.parametrize("index, count", [(0, 0), (-1, 2), (2, 2)])
+def test_invalid_shard(index, count):
+    with pytest.raises(ScraperConfigurationError):
+        Shard(index, count)
+
+
+def test_single_shard_owns_everything():
+    shard = Shard()
+    assert shard.filter(REPO_NAMES) == REPO_NAMES
+
+
+def test_each_repo_owned_by_one_shard():
+    shards = [Shard(i, 3) for i in range(3)]
+    owned = [shard.filter(REPO_NAMES) for shard in shards]
+
+    # Every repo is owned by exactly one shard
+    assert sorted(sum(owned, [])) == sorted(REPO_NAMES)
+    for shard, repos in zip(shards, owned):
+        assert all(shard.owner(repo) == shard.index for repo in repos)
+        # The repos should be roughly distributed evenly
+        assert len(repos) > len(REPO_NAMES) / 3 * 0.7
+
+
+@mock.patch("zubbi.scraper.main._scrape_repo_map")
+def test_scrape_repo_list_skips_foreign_repos(scrape_mock):
+    tenant_parser = TenantParser(
+        sources_file="tests/testdata/tenant_configs/tenant-config.yaml"
+    )
+    tenant_parser.parse()
+    repo_list = list(tenant_parser.repo_map.keys())
+    shard = Shard(1, 2)
+
+    scrape_repo_list(repo_list, {}, [], tenant_parser, shard=shard)
+
+    # Only the own repos are scraped and nothing is deleted
+    assert scrape_mock.call_count == 1
+    scraped_repos = list(scrape_mock.call_args[0][0].keys())
+    assert scraped_repos == shard.filter(repo_list)
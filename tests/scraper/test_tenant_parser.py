@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+from unittest import mock
+
 from zubbi.scraper.tenant_parser import TenantParser
 
 
@@ -57,3 +60,66 @@ def test_parse():
     tenant_parser.parse()
 
     assert tenant_parser.repo_map == expected_repo_map
+
+
+def test_refresh_only_parses_changed_sources(tmp_path):
+    sources_file = tmp_path / "tenant-config.yaml"
+    sources_file.write_text(
+        open("tests/testdata/tenant_configs/tenant-config.yaml").read()
+    )
+    tenant_parser = TenantParser(sources_file=str(sources_file))
+
+    diff = tenant_parser.refresh()
+    assert "orga1/repo1" in diff.added
+    assert "orga1/repo1" in tenant_parser.repo_map
+    # Without any change, the sources are neither reloaded nor parsed again
+    with mock.patch.object(tenant_parser, "parse") as parse_mock:
+        assert tenant_parser.refresh() is None
+        assert parse_mock.call_count == 0
+
+    # Touching the file without changing its content doesn't trigger a re-parse
+    os.utime(sources_file, ns=(0, 0))
+    assert tenant_parser.refresh() is None
+
+    sources_file.write_text(
+        "- tenant:\n"
+        "    name: foo\n"
+        "    source:\n"
+        "      github:\n"
+        "        untrusted-projects:\n"
+        "          - orga1/repo2\n"
+        "          - orga2/repo2\n"
+        "          - orga3/repo1\n"
+    )
+    diff = tenant_parser.refresh()
+    assert list(tenant_parser.repo_map) == ["orga1/repo2", "orga2/repo2", "orga3/repo1"]
+    assert diff.added == ["orga3/repo1"]
+    assert diff.removed == [
+        "orga1/repo1",
+        "orga1/repo3",
+        "orga1/repo4",
+        "orga2/repo1",
+        "orga2/repo3",
+    ]
+    # The repo is still part of tenant foo, but no longer of tenant bar
+    assert diff.changed == ["orga2/repo2"]
+    assert diff.tenants_removed == ["bar"]
+
+
+def test_refresh_sources_repo():
+    sources_repo = mock.Mock(repo_name="orga/tenant-sources")
+    sources_repo.head_sha.return_value = "abc"
+    with mock.patch.object(
+        TenantParser, "_load_tenant_sources_from_repo", return_value=[]
+    ) as load_mock:
+        tenant_parser = TenantParser(sources_repo=sources_repo)
+        assert tenant_parser.refresh() is not None
+        # The repo is only checked when we are told to fetch it
+        assert tenant_parser.refresh() is None
+        assert tenant_parser.refresh(fetch=True) is None
+        assert load_mock.call_count == 1
+
+        sources_repo.head_sha.return_value = "def"
+        assert tenant_parser.refresh(fetch=True) is not None
+        assert load_mock.call_count == 2
+        assert sources_repo.refresh.call_count == 2
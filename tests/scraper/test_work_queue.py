@@ -0,0 +1,160 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from unittest import mock
+
+from zubbi.scraper.main import report_queue_depth
+from zubbi.scraper.shard import Shard
+from zubbi.scraper.work_queue import (
+    PRIORITY_INSTALLATION,
+    PRIORITY_PERIODIC,
+    PRIORITY_PUSH,
+    ScrapeQueue,
+)
+
+
+def test_priority_order():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/periodic1", "orga/periodic2"], PRIORITY_PERIODIC)
+    scrape_queue.put(["orga/installation"], PRIORITY_INSTALLATION)
+    scrape_queue.put(["orga/push"], PRIORITY_PUSH)
+
+    repo_names = []
+    while scrape_queue:
+        repo_names.append(scrape_queue.pop().repo_name)
+
+    # Requests with the same priority keep their order
+    assert repo_names == [
+        "orga/push",
+        "orga/installation",
+        "orga/periodic1",
+        "orga/periodic2",
+    ]
+    assert scrape_queue.pop() is None
+
+
+def test_coalescing():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1", "orga/repo2"], PRIORITY_PERIODIC)
+    # A burst of pushes results in a single request with the best priority
+    for _ in range(5):
+        scrape_queue.put(["orga/repo2"], PRIORITY_PUSH)
+    # A lower priority doesn't downgrade a pending request
+    scrape_queue.put(["orga/repo2"], PRIORITY_PERIODIC)
+
+    assert len(scrape_queue) == 2
+    assert scrape_queue.depth() == {"push": 1, "installation": 0, "periodic": 1}
+
+    request = scrape_queue.pop()
+    assert request.repo_name == "orga/repo2"
+    assert request.priority == PRIORITY_PUSH
+    assert scrape_queue.pop().repo_name == "orga/repo1"
+    assert scrape_queue.pop() is None
+
+
+def test_coalescing_keeps_latest_action():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1"], PRIORITY_INSTALLATION)
+    scrape_queue.put(["orga/repo1"], PRIORITY_INSTALLATION, delete_only=True)
+
+    request = scrape_queue.pop()
+    assert request.delete_only is True
+    assert scrape_queue.pop() is None
+
+
+def test_coalescing_paths():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1"], PRIORITY_PUSH, paths=["zuul.yaml"])
+    scrape_queue.put(["orga/repo1"], PRIORITY_PUSH, paths=["roles/foo/README.md"])
+    scrape_queue.put(["orga/repo2"], PRIORITY_PUSH, paths=["zuul.yaml"])
+    # A request without paths covers the whole repository
+    scrape_queue.put(["orga/repo2"], PRIORITY_PERIODIC)
+
+    request = scrape_queue.pop()
+    assert request.paths == {"zuul.yaml", "roles/foo/README.md"}
+    assert scrape_queue.pop().paths is None
+
+
+def test_pop_batch():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1", "orga/repo2", "orga/repo3"], PRIORITY_PUSH)
+    scrape_queue.put(["orga/repo4"], PRIORITY_PUSH, delete_only=True)
+    scrape_queue.put(["orga/repo5"], PRIORITY_PERIODIC)
+
+    batch = scrape_queue.pop_batch(2)
+    assert [r.repo_name for r in batch] == ["orga/repo1", "orga/repo2"]
+    # A batch never mixes different priorities or actions
+    batch = scrape_queue.pop_batch(10)
+    assert [r.repo_name for r in batch] == ["orga/repo3"]
+    batch = scrape_queue.pop_batch(10)
+    assert [r.repo_name for r in batch] == ["orga/repo4"]
+    batch = scrape_queue.pop_batch(10)
+    assert [r.repo_name for r in batch] == ["orga/repo5"]
+    assert scrape_queue.pop_batch(10) == []
+
+
+def test_upcoming():
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1", "orga/repo2", "orga/repo3"], PRIORITY_PERIODIC)
+    scrape_queue.put(["orga/repo3"], PRIORITY_PUSH)
+
+    upcoming = scrape_queue.upcoming(2)
+    assert [r.repo_name for r in upcoming] == ["orga/repo3", "orga/repo1"]
+    # The coalesced request got a new revision
+    assert [r.revision for r in upcoming] == [1, 0]
+    # The requests are still pending
+    assert len(scrape_queue) == 3
+    assert scrape_queue.pop() is upcoming[0]
+
+
+def test_duplicate_deliveries():
+    scrape_queue = ScrapeQueue(delivery_cache_size=2)
+    assert scrape_queue.is_duplicate(None) is False
+    assert scrape_queue.is_duplicate("delivery-1") is False
+    assert scrape_queue.is_duplicate("delivery-1") is True
+    assert scrape_queue.is_duplicate("delivery-2") is False
+    assert scrape_queue.is_duplicate("delivery-3") is False
+    # The oldest delivery was evicted from the cache
+    assert scrape_queue.is_duplicate("delivery-1") is False
+
+
+def test_foreign_repos_are_not_queued():
+    repo_names = ["orga/repo{}".format(i) for i in range(20)]
+    shard = Shard(0, 2)
+    scrape_queue = ScrapeQueue(shard=shard)
+    scrape_queue.put(repo_names, PRIORITY_PUSH)
+
+    assert len(scrape_queue) == len(shard.filter(repo_names))
+    assert all(repo_name in scrape_queue for repo_name in shard.filter(repo_names))
+
+
+def test_report_queue_depth(caplog):
+    scrape_queue = ScrapeQueue()
+    scrape_queue.put(["orga/repo1"], PRIORITY_PUSH)
+    caplog.set_level(logging.INFO)
+
+    with mock.patch("zubbi.scraper.main.time.monotonic", return_value=100):
+        last_report = report_queue_depth(scrape_queue, None)
+    assert last_report == 100
+    assert "Pending scrape requests" in caplog.text
+
+    # The depth is only reported once per interval
+    caplog.clear()
+    with mock.patch("zubbi.scraper.main.time.monotonic", return_value=130):
+        assert report_queue_depth(scrape_queue, last_report) == 100
+    assert caplog.text == ""
+    with mock.patch("zubbi.scraper.main.time.monotonic", return_value=160):
+        assert report_queue_depth(scrape_queue, last_report) == 160
+    assert "Pending scrape requests" in caplog.text
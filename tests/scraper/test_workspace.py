@@ -0,0 +1,190 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import os
+from pathlib import Path
+
+import pytest
+from git import Repo
+
+from zubbi.scraper.workspace import (
+    LOCKS_DIR,
+    SHARED_OBJECTS_DIR,
+    Workspace,
+    _dir_size,
+    get_workspace,
+)
+
+
+def _create_remote(path, files):
+    repo = Repo.init(path, initial_branch="master")
+    for file_name, content in files.items():
+        (Path(path) / file_name).write_text(content)
+        repo.index.add([file_name])
+    repo.index.commit("Initial commit")
+    return repo
+
+
+def _other_lock_file(workspace, repo_name):
+    # A lock file of its own behaves like the one of another scraper
+    return open(workspace.path / LOCKS_DIR / "{}.lock".format(repo_name), "a")
+
+
+def _count_objects(repo):
+    output = repo.git.count_objects("-v")
+    stats = dict(line.split(": ") for line in output.splitlines())
+    return int(stats["count"]) + int(stats["in-pack"])
+
+
+def test_maintain_shared_objects(tmpdir):
+    remote = _create_remote(tmpdir / "remote", {"README": "Readme", "zuul.yaml": ""})
+    workspace = Workspace(tmpdir / "workspace", shared_objects=True)
+    # Two clones of the same repository share all of their objects
+    clones = [
+        Repo.clone_from(remote.git_dir, workspace.repo_path(repo_name), bare=True)
+        for repo_name in ("orga/foo", "orga/fork")
+    ]
+    assert workspace.repo_names() == ["orga/foo", "orga/fork"]
+
+    workspace.maintain()
+
+    shared_repo = Repo(workspace.path / SHARED_OBJECTS_DIR)
+    # Commit, tree and both files
+    assert _count_objects(shared_repo) == 4
+    for clone in clones:
+        # The clones don't store any objects themselves anymore
+        assert _count_objects(clone) == 0
+        assert clone.git.show("master:README") == "Readme"
+
+    # Maintaining the workspace again doesn't break anything
+    workspace.maintain()
+    assert _count_objects(shared_repo) == 4
+    assert clones[1].git.show("master:README") == "Readme"
+
+
+def test_maintain_without_shared_objects(tmpdir):
+    remote = _create_remote(tmpdir / "remote", {"README": "Readme"})
+    workspace = Workspace(tmpdir / "workspace")
+    clone = Repo.clone_from(remote.git_dir, workspace.repo_path("foo"), bare=True)
+
+    workspace.maintain()
+    assert not (workspace.path / SHARED_OBJECTS_DIR).exists()
+    assert clone.git.show("master:README") == "Readme"
+
+
+def test_evict_least_recently_used(tmpdir):
+    remote = _create_remote(tmpdir / "remote", {"README": "x" * 1000})
+    workspace = Workspace(tmpdir / "workspace")
+    repo_names = ["orga/old", "orga/in-use", "orga/new"]
+    for index, repo_name in enumerate(repo_names):
+        Repo.clone_from(remote.git_dir, workspace.repo_path(repo_name), bare=True)
+        # Ensure distinct access times
+        os.utime(workspace.repo_path(repo_name), (index, index))
+
+    # The workspace is large enough for two clones
+    clone_size = _dir_size(workspace.repo_path("orga/new"))
+    workspace.max_size = int(clone_size * 2.5)
+    workspace.acquire("orga/in-use")
+    workspace.update("orga/new")
+    assert workspace.repo_names() == ["orga/in-use", "orga/new"]
+
+    # Clones in use are never removed
+    workspace.max_size = clone_size
+    workspace.update("orga/new")
+    assert workspace.repo_names() == ["orga/in-use", "orga/new"]
+
+    workspace.release("orga/in-use")
+    workspace.update("orga/new")
+    assert workspace.repo_names() == ["orga/new"]
+
+
+def test_remove(tmpdir):
+    remote = _create_remote(tmpdir / "remote", {"README": "Readme"})
+    workspace = Workspace(tmpdir / "workspace")
+    Repo.clone_from(remote.git_dir, workspace.repo_path("orga/foo"), bare=True)
+
+    workspace.remove("orga/foo")
+    assert workspace.repo_names() == []
+    # The empty parent directory is removed as well
+    assert not (workspace.path / "orga").exists()
+    # Unknown repositories are ignored
+    workspace.remove("orga/bar")
+
+
+def test_lock(tmpdir):
+    workspace = Workspace(tmpdir / "workspace")
+    with workspace.lock("orga/foo") as locked:
+        assert locked
+        # Another lock on the same clone (e.g. from another thread or
+        # process) can't be acquired in the meantime.
+        with workspace.lock("orga/foo", blocking=False) as locked_again:
+            assert not locked_again
+        with workspace.lock("orga/bar", blocking=False) as other_locked:
+            assert other_locked
+    with workspace.lock("orga/foo", blocking=False) as locked:
+        assert locked
+
+
+def test_evict_clone_read_by_other_scraper(tmpdir):
+    remote = _create_remote(tmpdir / "remote", {"README": "x" * 1000})
+    workspace = Workspace(tmpdir / "workspace")
+    for index, repo_name in enumerate(["old", "new"]):
+        Repo.clone_from(remote.git_dir, workspace.repo_path(repo_name), bare=True)
+        os.utime(workspace.repo_path(repo_name), (index, index))
+    workspace.max_size = _dir_size(workspace.repo_path("new"))
+
+    # Another scraper sharing the workspace reads the old clone
+    other = Workspace(workspace.path)
+    other.acquire("old")
+    workspace.update("new")
+    assert workspace.repo_names() == ["new", "old"]
+
+    other.release("old")
+    workspace.update("new")
+    assert workspace.repo_names() == ["new"]
+
+
+def test_acquire_locks_shared(tmpdir):
+    workspace = Workspace(tmpdir / "workspace")
+    workspace.acquire("foo")
+    workspace.acquire("foo")
+    with _other_lock_file(workspace, "foo") as lock_file:
+        # Others might read, but not modify the clone in the meantime
+        fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        # The clone can still be modified by its users within this process
+        with workspace.lock("foo", blocking=False) as locked:
+            assert locked
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        workspace.release("foo")
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        workspace.release("foo")
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_get_workspace(tmpdir):
+    workspace = get_workspace(tmpdir / "workspace", max_size=100)
+    # Connections using the same directory share the workspace
+    same = get_workspace(str(tmpdir / "workspace"), shared_objects=True, max_size=200)
+    assert same is workspace
+    assert workspace.shared_objects
+    assert workspace.max_size == 100
+    assert get_workspace(tmpdir / "other") is not workspace
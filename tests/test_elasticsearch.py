@@ -18,6 +18,13 @@ ES_HOST = "http://127.0.0.1:9200"
 ES_HOST_SSL = "https://127.0.0.1:443"
 
 
+@pytest.fixture(autouse=True)
+def reset_outdated_indices():
+    yield
+    # Other tests must not use the fallback queries for outdated indices
+    zubbi.models.OUTDATED_INDICES.clear()
+
+
 @pytest.fixture()
 def mock_index_prefix():
     # Using a ctx manager allows us to pass different prefix values in each
@@ -122,6 +129,74 @@ def test_elasticsearch_init(elmock):
     assert {"zuul-tenants", "git-repos"} == created_indices
 
 
+@mock.patch("elasticsearch.Elasticsearch")
+def test_elasticsearch_init_outdated_mapping(elmock):
+    existing_indices = {"zuul-jobs", "ansible-roles"}
+    elmock.return_value.indices.exists.side_effect = (
+        lambda index: index in existing_indices
+    )
+    # The existing indices were created with the first mapping version
+    elmock.return_value.indices.get_mapping.side_effect = lambda index: {
+        index: {"mappings": {"properties": {"repo": {"type": "text"}}}}
+    }
+
+    init_elasticsearch_documents(using=elmock())
+
+    # Outdated indices are not closed, so they can still be searched
+    indices = elmock.return_value.indices
+    indices.close.assert_not_called()
+    elmock.return_value.update_by_query.assert_not_called()
+    assert zubbi.models.OUTDATED_INDICES == existing_indices
+    # Only the new fields which don't need the new analyzers are added
+    added = {
+        call.kwargs["index"]: call.kwargs["body"]
+        for call in indices.put_mapping.call_args_list
+    }
+    assert sorted(added) == ["ansible-roles", "zuul-jobs"]
+    job_fields = added["zuul-jobs"]["properties"]
+    assert job_fields["file_path"] == {"type": "keyword"}
+    assert added["ansible-roles"]["properties"]["tree_sha"] == {"type": "keyword"}
+    assert "repo" not in job_fields
+    assert "job_name" not in job_fields
+    assert "_meta" not in added["zuul-jobs"]
+
+
+@mock.patch("elasticsearch.Elasticsearch")
+def test_block_migrate(elmock):
+    existing_indices = {"zuul-jobs", "ansible-roles"}
+    mapping_versions = {
+        "zuul-jobs": 1,
+        "ansible-roles": zubbi.models.BLOCK_MAPPING_VERSION,
+    }
+    elmock.return_value.indices.exists.side_effect = (
+        lambda index: index in existing_indices
+    )
+    elmock.return_value.indices.get_mapping.side_effect = lambda index: {
+        index: {"mappings": {"_meta": {"mapping_version": mapping_versions[index]}}}
+    }
+    # The existing index doesn't know the n-gram analyzer yet
+    elmock.return_value.indices.get_settings.side_effect = lambda index: {
+        index: {"settings": {"index": {"analysis": {}}}}
+    }
+    elmock.return_value.update_by_query.return_value = mock.Mock(
+        body={"task": "node:1"}
+    )
+
+    assert zubbi.models.ZuulJob.migrate(using=elmock()) == "node:1"
+    # Up to date indices are not migrated
+    assert zubbi.models.AnsibleRole.migrate(using=elmock()) is None
+
+    # The analysis settings can only be updated on a closed index
+    indices = elmock.return_value.indices
+    indices.close.assert_called_once_with(index="zuul-jobs")
+    indices.open.assert_called_once_with(index="zuul-jobs")
+    settings = indices.put_settings.call_args[1]["settings"]
+    assert "zubbi_ngram" in settings["analysis"]["analyzer"]
+    # The existing documents are indexed again to fill the new fields
+    elmock.return_value.update_by_query.assert_called_once()
+    assert elmock.return_value.update_by_query.call_args[1]["index"] == ["zuul-jobs"]
+
+
 @mock.patch("elasticsearch.Elasticsearch")
 def test_elasticsearch_init_with_prefix(elmock, mock_index_prefix):
     index_prefix = "zubbi"
@@ -0,0 +1,43 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from zubbi.extensions import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(threshold=2, default_timeout=60)
+    cache.set("foo", ["foo"])
+    cache.set("bar", ["bar"])
+    # Using an item protects it from being dropped
+    assert cache.get("foo") == ["foo"]
+    cache.set("baz", ["baz"])
+
+    assert cache.get("bar") is None
+    assert cache.get("foo") == ["foo"]
+    assert cache.get("baz") == ["baz"]
+
+
+@mock.patch("zubbi.extensions.time.monotonic")
+def test_lru_cache_timeout(monotonic_mock):
+    monotonic_mock.return_value = 100
+    cache = LRUCache(default_timeout=60)
+    cache.set("foo", ["foo"])
+    cache.set("bar", ["bar"], timeout=0)
+
+    monotonic_mock.return_value = 200
+    assert not cache.has("foo")
+    # A timeout of 0 never expires
+    assert cache.get("bar") == ["bar"]
@@ -12,7 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from zubbi.models import ZuulJob
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from elastic_transport import ObjectApiResponse
+from elasticsearch.exceptions import ApiError
+
+import zubbi.models
+from zubbi.models import BlockSearch, GitRepo, ZuulJob
 
 
 def test_zuul_job_description():
@@ -23,3 +31,215 @@ def test_zuul_job_description():
     # Validate that the description is rendered correctly and doesn't
     # result in an AttributeError.
     assert "<p>Some nice html</p>" == job.description_rendered
+
+
+def test_zuul_job_bulk_save_name_suggest():
+    job = ZuulJob(job_name="foo")
+
+    # The name suggestion must also be filled when storing jobs in bulk
+    assert job.prepare_bulk_save()["_source"]["name_suggest"] == "foo"
+
+
+def test_block_summary():
+    job = ZuulJob(
+        job_name="foo",
+        description="Runs **bar**\n\nSome details",
+        description_html=(
+            '<div class="document">\n<p>Runs <strong>bar</strong></p>\n'
+            "<p>Some details</p>\n</div>"
+        ),
+    )
+
+    # The rendered description is preferred, but without its markup
+    assert job.prepare_bulk_save()["_source"]["summary"] == "Runs bar"
+
+    job = ZuulJob(job_name="foo", description="\n{}\nSome details".format("a" * 400))
+    summary = job.prepare_bulk_save()["_source"]["summary"]
+    assert len(summary) == zubbi.models.SUMMARY_MAX_LENGTH
+    assert summary.endswith("...")
+
+    # Without description, the summary is still stored
+    job = ZuulJob(job_name="foo")
+    assert job.prepare_bulk_save()["_source"]["summary"] == ""
+
+
+def test_zuul_job_update_tenants(es_client):
+    es_client.update_by_query.return_value = ObjectApiResponse(
+        meta=None, body={"updated": 3}
+    )
+    repo_tenants = {
+        "jobs": ["foo"],
+        "roles": ["foo", "bar"],
+        # Overlapping paths, the first matching one wins
+        "extra_config_paths": {"zuul-extra.d": ["bar"], "zuul-extra.d/baz": ["baz"]},
+    }
+    file_paths = {"zuul.yaml", "zuul-extra.d/jobs.yaml", "zuul-extra.d/baz/jobs.yaml"}
+
+    with mock.patch.object(ZuulJob, "file_paths", return_value=file_paths):
+        assert ZuulJob.update_tenants("orga/repo", repo_tenants) == 3
+
+    kwargs = es_client.update_by_query.call_args.kwargs
+    assert kwargs["conflicts"] == "proceed"
+    assert kwargs["query"] == {"bool": {"filter": [{"terms": {"repo": ["orga/repo"]}}]}}
+    # The tenants of the files are resolved like during a full scrape
+    assert kwargs["script"]["params"] == {
+        "tenants": ["foo"],
+        "file_tenants": {
+            "zuul-extra.d/jobs.yaml": ["bar"],
+            "zuul-extra.d/baz/jobs.yaml": ["bar"],
+        },
+    }
+
+
+def test_zuul_job_carry_over(es_client):
+    es_client.update_by_query.return_value = ObjectApiResponse(
+        meta=None, body={"updated": 2}
+    )
+    repo_tenants = {"jobs": ["foo"], "roles": ["foo"]}
+    scrape_time = datetime(2018, 9, 1, tzinfo=timezone.utc)
+
+    assert (
+        ZuulJob.carry_over("orga/repo", {"zuul.yaml": "abc"}, repo_tenants, scrape_time)
+        == 2
+    )
+
+    # Only the jobs of the unchanged files are updated
+    kwargs = es_client.update_by_query.call_args.kwargs
+    assert kwargs["query"] == {
+        "bool": {
+            "filter": [
+                {"terms": {"repo": ["orga/repo"]}},
+                {"terms": {"file_path": ["zuul.yaml"]}},
+            ]
+        }
+    }
+    assert kwargs["script"]["params"] == {
+        "tenants": ["foo"],
+        "file_tenants": {},
+        "scrape_time": scrape_time.isoformat(),
+    }
+
+
+def test_zuul_job_touch_repo_failed(es_client):
+    es_client.update_by_query.side_effect = ApiError("Timeout", meta=None, body=None)
+
+    # The failure must not be hidden, as the documents would be outdated
+    with pytest.raises(ApiError):
+        ZuulJob.touch_repo("orga/repo", datetime(2018, 9, 1, tzinfo=timezone.utc))
+
+
+def test_git_repo_update_tenant_config(es_client):
+    es_client.update.return_value = ObjectApiResponse(
+        meta=None, body={"result": "updated", "_seq_no": 1, "_primary_term": 1}
+    )
+    tenant_config = {"tenants": {"jobs": ["foo"]}, "connection_name": "github"}
+
+    GitRepo(meta={"id": "abc"}).update_tenant_config(tenant_config)
+
+    # The whole config is replaced, so no outdated keys are kept
+    script = es_client.update.call_args.kwargs["body"]["script"]
+    assert script["params"] == {"tenant_config": tenant_config}
+
+
+def test_search_query_substring():
+    search = BlockSearch().search_query("Foo-bar ab", {"job_name", "description"})
+    query = search.to_dict()["query"]["bool"]["must"][0]["bool"]
+
+    # Each word is looked up via its n-grams instead of leading wildcards
+    assert query["minimum_should_match"] == 1
+    assert query["should"] == [
+        {
+            "multi_match": {
+                "query": "Foo-bar",
+                "fields": ["description.ngram^1.2", "job_name.ngram^1.5"],
+                "operator": "and",
+            }
+        },
+        # Words which are shorter than an n-gram only match as prefix
+        {
+            "multi_match": {
+                "query": "ab",
+                "fields": ["description^1.2", "job_name^1.5"],
+                "type": "phrase_prefix",
+            }
+        },
+    ]
+
+
+def test_search_query_exact():
+    search = BlockSearch().search_query("foo", {"job_name", "repo"}, exact=True)
+    query = search.to_dict()["query"]["bool"]["must"][0]
+
+    # An exact match of the whole name is boosted via the keyword field
+    assert query == {
+        "multi_match": {
+            "query": "foo",
+            "fields": ["job_name^1.5", "repo", "job_name.keyword^3.0"],
+        }
+    }
+
+
+def test_search_outdated_index():
+    # Outdated indices don't have the ngram and suggest subfields yet
+    with mock.patch.object(zubbi.models, "OUTDATED_INDICES", {"zuul-jobs"}):
+        search = BlockSearch(index=["zuul-jobs", "ansible-roles"])
+        query = search.search_query("foo bar", {"job_name"}).to_dict()["query"]
+        suggest = search.autocomplete_query("fo").to_dict()["query"]
+
+    assert query["bool"]["must"][0] == {
+        "query_string": {"query": "*foo bar*", "fields": ["job_name^1.5"]}
+    }
+    assert suggest["bool"]["must"][0] == {
+        "multi_match": {
+            "query": "fo",
+            "type": "phrase_prefix",
+            "fields": ["job_name", "role_name"],
+        }
+    }
+
+
+def test_block_hit():
+    # NOTE (felix): Other tests reload the models module, so we must use the
+    # full-qualified names for the isinstance checks to work.
+    BlockHit = zubbi.models.BlockHit
+    hit = BlockHit.from_hit(
+        {
+            "_index": "ansible-roles",
+            "_source": {
+                "role_name": "foo",
+                "repo": "orga/repo",
+                "last_updated": "2018-09-17T15:15:15Z",
+                "summary": "Deploys foo",
+            },
+        }
+    )
+
+    assert zubbi.models.block_type(hit) == "role"
+    assert hit.name == "foo"
+    assert hit.last_updated == datetime(2018, 9, 17, 15, 15, 15, tzinfo=timezone.utc)
+    assert hit.summary == "Deploys foo"
+    assert hit.reusable is False
+
+    hit = BlockHit.from_hit({"_index": "zuul-jobs", "_source": {"job_name": "bar"}})
+    assert zubbi.models.block_type(hit) == "job"
+    assert hit.summary is None
+
+    with pytest.raises(ValueError):
+        BlockHit.from_hit({"_index": "unknown", "_source": {}})
+
+
+def test_block_count_without(es_client):
+    es_client.count.return_value = ObjectApiResponse(meta=None, body={"count": 2})
+
+    assert ZuulJob.count_without("orga/repo", "file_sha", "summary") == 2
+
+    # Documents missing any of the fields are counted
+    query = es_client.count.call_args.kwargs["query"]
+    assert query["bool"]["filter"][1] == {
+        "bool": {
+            "should": [
+                {"bool": {"must_not": [{"exists": {"field": "file_sha"}}]}},
+                {"bool": {"must_not": [{"exists": {"field": "summary"}}]}},
+            ]
+        }
+    }
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+from unittest import mock
+
 import pytest
 from elastic_transport import ObjectApiResponse
 
@@ -56,6 +59,59 @@ def test_detail_view(flask_client, es_client):
     assert b"<title>Details for role foo - Zubbi</title>" in rv.data
 
 
+def test_search_view(flask_client, es_client):
+    response = ObjectApiResponse(
+        meta=None,
+        body={
+            "hits": {
+                "total": {"value": 3},
+                "hits": [
+                    {
+                        "_index": "ansible-roles",
+                        "_source": {
+                            "role_name": "foo",
+                            "repo": "orga/repo1",
+                            "summary": "Deploys foo",
+                        },
+                    },
+                    {
+                        "_index": "ansible-roles",
+                        "_source": {
+                            "role_name": "bar",
+                            "repo": "orga/repo1",
+                            "summary": "Deploys <bar>",
+                        },
+                    },
+                    {
+                        "_index": "zuul-jobs",
+                        "_source": {
+                            "job_name": "foobar",
+                            "repo": "orga/repo2",
+                            "reusable": True,
+                            "last_updated": "2018-09-17T15:15:15Z",
+                        },
+                    },
+                ],
+            }
+        },
+    )
+
+    es_client.search.return_value = response
+    rv = flask_client.get("/search?query=foo")
+    assert rv.status == "200 OK"
+    assert b"<strong>3</strong> results" in rv.data
+    assert b"Deploys foo" in rv.data
+    # The summary is plain text, so it must be escaped
+    assert b"Deploys &lt;bar&gt;" in rv.data
+    assert b"/detail/orga/repo2/job/foobar" in rv.data
+
+    # Only the fields shown on the result cards are loaded
+    source = es_client.search.call_args.kwargs["body"]["_source"]
+    assert "summary" in source["includes"]
+    assert "description" not in source["includes"]
+    assert "description_html" not in source["includes"]
+
+
 def test_detail_view_unknown_block_type(flask_client):
     rv = flask_client.get("/detail/repo_name/foobar/foo")
     assert rv.status == "400 BAD REQUEST"
@@ -66,16 +122,29 @@ def test_auto_complete_view(flask_client, es_client):
     response = ObjectApiResponse(
         meta=None,
         body={
-            "suggest": {
-                "suggester": [{"options": [{"text": "foo"}, {"text": "foobar"}]}]
+            "hits": {
+                "hits": [
+                    {"_index": "zuul-jobs", "_source": {"job_name": "foo"}},
+                    {"_index": "ansible-roles", "_source": {"role_name": "foobar"}},
+                    # The same job might be defined in multiple repos
+                    {"_index": "zuul-jobs", "_source": {"job_name": "foo"}},
+                ]
             }
         },
     )
 
     es_client.search.return_value = response
     rv = flask_client.get("/api/search/autocomplete?term=foo")
-    # The resulting list is not ordered
-    assert set(rv.get_json()) == {"foobar", "foo"}
+    assert rv.get_json() == ["foo", "foobar"]
+    # Jobs and roles are completed via their search_as_you_type fields
+    query = es_client.search.call_args.kwargs["body"]["query"]["bool"]
+    assert query["must"][0]["multi_match"]["type"] == "bool_prefix"
+    assert query["filter"] == [{"term": {"private": False}}]
+
+    # The suggestions for the same prefix are cached
+    rv = flask_client.get("/api/search/autocomplete?term=FOO")
+    assert rv.get_json() == ["foo", "foobar"]
+    assert es_client.search.call_count == 1
 
 
 @pytest.mark.parametrize(
@@ -140,3 +209,24 @@ def test_webhook_view_correct_sha(flask_client):
     )
     assert rv_post_valid.status == "200 OK"
     assert rv_post_valid.get_json() == {"event_processed": True}
+
+
+def test_webhook_view_forward_event(flask_client):
+    precalculated_signature = "sha1=3e7397e4c518017be42e2a87522ae117edc422c9"
+
+    with mock.patch("zubbi.views.get_zmq_socket") as socket_mock:
+        rv = flask_client.post(
+            "/api/webhook",
+            json={"abc": "cde"},
+            headers={
+                "X-GitHub-Delivery": "foo",
+                "X-Hub-Signature": precalculated_signature,
+                "x-Github-Event": "installation",
+            },
+        )
+    assert rv.status == "200 OK"
+
+    # The message has only two frames, so older scrapers can still read it
+    event, payload = socket_mock.return_value.send_multipart.call_args[0][0]
+    assert event == b"installation"
+    assert json.loads(payload) == {"abc": "cde", "delivery_id": "foo"}
@@ -12,10 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import random
 import subprocess
+import time
 
 import click
+from elasticsearch.dsl import connections
 from flask.cli import current_app, with_appcontext
+from tabulate import tabulate
+
+from zubbi.models import AnsibleRole, BlockSearch, ZubbiDoc, ZuulJob
 
 
 @click.command()
@@ -25,3 +31,146 @@ def collectstatic(dst):
     for blueprint in current_app.iter_blueprints():
         subprocess.run(["cp", "-rv", blueprint.static_folder, dst])
     subprocess.run(["cp", "-rv", current_app.static_folder, dst])
+
+
+@click.command("benchmark-search")
+@click.option("--count", default=50000, help="Number of synthetic jobs and roles each")
+@click.option("--queries", default=500, help="Number of search queries to measure")
+@click.option("--seed", default=0, help="Seed for the synthetic data and queries")
+@click.option("--keep", is_flag=True, help="Keep the benchmark indices afterwards")
+@with_appcontext
+def benchmark_search(count, queries, seed, keep):
+    """Measure the search latency on a large synthetic index.
+
+    The synthetic jobs and roles are stored in separate benchmark indices,
+    so the real data is not affected. For comparison, the previous search
+    via a query_string with leading wildcards is measured as well.
+    """
+    rnd = random.Random(seed)
+    indices = {
+        doc_class: "{}-benchmark".format(doc_class._default_index())
+        for doc_class in (AnsibleRole, ZuulJob)
+    }
+    for doc_class, index in indices.items():
+        doc_class.init(index=index)
+
+    try:
+        click.echo("Indexing {} synthetic jobs and roles".format(2 * count))
+        names = []
+        ZubbiDoc.bulk_save(
+            _synthetic_blocks(rnd, indices, count, names), chunk_size=1000
+        )
+        connections.get_connection().indices.refresh(index=list(indices.values()))
+
+        fields = sorted(["job_name", "role_name", "description"])
+        terms = [_synthetic_term(rnd, names) for _ in range(queries)]
+        results = []
+        for label, build_query in (
+            ("ngram", lambda search, term: search.search_query(term, fields)),
+            (
+                "wildcard",
+                lambda search, term: search.query(
+                    "query_string", query="*{}*".format(term), fields=fields
+                ),
+            ),
+        ):
+            took, wall = _measure(build_query, terms, list(indices.values()))
+            results.append((label, *_percentiles(took), *_percentiles(wall)))
+        click.echo(
+            tabulate(
+                results,
+                headers=[
+                    "query",
+                    "took p50",
+                    "took p99",
+                    "wall p50",
+                    "wall p99",
+                ],
+                floatfmt=".1f",
+            )
+        )
+    finally:
+        if not keep:
+            connections.get_connection().indices.delete(
+                index=list(indices.values()), ignore_unavailable=True
+            )
+
+
+def _synthetic_blocks(rnd, indices, count, names):
+    for i in range(count):
+        for doc_class, name_field in (
+            (AnsibleRole, "role_name"),
+            (ZuulJob, "job_name"),
+        ):
+            name = "{}-{}-{}".format(
+                rnd.choice(BENCHMARK_WORDS), rnd.choice(BENCHMARK_WORDS), i
+            )
+            names.append(name)
+            doc = doc_class(
+                repo="orga/repo{}".format(i % 500),
+                tenants=["tenant{}".format(i % 7)],
+                private=False,
+                description=" ".join(
+                    rnd.choice(BENCHMARK_WORDS) for _ in range(rnd.randint(10, 40))
+                ),
+                **{name_field: name},
+            )
+            doc.meta.index = indices[doc_class]
+            yield doc
+
+
+def _synthetic_term(rnd, names):
+    name = rnd.choice(names)
+    length = rnd.randint(3, 8)
+    start = rnd.randint(0, max(len(name) - length, 0))
+    return name[start : start + length]
+
+
+def _measure(build_query, terms, indices):
+    took = []
+    wall = []
+    for term in terms:
+        search = build_query(BlockSearch(index=indices), term)[0:9]
+        start = time.perf_counter()
+        response = search.execute()
+        wall.append((time.perf_counter() - start) * 1000)
+        took.append(response.took)
+    return took, wall
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return tuple(
+        values[min(len(values) - 1, int(len(values) * pct / 100))] for pct in (50, 99)
+    )
+
+
+# Words for the names and descriptions of the synthetic jobs and roles
+BENCHMARK_WORDS = [
+    "ansible",
+    "build",
+    "cache",
+    "check",
+    "cleanup",
+    "deploy",
+    "docker",
+    "fetch",
+    "gate",
+    "helm",
+    "install",
+    "kernel",
+    "lint",
+    "manifest",
+    "nodeset",
+    "openstack",
+    "package",
+    "publish",
+    "python",
+    "release",
+    "sphinx",
+    "terraform",
+    "tox",
+    "upload",
+    "validate",
+    "zuul",
+]
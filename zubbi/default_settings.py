@@ -14,10 +14,38 @@
 
 SEARCH_BATCH_SIZE = 9
 SEARCH_BATCH_LIMIT = 30
+# Number of prefixes whose autocompletion is cached and for how long (in seconds)
+AUTOCOMPLETE_CACHE_SIZE = 1000
+AUTOCOMPLETE_CACHE_TIMEOUT = 60
 
 
 # Scraper defaults
 # Timeout in seconds (5 min)
 ZMQ_SUB_TIMEOUT = 300
-# Interval after which a repo will be scraped in any case (in hours)
+# Interval after which a repo will be scraped in any case (in hours). This is
+# used for repos whose change frequency is not known yet.
 FORCE_SCRAPE_INTERVAL = 24
+# Bounds for the scrape interval of a repo (in hours). The interval of each repo
+# is adapted to how often it changes: The longer a repo doesn't change, the less
+# often it is scraped. FORCE_SCRAPE_INTERVAL is used for unknown repos.
+FORCE_SCRAPE_INTERVAL_MIN = 12
+FORCE_SCRAPE_INTERVAL_MAX = 240
+# Fraction of its scrape interval by which a repo might be scraped
+# earlier. This spreads the periodic scrapes of all repos over time.
+FORCE_SCRAPE_JITTER = 0.25
+# Maximum number of periodic scrapes per FORCE_SCRAPE_WINDOW (in seconds).
+# Set the limit to 0 to disable it.
+FORCE_SCRAPE_LIMIT = 50
+FORCE_SCRAPE_WINDOW = 300
+# Engine used to scrape the repositories, either 'sync' or 'async'.
+# The async engine fetches multiple repositories concurrently.
+SCRAPE_ENGINE = "sync"
+# Number of repositories which are fetched concurrently by the async engine
+SCRAPE_CONCURRENCY = 8
+# Number of upcoming repositories which are cloned or fetched in the
+# background while the current ones are scraped. 0 disables the prefetching.
+SCRAPE_PREFETCH = 0
+# Shard handled by this scraper instance. Each repository is assigned to one
+# of SHARD_COUNT shards, so multiple scrapers can run side by side.
+SHARD_INDEX = 0
+SHARD_COUNT = 1
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 import atexit
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 
 import zmq
-from cachelib import NullCache, SimpleCache
+from cachelib import BaseCache, NullCache, SimpleCache
 from flask import current_app
 
 
@@ -61,6 +64,74 @@ def get_cache():
     return current_app.extensions["cache"]
 
 
+class LRUCache(BaseCache):
+    """Memory cache which drops the least recently used items once it's full.
+
+    In contrary to the SimpleCache, frequently used items (like the
+    autocompletion of common prefixes) are kept until they expire.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        super().__init__(default_timeout)
+        self._threshold = threshold
+        # key -> (expires, value), ordered from least to most recently used
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        expires = time.monotonic() + timeout if timeout else 0
+        with self._lock:
+            self._cache[key] = (expires, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+
+def get_autocomplete_cache():
+    # Don't use caching in debug mode (mostly for development)
+    if current_app.debug:
+        return NullCache()
+    if not hasattr(current_app, "extensions"):
+        current_app.extensions = {}
+    if "autocomplete_cache" not in current_app.extensions:
+        current_app.extensions["autocomplete_cache"] = LRUCache(
+            threshold=current_app.config["AUTOCOMPLETE_CACHE_SIZE"],
+            default_timeout=current_app.config["AUTOCOMPLETE_CACHE_TIMEOUT"],
+        )
+    return current_app.extensions["autocomplete_cache"]
+
+
 def get_zmq_socket():
     if not hasattr(current_app, "extensions"):
         current_app.extensions = {}
@@ -26,12 +26,17 @@ from elasticsearch.dsl import (
     Document,
     Integer,
     Keyword,
+    MetaField,
+    Object,
     Q,
     Search,
+    SearchAsYouType,
     Text,
+    UpdateByQuery,
+    analyzer,
     connections,
+    token_filter,
 )
-from elasticsearch.exceptions import ApiError
 from elasticsearch.helpers import bulk
 
 LOGGER = logging.getLogger(__name__)
@@ -48,10 +53,33 @@ DEFAULT_TLS_CONFIG = {
 
 # We want to boost following fields
 SEARCH_BOOST_FIELDS = {
-    "role_name": "role_name^1.5",
-    "job_name": "job_name^1.5",
-    "description": "description^1.2",
+    "role_name": 1.5,
+    "job_name": 1.5,
+    "description": 1.2,
 }
+# Fields which provide a keyword subfield for exact matches
+KEYWORD_FIELDS = frozenset(["role_name", "job_name"])
+
+# Length of the n-grams which are indexed for the substring search
+NGRAM_SIZE = 3
+
+# Maximum length of the description summary shown on the result cards
+SUMMARY_MAX_LENGTH = 300
+
+# NOTE (felix): A substring search via leading wildcards has to scan the whole
+# term dictionary. Instead, we index the trigrams of each (lowercased) word,
+# so any substring of at least NGRAM_SIZE characters can be found via the
+# trigrams it consists of.
+ngram_analyzer = analyzer(
+    "zubbi_ngram",
+    tokenizer="whitespace",
+    filter=[
+        "lowercase",
+        token_filter(
+            "zubbi_ngram", type="ngram", min_gram=NGRAM_SIZE, max_gram=NGRAM_SIZE
+        ),
+    ],
+)
 
 RESERVED_CHARACTERS = [
     "+",
@@ -97,6 +125,45 @@ TRANSLATION_TABLE = str.maketrans(
 )
 
 
+# Version of the block mappings. An index created with an older version must
+# be migrated (see Block.migrate()).
+BLOCK_MAPPING_VERSION = 2
+# Names of the block indices which are not migrated yet (see Block.init())
+OUTDATED_INDICES = set()
+
+
+def name_field():
+    """Field for the name of a block.
+
+    Besides the whitespace analyzed name, it provides subfields for exact
+    matches, the substring search and the autocompletion while typing.
+    """
+    return Text(
+        analyzer="whitespace",
+        fields={
+            "keyword": Keyword(),
+            "ngram": Text(analyzer=ngram_analyzer),
+            "suggest": SearchAsYouType(),
+        },
+    )
+
+
+# Update the tenants of a job, depending on the file it's defined in. The
+# tenants of the files in extra config paths are resolved beforehand (see
+# ZuulJob.tenants_for_file()), so a full scrape results in the same tenants.
+JOB_TENANTS_SCRIPT = """
+def tenants = params.tenants;
+def file_path = ctx._source.file_path;
+if (file_path != null && params.file_tenants.containsKey(file_path)) {
+    tenants = params.file_tenants[file_path];
+}
+ctx._source.tenants = tenants;
+"""
+
+# Carry over unchanged documents to the current scrape
+SCRAPE_TIME_SCRIPT = "ctx._source.scrape_time = params.scrape_time;"
+
+
 class ZubbiDoc(Document):
     """All documents which are scraped by Zubbi and stored in Elasticsearch."""
 
@@ -115,13 +182,20 @@ class ZubbiDoc(Document):
     # Helper method as mentioned in
     # https://github.com/elastic/elasticsearch-dsl-py/issues/403
     @classmethod
-    def bulk_save(cls, docs):
-        try:
-            objects = (d.to_dict(include_meta=True) for d in docs)
-            client = connections.get_connection()
-            return bulk(client, objects)
-        except ApiError:
-            LOGGER.exception("Writing data to Elasticsearch failed")
+    def bulk_save(cls, docs, **kwargs):
+        """Store the documents in chunks.
+
+        The documents might be of different classes and can be provided by
+        a generator, so they don't have to be kept in memory all at once.
+        The kwargs are passed to the bulk helper (e.g. chunk_size). Errors
+        are raised, so the caller knows which documents weren't stored.
+        """
+        objects = (d.prepare_bulk_save() for d in docs)
+        client = connections.get_connection()
+        return bulk(client, objects, **kwargs)
+
+    def prepare_bulk_save(self):
+        return self.to_dict(include_meta=True)
 
     @classmethod
     def prefix_name(cls, name):
@@ -146,10 +220,52 @@ class GitRepo(ZubbiDoc):
     # field to allow exact matches e.g. via term query.
     repo_name = Text(fields={"keyword": Keyword()})
     provider = Text()
+    # Used to detect if the repo changed since the last scraping
+    head_sha = Keyword()
+    content_hash = Keyword()
+    changed_at = Date(default_timezone="UTC")
+    # Interval for periodic scrapes in seconds, based on how often the repo
+    # changes.
+    scrape_interval = Integer()
+    # Settings of the repo which are copied to each job and role. If they
+    # change, the unchanged files must be parsed again.
+    private = Boolean()
+    reusable = Boolean()
+    url = Keyword(index=False)
+    # Entry of the repo in the repo_map of the tenant sources at the last
+    # scraping. It's only used to pick up the changes of the tenant sources
+    # between two runs of the scraper, so it's not indexed.
+    tenant_config = Object(enabled=False)
 
     class Index:
         name = ZubbiDoc.prefix_name("git-repos")
 
+    @classmethod
+    def stored_repo_map(cls):
+        """Get the tenant configs of all stored repos.
+
+        Repos which were stored without a tenant config are mapped to None.
+        """
+        repo_map = {}
+        for hit in cls.search().source(["repo_name", "tenant_config"]).scan():
+            tenant_config = getattr(hit, "tenant_config", None)
+            repo_map[hit.repo_name] = (
+                tenant_config.to_dict() if tenant_config is not None else None
+            )
+        return repo_map
+
+    def update_tenant_config(self, tenant_config):
+        # NOTE (felix): A partial update would merge the old and new config,
+        # so the whole object must be replaced via script.
+        self.update(
+            script="ctx._source.tenant_config = params.tenant_config",
+            tenant_config=tenant_config,
+        )
+
+    def touch(self, scrape_time, **fields):
+        """Update the scrape time of an unchanged repository."""
+        self.update(scrape_time=scrape_time, **fields)
+
 
 class Block(ZubbiDoc):
     name_suggest = Completion(
@@ -158,22 +274,162 @@ class Block(ZubbiDoc):
             {"name": "tenants", "type": "category", "path": "tenants"},
         ]
     )
-    repo = Text(analyzer="whitespace")
-    tenants = Text(multi=True, analyzer="whitespace")
+    repo = Text(analyzer="whitespace", fields={"ngram": Text(analyzer=ngram_analyzer)})
+    tenants = Text(
+        multi=True,
+        analyzer="whitespace",
+        fields={"ngram": Text(analyzer=ngram_analyzer)},
+    )
     # NOTE (fschmidt): Elasticsearch does not support context suggestion for
     # Boplean fields. As we are using the private flag to filter the auto-
     # completion results, this must be Text.
     private = Text()
     url = Text()
-    description = Text(analyzer="whitespace")
+    description = Text(
+        analyzer="whitespace", fields={"ngram": Text(analyzer=ngram_analyzer)}
+    )
     description_html = Text()
+    # First line of the description as plain text for the result cards, so
+    # the search doesn't have to load the whole description.
+    summary = Keyword(index=False)
     platforms = Text(multi=True, analyzer="whitespace")
     last_updated = Date(default_timezone="UTC")
     reusable = Boolean()
 
-    @staticmethod
-    def suggest_field():
-        return "name_suggest"
+    class Meta:
+        meta = MetaField(mapping_version=BLOCK_MAPPING_VERSION)
+
+    def save(self, **kwargs):
+        self.summary = _summary(self.description_html, self.description)
+        return super().save(**kwargs)
+
+    def prepare_bulk_save(self):
+        self.summary = _summary(self.description_html, self.description)
+        return super().prepare_bulk_save()
+
+    @classmethod
+    def init(cls, index=None, using=None):
+        """Create the index or update its mapping.
+
+        An index created with an older mapping version must be closed to add
+        the new analyzers, which is done by migrate(). Until then, only the
+        new fields which don't use them are added, and the search falls back
+        to queries which work with the old mapping.
+        """
+        i = cls._index.clone(name=index) if index else cls._index
+        mapping = cls._get_mapping(i, using) if i.exists(using=using) else None
+        if mapping is None or _mapping_version(mapping) == BLOCK_MAPPING_VERSION:
+            OUTDATED_INDICES.discard(i._name)
+            super().init(index=index, using=using)
+            return
+
+        LOGGER.warning(
+            "Index '%s' uses an outdated mapping, run 'zubbi-scraper migrate' "
+            "to update it",
+            i._name,
+        )
+        OUTDATED_INDICES.add(i._name)
+        # NOTE (felix): Otherwise, Elasticsearch would map the new fields
+        # dynamically once they are stored, which doesn't match our queries
+        # and conflicts with the migration.
+        properties = cls._additive_properties(i, mapping.get("properties", {}))
+        if properties:
+            LOGGER.info("Adding fields %s to index '%s'", sorted(properties), i._name)
+            i.put_mapping(using=using, body={"properties": properties})
+
+    @classmethod
+    def migrate(cls, index=None, using=None):
+        """Update an index which was created with an older mapping version.
+
+        New analyzers can't be added to an open index. Thus, the index is
+        closed (and can't be searched) during the update. Afterwards, its
+        documents are indexed again in the background, so the new fields are
+        filled. Returns the id of this task, or None if the index is up to
+        date.
+        """
+        i = cls._index.clone(name=index) if index else cls._index
+        if not i.exists(using=using) or (
+            _mapping_version(cls._get_mapping(i, using)) == BLOCK_MAPPING_VERSION
+        ):
+            return None
+        cls._update_analysis(i, using)
+        OUTDATED_INDICES.discard(i._name)
+
+        LOGGER.info("Indexing the existing documents of index '%s' again", i._name)
+        response = (
+            UpdateByQuery(using=cls._get_using(using), index=i._name)
+            .params(conflicts="proceed", wait_for_completion=False)
+            .execute()
+        )
+        return response.task
+
+    @classmethod
+    def _get_mapping(cls, i, using=None):
+        response = cls._get_connection(using).indices.get_mapping(index=i._name)
+        for mapping in response.values():
+            return mapping["mappings"]
+        return {}
+
+    @classmethod
+    def _additive_properties(cls, i, existing):
+        """Get the fields missing in the index which use no new analyzer."""
+        body = i.to_dict()
+        analysis = body.get("settings", {}).get("analysis", {})
+        analyzers = set(analysis.get("analyzer", {}))
+        return {
+            name: field
+            for name, field in body["mappings"]["properties"].items()
+            if name not in existing and not _uses_analyzers(field, analyzers)
+        }
+
+    @classmethod
+    def _update_analysis(cls, i, using=None):
+        body = i.to_dict()
+        es = cls._get_connection(using)
+        LOGGER.info("Updating the analysis settings of index '%s'", i._name)
+        es.indices.close(index=i._name)
+        try:
+            es.indices.put_settings(index=i._name, settings=body["settings"])
+        finally:
+            es.indices.open(index=i._name)
+        i.put_mapping(using=using, body=body["mappings"])
+
+    @classmethod
+    def touch_repo(cls, repo_name, scrape_time):
+        """Update the scrape time of all documents of an unchanged repository."""
+        return cls.update_repo(
+            repo_name, SCRAPE_TIME_SCRIPT, scrape_time=scrape_time.isoformat()
+        )
+
+    @classmethod
+    def count_without(cls, repo_name, *fields):
+        """Count the documents of a repository which miss any of these fields."""
+        has_fields = Q("bool", filter=[Q("exists", field=field) for field in fields])
+        return (
+            cls.search().filter("terms", repo=[repo_name]).exclude(has_fields).count()
+        )
+
+    @classmethod
+    def update_repo(cls, repo_name, script, extra_filter=None, **params):
+        """Update all documents of a repository in place via a script.
+
+        Returns the number of updated documents. If the update fails, the
+        ApiError is raised, as the documents which were not updated would be
+        deleted as outdated afterwards.
+        """
+        ubq = UpdateByQuery(index=cls._default_index()).filter(
+            "terms", repo=[repo_name]
+        )
+        for query in extra_filter or []:
+            ubq = ubq.filter(query)
+        ubq = (
+            ubq.script(source=script, lang="painless", params=params)
+            # Documents which are changed in the meantime (e.g. by a scrape)
+            # are up to date anyway. The refresh makes the changes visible
+            # for the deletion of outdated documents afterwards.
+            .params(conflicts="proceed", refresh=True)
+        )
+        return ubq.execute().updated
 
     @property
     def has_html_description(self):
@@ -197,9 +453,11 @@ class Block(ZubbiDoc):
 class AnsibleRole(Block):
     # NOTE (fschmidt): We have to store the name as 'role_name' in the result,
     # so we can use it for aggregation in Elasticsearch later on.
-    role_name = Text(analyzer="whitespace")
+    role_name = name_field()
     changelog = Text(analyzer="whitespace")
     changelog_html = Text()
+    # SHA of the role directory (tree) in git
+    tree_sha = Keyword()
 
     class Index:
         name = ZubbiDoc.prefix_name("ansible-roles")
@@ -212,18 +470,51 @@ class AnsibleRole(Block):
     def changelog_rendered(self):
         return self._renderable_field(self.changelog_html, self.changelog)
 
+    def prepare_bulk_save(self):
+        self.name_suggest = self.role_name
+        return super().prepare_bulk_save()
+
     @classmethod
-    def bulk_save(cls, docs):
-        for doc in docs:
-            doc.name_suggest = doc.role_name
-        return super().bulk_save(docs)
+    def update_tenants(cls, repo_name, repo_tenants):
+        return cls.update_repo(
+            repo_name,
+            "ctx._source.tenants = params.tenants",
+            tenants=repo_tenants["roles"],
+        )
+
+    @classmethod
+    def known_shas(cls, repo_name):
+        """Get the tree SHAs of all roles of a repository by role name."""
+        search = (
+            cls.search()
+            .filter("terms", repo=[repo_name])
+            .filter("exists", field="tree_sha")
+            # Roles stored before the summary existed must be parsed again
+            .filter("exists", field="summary")
+            .source(["role_name", "tree_sha"])
+        )
+        return {hit.role_name: hit.tree_sha for hit in search.scan()}
+
+    @classmethod
+    def carry_over(cls, repo_name, role_names, repo_tenants, scrape_time):
+        """Keep the documents of unchanged roles for the current scrape."""
+        return cls.update_repo(
+            repo_name,
+            "ctx._source.tenants = params.tenants; " + SCRAPE_TIME_SCRIPT,
+            extra_filter=[Q("terms", role_name=list(role_names))],
+            tenants=repo_tenants["roles"],
+            scrape_time=scrape_time.isoformat(),
+        )
 
 
 class ZuulJob(Block):
     # NOTE (fschmidt): We have to store the name as 'job_name' in the result,
     # so we can use it for aggregation in Elasticsearch later on.
-    job_name = Text(analyzer="whitespace")
+    job_name = name_field()
     parent = Text(analyzer="whitespace")
+    file_path = Keyword()
+    # SHA of the file (blob) in git
+    file_sha = Keyword()
     line_start = Integer()
     line_end = Integer()
 
@@ -239,6 +530,86 @@ class ZuulJob(Block):
         self.name_suggest = self.job_name
         return super().save(**kwargs)
 
+    def prepare_bulk_save(self):
+        self.name_suggest = self.job_name
+        return super().prepare_bulk_save()
+
+    @staticmethod
+    def tenants_for_file(repo_tenants, file_path):
+        """Get the tenants of the jobs defined in a file.
+
+        Files in an extra config path belong to the tenants of the first
+        matching path.
+        """
+        extra_config_paths = repo_tenants.get("extra_config_paths", {})
+        for extra_config_path, tenants in extra_config_paths.items():
+            if file_path.startswith(extra_config_path):
+                return tenants
+        return repo_tenants["jobs"]
+
+    @classmethod
+    def update_tenants(cls, repo_name, repo_tenants):
+        file_paths = []
+        if repo_tenants.get("extra_config_paths"):
+            file_paths = cls.file_paths(repo_name)
+        return cls.update_repo(
+            repo_name,
+            JOB_TENANTS_SCRIPT,
+            **cls._tenant_params(repo_tenants, file_paths),
+        )
+
+    @classmethod
+    def file_paths(cls, repo_name):
+        """Get the paths of all files defining jobs of a repository."""
+        search = (
+            cls.search()
+            .filter("terms", repo=[repo_name])
+            .filter("exists", field="file_path")
+            .source(["file_path"])
+        )
+        return {hit.file_path for hit in search.scan()}
+
+    @classmethod
+    def known_shas(cls, repo_name):
+        """Get the blob SHAs of all job files of a repository by file path."""
+        search = (
+            cls.search()
+            .filter("terms", repo=[repo_name])
+            .filter("exists", field="file_sha")
+            # Jobs stored before the summary existed must be parsed again
+            .filter("exists", field="summary")
+            .source(["file_path", "file_sha"])
+        )
+        # A file usually contains multiple jobs, but they share the same SHA
+        return {hit.file_path: hit.file_sha for hit in search.scan()}
+
+    @classmethod
+    def carry_over(cls, repo_name, file_paths, repo_tenants, scrape_time):
+        """Keep the documents of jobs in unchanged files for the current scrape."""
+        return cls.update_repo(
+            repo_name,
+            JOB_TENANTS_SCRIPT + SCRAPE_TIME_SCRIPT,
+            extra_filter=[Q("terms", file_path=list(file_paths))],
+            scrape_time=scrape_time.isoformat(),
+            **cls._tenant_params(repo_tenants, file_paths),
+        )
+
+    @classmethod
+    def _tenant_params(cls, repo_tenants, file_paths):
+        tenants = repo_tenants["jobs"]
+        file_tenants = {}
+        for file_path in file_paths:
+            # Only the files with other tenants must be provided
+            extra_tenants = cls.tenants_for_file(repo_tenants, file_path)
+            if extra_tenants != tenants:
+                file_tenants[file_path] = extra_tenants
+        return {"tenants": tenants, "file_tenants": file_tenants}
+
+    @classmethod
+    def count_without_file_path(cls, repo_name):
+        """Count the jobs which were stored before the file path was known."""
+        return cls.count_without(repo_name, "file_path")
+
 
 class BlockSearch(Search):
     def __init__(self, index=None, doc_type=None, block_class=None, **kwargs):
@@ -266,12 +637,22 @@ class BlockSearch(Search):
 
     def search_query(self, query, fields_set, exact=False, extra_filter=None):
         # Elasticsearch cannot work with a set, only with list
-        fields = [SEARCH_BOOST_FIELDS.get(field, field) for field in fields_set]
+        fields = sorted(fields_set)
         if exact:
-            search_query = Q("multi_match", query=query, fields=fields)
-        else:
+            # An exact match of the whole name ranks highest
+            search_fields = [_search_field(field) for field in fields] + [
+                _search_field(field, "keyword", boost=2)
+                for field in fields
+                if field in KEYWORD_FIELDS
+            ]
+            search_query = Q("multi_match", query=query, fields=search_fields)
+        elif self._searches_outdated_index():
+            # The previous query, which scans the whole term dictionary
             query_string = "*{}*".format(query.translate(TRANSLATION_TABLE))
-            search_query = Q("query_string", query=query_string, fields=fields)
+            search_fields = [_search_field(field) for field in fields]
+            search_query = Q("query_string", query=query_string, fields=search_fields)
+        else:
+            search_query = self._substring_query(query, fields)
 
         extra_filter = extra_filter or []
 
@@ -281,6 +662,39 @@ class BlockSearch(Search):
             "bool", filter=extra_filter, must=search_query, should=boost_reusable_query
         )
 
+    @staticmethod
+    def _substring_query(query, fields):
+        """Find the documents containing any of the query's words.
+
+        Each word might be part of a longer word in the document, like a
+        query_string with leading and trailing wildcards, but without
+        scanning the whole term dictionary.
+        """
+        words = query.split()
+        if not words:
+            return Q("match_all")
+
+        ngram_fields = [_search_field(field, "ngram") for field in fields]
+        prefix_fields = [_search_field(field) for field in fields]
+        word_queries = []
+        for word in words:
+            if len(word) >= NGRAM_SIZE:
+                # All n-grams of the word must be found in the same field
+                word_queries.append(
+                    Q("multi_match", query=word, fields=ngram_fields, operator="and")
+                )
+            else:
+                # Words which are too short for n-grams only match as prefix
+                word_queries.append(
+                    Q(
+                        "multi_match",
+                        query=word,
+                        fields=prefix_fields,
+                        type="phrase_prefix",
+                    )
+                )
+        return Q("bool", should=word_queries, minimum_should_match=1)
+
     def detail_query(self, block_name, repo, extra_filter=None):
         extra_filter = extra_filter or []
         query_string = block_name.translate(TRANSLATION_TABLE)
@@ -290,27 +704,145 @@ class BlockSearch(Search):
         ]
         return self.query("bool", filter=extra_filter, must=detail_query)
 
-    def suggest_query(
-        self, text, name="suggester", size=DEFAULT_SUGGEST_SIZE, contexts=None
+    def autocomplete_query(self, text, size=DEFAULT_SUGGEST_SIZE, extra_filter=None):
+        """Find the jobs and roles whose name contains words starting with text.
+
+        Only the names are loaded for the results.
+        """
+        extra_filter = extra_filter or []
+        if self._searches_outdated_index():
+            # The names don't have the search_as_you_type subfield yet
+            autocomplete_query = Q(
+                "multi_match",
+                query=text,
+                type="phrase_prefix",
+                fields=["job_name", "role_name"],
+            )
+        else:
+            fields = [
+                "{}.suggest{}".format(field, suffix)
+                for field in ("job_name", "role_name")
+                for suffix in ("", "._2gram", "._3gram")
+            ]
+            autocomplete_query = Q(
+                "multi_match", query=text, type="bool_prefix", fields=fields
+            )
+        return self.query("bool", filter=extra_filter, must=autocomplete_query)[:size]
+
+    def _searches_outdated_index(self):
+        return any(index in OUTDATED_INDICES for index in self._index or [])
+
+    def execute_hits(self):
+        """Execute the search and wrap the results into BlockHits.
+
+        Returns the total number of results and the BlockHits.
+        """
+        # NOTE (felix): The response only creates the documents when its hits
+        # are accessed, so we use the raw response instead.
+        response = self.execute().to_dict()
+        hits = [BlockHit.from_hit(hit) for hit in response["hits"]["hits"]]
+        return response["hits"]["total"]["value"], hits
+
+
+class BlockHit:
+    """Lightweight search result providing only the fields of a result card.
+
+    In contrary to the AnsibleRole and ZuulJob documents, only the used
+    fields are deserialized.
+    """
+
+    __slots__ = ("block_class", "name", "repo", "reusable", "last_updated", "summary")
+
+    def __init__(
+        self, block_class, name, repo, reusable=False, last_updated=None, summary=None
     ):
-        contexts = contexts or {}
-        return self.suggest(
-            name,
-            text,
-            completion={
-                "field": Block.suggest_field(),
-                "size": size,
-                "contexts": contexts,
-            },
+        self.block_class = block_class
+        self.name = name
+        self.repo = repo
+        self.reusable = reusable
+        self.last_updated = last_updated
+        self.summary = summary
+
+    @classmethod
+    def from_hit(cls, hit):
+        index = hit.get("_index")
+        if index == AnsibleRole._default_index():
+            block_class = AnsibleRole
+        elif index == ZuulJob._default_index():
+            block_class = ZuulJob
+        else:
+            raise ValueError("Unsupported index: {}".format(index))
+
+        source = hit.get("_source", {})
+        last_updated = source.get("last_updated")
+        if last_updated is not None:
+            last_updated = block_class._doc_type.mapping["last_updated"].deserialize(
+                last_updated
+            )
+        return cls(
+            block_class,
+            name=source.get("role_name" if block_class is AnsibleRole else "job_name"),
+            repo=source.get("repo"),
+            reusable=source.get("reusable", False),
+            last_updated=last_updated,
+            summary=source.get("summary"),
         )
 
 
+def _summary(html, raw):
+    """Get the first line of the description as plain text.
+
+    Like on the detail page, the rendered description is preferred over the
+    raw one. Without a description, the summary is an empty string, so the
+    documents which were stored before the summary existed can be told apart.
+    """
+    if html:
+        lines = (markupsafe.Markup(line).striptags() for line in html.splitlines())
+    else:
+        lines = (raw or "").splitlines()
+    for line in lines:
+        line = line.strip()
+        if line:
+            if len(line) > SUMMARY_MAX_LENGTH:
+                line = line[: SUMMARY_MAX_LENGTH - 3].rstrip() + "..."
+            return line
+    return ""
+
+
+def _mapping_version(mapping):
+    return mapping.get("_meta", {}).get("mapping_version")
+
+
+def _uses_analyzers(definition, analyzers):
+    """Check if a field definition (or its subfields) uses any of analyzers."""
+    return isinstance(definition, dict) and any(
+        (key.endswith("analyzer") and value in analyzers)
+        or _uses_analyzers(value, analyzers)
+        for key, value in definition.items()
+    )
+
+
+def _search_field(field, subfield=None, boost=1):
+    boost *= SEARCH_BOOST_FIELDS.get(field, 1)
+    if subfield is not None:
+        field = "{}.{}".format(field, subfield)
+    if boost == 1:
+        return field
+    return "{}^{}".format(field, boost)
+
+
 def role_type(item):
-    return isinstance(item, AnsibleRole)
+    return issubclass(_block_class(item), AnsibleRole)
 
 
 def job_type(item):
-    return isinstance(item, ZuulJob)
+    return issubclass(_block_class(item), ZuulJob)
+
+
+def _block_class(item):
+    if isinstance(item, BlockHit):
+        return item.block_class
+    return type(item)
 
 
 def block_type(item):
@@ -12,7 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
+import shlex
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
 
 from zubbi.scraper.connections.git import GitConnection
 from zubbi.scraper.exceptions import ScraperConfigurationError
@@ -20,6 +27,9 @@ from zubbi.utils import urljoin
 
 LOGGER = logging.getLogger(__name__)
 
+# Gerrit prefixes each JSON response to prevent XSSI attacks
+JSON_MAGIC_PREFIX = ")]}'"
+
 
 class CGitUrlBuilder:
     def __init__(self, web_url):
@@ -70,12 +80,31 @@ class GerritConnection(GitConnection):
         workspace="/tmp/zubbi_working_dir",
         web_type="cgit",
         web_url=None,
+        shared_objects=False,
+        workspace_max_size=None,
+        stream_events=False,
+        ssh_port=29418,
+        events_command=None,
+        rest_url=None,
+        heads_ttl=60,
     ):
-        super().__init__(url, user, password, workspace)
+        super().__init__(
+            url, user, password, workspace, shared_objects, workspace_max_size
+        )
         self.base_url = url
         self.gitweb_type = web_type
         self.gitweb_url = web_url or url
         self.web_url_builder = self.get_web_url_builder(web_type, web_url, url)
+        # Listen to Gerrit's event stream to scrape updated repos immediately
+        self.stream_events = stream_events
+        self.ssh_port = ssh_port
+        self.events_command = events_command
+        # Look up the HEADs of all projects with a single REST API call. The
+        # result is cached for heads_ttl seconds.
+        self.rest_url = rest_url
+        self.heads_ttl = heads_ttl
+        self._heads = None
+        self._heads_lock = threading.Lock()
 
     def init(self):
         LOGGER.info("Initializing Gerrit connection to %s", self.base_url)
@@ -85,6 +114,102 @@ class GerritConnection(GitConnection):
     def provider(self):
         return "gerrit"
 
+    def get_head_sha(self, repository_name, branch="master"):
+        """Get the SHA of the branch's HEAD from the bulk listing if possible.
+
+        Falls back to asking the repository itself if no REST API is
+        configured or the listing failed.
+        """
+        heads = self.get_head_shas(branch)
+        if heads is None:
+            return super().get_head_sha(repository_name, branch)
+        return heads.shas.get(repository_name)
+
+    def get_head_shas(self, branch="master"):
+        """List the branch's HEAD of all projects with a single API call.
+
+        Returns a ProjectHeads object or None if no REST API is configured or
+        the projects could not be listed.
+        """
+        if not self.rest_url:
+            return None
+        with self._heads_lock:
+            heads = self._heads
+            if (
+                heads is not None
+                and heads.branch == branch
+                and heads.age() < self.heads_ttl
+            ):
+                return heads
+
+            list_time = datetime.now(timezone.utc)
+            shas = self._list_projects(branch)
+            if shas is None:
+                return None
+            LOGGER.debug("Listed the HEADs of %d Gerrit projects", len(shas))
+            self._heads = ProjectHeads(branch, shas, list_time)
+            return self._heads
+
+    def _list_projects(self, branch):
+        # NOTE (felix): Authenticated requests must use the /a/ prefix
+        auth = None
+        url = self.rest_url
+        if self.user and self.password:
+            auth = (self.user, self.password)
+            url = urljoin(url, "a")
+        # NOTE (felix): The trailing slash is required by Gerrit
+        url = "{}/".format(urljoin(url, "projects"))
+        try:
+            response = requests.get(url, params={"b": branch}, auth=auth)
+            response.raise_for_status()
+            projects = _parse_json(response.text)
+        except (requests.RequestException, ValueError) as e:
+            LOGGER.warning("Could not list the projects of %s: %s", url, e)
+            return None
+
+        # Projects without this branch are not listed at all
+        return {
+            name: project["branches"][branch]
+            for name, project in projects.items()
+            if branch in project.get("branches", {})
+        }
+
+    def get_events_command(self):
+        """Get the command which streams the ref updates of this Gerrit.
+
+        Returns None if the event stream is disabled.
+        """
+        if not self.stream_events:
+            return None
+        if self.events_command:
+            if isinstance(self.events_command, str):
+                return shlex.split(self.events_command)
+            return list(self.events_command)
+
+        # NOTE (felix): The user needs the 'Stream Events' capability and an
+        # SSH key which is accepted by Gerrit.
+        host = urlparse(self.base_url).hostname
+        if host is None:
+            raise ScraperConfigurationError(
+                "Could not determine the SSH host of Gerrit connection '{}'".format(
+                    self.base_url
+                )
+            )
+        if self.user:
+            host = "{}@{}".format(self.user, host)
+        return [
+            "ssh",
+            "-p",
+            str(self.ssh_port),
+            "-o",
+            "BatchMode=yes",
+            host,
+            "gerrit",
+            "stream-events",
+            "-s",
+            "ref-updated",
+        ]
+
     def get_web_url_builder(self, web_type, web_url, url):
         web_url = web_url or url
         url_builder_class = self.WEB_URL_BUILDERS.get(web_type)
@@ -95,3 +220,23 @@ class GerritConnection(GitConnection):
                 )
             )
         return url_builder_class(web_url)
+
+
+class ProjectHeads:
+    """HEAD SHAs of a branch in all Gerrit projects at list_time."""
+
+    __slots__ = ("branch", "shas", "list_time")
+
+    def __init__(self, branch, shas, list_time):
+        self.branch = branch
+        self.shas = shas
+        self.list_time = list_time
+
+    def age(self):
+        return (datetime.now(timezone.utc) - self.list_time).total_seconds()
+
+
+def _parse_json(text):
+    if text.startswith(JSON_MAGIC_PREFIX):
+        text = text[len(JSON_MAGIC_PREFIX) :]
+    return json.loads(text)
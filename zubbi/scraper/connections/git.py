@@ -14,14 +14,30 @@
 
 import logging
 
+from git.cmd import Git
+from git.exc import GitCommandError
+
+from zubbi.scraper.workspace import get_workspace
 from zubbi.utils import urljoin
 
 LOGGER = logging.getLogger(__name__)
 
 
+def create_workspace(workspace, shared_objects=False, max_size=None):
+    if max_size is not None:
+        max_size = max_size * 1024 * 1024
+    return get_workspace(workspace, shared_objects=shared_objects, max_size=max_size)
+
+
 class GitConnection:
     def __init__(
-        self, url, user=None, password=None, workspace="/tmp/zubbi_working_dir"
+        self,
+        url,
+        user=None,
+        password=None,
+        workspace="/tmp/zubbi_working_dir",
+        shared_objects=False,
+        workspace_max_size=None,
     ):
         self.git_host_url = url
 
@@ -34,6 +50,9 @@ class GitConnection:
         # workspace directory is depending on the connection entry in the settings file
         # (different connection -> different workspace)
         self.workspace_dir = workspace
+        # Optionally, store the objects of all repositories in a single object
+        # store and limit the size of the workspace (in MB).
+        self.workspace = create_workspace(workspace, shared_objects, workspace_max_size)
 
         # TODO If we want to support ssh and https, we should add a protocol parameter
 
@@ -58,6 +77,23 @@ class GitConnection:
         remote_url = urljoin(auth_base_url, repository_name)
         return remote_url
 
+    def get_head_sha(self, repository_name, branch="master"):
+        """Get the SHA of the branch's HEAD without fetching the repository.
+
+        Returns None if the SHA could not be determined.
+        """
+        remote_url = self.get_remote_url(repository_name)
+        try:
+            output = Git().ls_remote(remote_url, "refs/heads/{}".format(branch))
+        except GitCommandError as e:
+            LOGGER.warning(
+                "Could not get HEAD of repo '%s': %s", repository_name, e.stderr
+            )
+            return None
+        # The output looks like '<sha>\trefs/heads/<branch>'
+        sha, _, _ = output.partition("\t")
+        return sha or None
+
     @property
     def provider(self):
         return "git"
@@ -19,15 +19,38 @@ import github3
 import jwt
 import requests
 
+from zubbi.scraper.connections.git import create_workspace
+from zubbi.scraper.exceptions import ScraperConfigurationError
 from zubbi.utils import urljoin
 
 PREVIEW_JSON_ACCEPT = "application/vnd.github.machine-man-preview+json"
+# Let the commits API return only the SHA of a commit
+SHA_ACCEPT = "application/vnd.github.sha"
 
 LOGGER = logging.getLogger(__name__)
 
 
+# Modes for reading the contents of a repository
+ARCHIVE_MODES = ("never", "auto", "always")
+
+# Repositories with at least this number of files are read from an archive
+# in the 'auto' archive mode.
+DEFAULT_ARCHIVE_MIN_FILES = 500
+
+
 class GitHubConnection:
-    def __init__(self, url, app_id, app_key):
+    def __init__(
+        self,
+        url,
+        app_id,
+        app_key,
+        archive_mode="never",
+        archive_min_files=DEFAULT_ARCHIVE_MIN_FILES,
+        mirror=False,
+        workspace="/tmp/zubbi_working_dir",
+        shared_objects=False,
+        workspace_max_size=None,
+    ):
         self.base_url = url
         self.api_url = urljoin(url, "api/v3")
         self.graphql_url = urljoin(url, "api/graphql")
@@ -35,6 +58,21 @@ class GitHubConnection:
         self._app_id = app_id
         self._app_key = app_key
 
+        # Read the repository contents from a tarball instead of the contents
+        # API: 'never', 'always' or 'auto' (depending on archive_min_files)
+        if archive_mode not in ARCHIVE_MODES:
+            raise ScraperConfigurationError(
+                "Invalid archive mode '{}' for GitHub connection".format(archive_mode)
+            )
+        self.archive_mode = archive_mode
+        self.archive_min_files = archive_min_files
+
+        # Keep a bare clone of each repository in the workspace and read
+        # everything locally. This takes precedence over the archive_mode.
+        self.mirror = mirror
+        self.workspace_dir = workspace
+        self.workspace = create_workspace(workspace, shared_objects, workspace_max_size)
+
         self.installation_map = {}
         self.installation_token_cache = {}
 
@@ -194,6 +232,35 @@ class GitHubConnection:
         gh.login(token=token)
         return gh
 
+    def get_head_sha(self, project):
+        """Get the SHA of the default branch's HEAD with a single API call.
+
+        Returns None if the SHA could not be determined.
+        """
+        repo_info = self.installation_map.get(project)
+        token = self._get_installation_key(project)
+        if not repo_info or not token:
+            return None
+
+        url = "{}/repos/{}/commits/{}".format(
+            self.api_url, project, repo_info["default_branch"]
+        )
+        headers = {"Accept": SHA_ACCEPT, "Authorization": "token {}".format(token)}
+        try:
+            response = requests.get(url, headers=headers)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            LOGGER.warning("Could not get HEAD of repo '%s': %s", project, e)
+            return None
+        return response.text.strip() or None
+
+    def get_remote_url(self, project):
+        """Get the clone url of a project, authenticated by its installation token."""
+        token = self._get_installation_key(project)
+        scheme, _, host = self.base_url.partition("://")
+        auth_base_url = "{}://x-access-token:{}@{}".format(scheme, token, host)
+        return "{}.git".format(urljoin(auth_base_url, project))
+
     @property
     def repos(self):
         return self.installation_map.keys()
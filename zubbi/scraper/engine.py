@@ -0,0 +1,649 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from elasticsearch.exceptions import ApiError, NotFoundError
+
+from zubbi import default_settings
+from zubbi.models import AnsibleRole, GitRepo, ZubbiDoc, ZuulJob
+from zubbi.scraper.fetch_pool import FetchPool
+from zubbi.scraper.repo_parser import RepoParser
+from zubbi.scraper.repos.gerrit import GerritRepository
+from zubbi.scraper.repos.git import GitRepository
+from zubbi.scraper.repos.github import GitHubRepository
+from zubbi.scraper.scraper import JOB_FILE, ROLE, Scraper
+
+LOGGER = logging.getLogger(__name__)
+
+REPOS = {"git": GitRepository, "github": GitHubRepository, "gerrit": GerritRepository}
+
+# Number of repositories which are fetched concurrently by the async engine
+DEFAULT_CONCURRENCY = 8
+
+# Number of documents which are sent to Elasticsearch in a single bulk request
+INDEX_CHUNK_SIZE = 100
+
+# Number of scraped files (or parsed documents) per fetch worker which might
+# wait for the next stage in the async engine.
+QUEUE_SIZE_PER_WORKER = 4
+
+# The scrape interval of a repo is this fraction of the time since its last
+# change (within the configured bounds).
+SCRAPE_INTERVAL_FACTOR = 0.5
+
+
+class ScrapeIntervalPolicy:
+    """Adapt the periodic scrape interval of a repo to its change frequency.
+
+    Repositories which changed recently are scraped more often than the
+    ones which didn't change for a long time.
+    """
+
+    def __init__(self, minimum=None, maximum=None):
+        self.minimum = minimum or timedelta(
+            hours=default_settings.FORCE_SCRAPE_INTERVAL_MIN
+        )
+        self.maximum = maximum or timedelta(
+            hours=default_settings.FORCE_SCRAPE_INTERVAL_MAX
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            minimum=timedelta(hours=config["FORCE_SCRAPE_INTERVAL_MIN"]),
+            maximum=timedelta(hours=config["FORCE_SCRAPE_INTERVAL_MAX"]),
+        )
+
+    def interval(self, unchanged_since):
+        interval = unchanged_since * SCRAPE_INTERVAL_FACTOR
+        return min(max(interval, self.minimum), self.maximum)
+
+
+class ScrapeResult:
+    """Intermediate result of a single repository passed between the stages.
+
+    It doesn't hold the scraped files or parsed documents themselves, as
+    those are streamed through the stages one by one.
+    """
+
+    __slots__ = (
+        "repo",
+        "provider",
+        "connection_name",
+        "tenants",
+        "items",
+        "documents",
+        "unchanged_job_files",
+        "unchanged_roles",
+        "content_shas",
+        "head_sha",
+        "limited",
+        "changed_at",
+        "scrape_interval",
+    )
+
+    def __init__(self, repo, provider, tenants, items):
+        self.repo = repo
+        self.provider = provider
+        self.connection_name = None
+        self.tenants = tenants
+        # Generator of the scraped (kind, name, info) items
+        self.items = items
+        self.documents = 0
+        # Files and roles whose SHA didn't change since the last scraping
+        self.unchanged_job_files = {}
+        self.unchanged_roles = {}
+        # SHA (or content hash) of each scraped file and role
+        self.content_shas = {}
+        self.head_sha = None
+        # Whether only the changed paths (e.g. of a push) were scraped
+        self.limited = False
+        self.changed_at = None
+        self.scrape_interval = None
+
+
+class ScrapeEngine:
+    """Scrape repositories one after another.
+
+    Scraping a single repository is split into three stages:
+
+    - fetch: Check out the repository and collect all relevant files
+    - parse: Parse the job and role definitions and render their documentation
+    - index: Store the results in Elasticsearch
+
+    The stages are chained via generators, so each file (or role) is
+    fetched, parsed and indexed before the next one is fetched. Only the
+    documents of the current bulk request are kept in memory.
+
+    This engine runs all stages synchronously for one repository after
+    another.
+
+    Only job files and roles whose SHA changed since the last scraping are
+    fetched, parsed and rendered. The documents of the unchanged ones are
+    carried over to the current scrape in Elasticsearch. If the changed
+    paths of a repository are known (e.g. from a push event), only the
+    affected job files and roles are looked at in the first place.
+
+    scrape() returns the results of all repositories which were scraped
+    successfully. They contain the HEAD SHA, the time of the last change and
+    the new periodic scrape interval of each repository.
+
+    With prefetch, the next repositories (of the same scrape() call or
+    announced via prefetch()) are checked out in the background by a
+    FetchPool while the current one is parsed and indexed.
+    """
+
+    # Number of repositories which are passed to a single scrape() call
+    # when working off the scrape queue.
+    batch_size = 1
+
+    def __init__(self, connections, reusable_repos, interval_policy=None, prefetch=0):
+        self.connections = connections
+        self.reusable_repos = reusable_repos
+        self.interval_policy = interval_policy or ScrapeIntervalPolicy()
+        self.fetch_pool = FetchPool(prefetch) if prefetch else None
+
+    def scrape(self, repo_map, scrape_time, paths=None):
+        paths = paths or {}
+        results = {}
+        repo_items = list(repo_map.items())
+        for index, (repo_name, repo_data) in enumerate(repo_items):
+            if self.fetch_pool is not None:
+                next_items = repo_items[index + 1 : index + 1 + self.fetch_pool.size]
+                for next_name, next_data in next_items:
+                    self.prefetch(next_name, next_data)
+            result = self.fetch(repo_name, repo_data, paths.get(repo_name))
+            if result is None:
+                continue
+            try:
+                self.index(self.parse(result, result.items, scrape_time))
+                self.finish(result, scrape_time)
+            except Exception:
+                # The repo doesn't count as scraped, so its previous data is
+                # kept.
+                LOGGER.exception("Unable to index repo '%s'", repo_name)
+                result.repo.close()
+                continue
+            results[repo_name] = result
+        return results
+
+    def touch(self, repo_name, scrape_time, changed_at):
+        """Mark an unchanged repository as scraped without scraping it.
+
+        Returns the new periodic scrape interval of the repository, or None if
+        the repository must be scraped nevertheless.
+        """
+        # The reusable flag is copied to each job and role, so they must be
+        # parsed again if it changed (e.g. via the REUSABLE_PROJECTS setting).
+        uuid = hashlib.sha1(str.encode(repo_name)).hexdigest()
+        previous = self._get_previous(uuid)
+        if previous is None or previous.reusable != (repo_name in self.reusable_repos):
+            LOGGER.info("Settings of repo '%s' changed, it must be scraped", repo_name)
+            return None
+
+        LOGGER.info("Repo '%s' is unchanged, only updating scrape time", repo_name)
+        ZuulJob.touch_repo(repo_name, scrape_time)
+        AnsibleRole.touch_repo(repo_name, scrape_time)
+
+        interval = self.interval_policy.interval(scrape_time - changed_at)
+        GitRepo(meta={"id": uuid}).touch(
+            scrape_time, scrape_interval=int(interval.total_seconds())
+        )
+        return interval
+
+    def prefetch(self, repo_name, repo_data, token=None):
+        """Check out the repository in the background (if enabled)."""
+        if self.fetch_pool is None:
+            return
+        if repo_data.get("connection_name") not in self.connections:
+            return
+        self.fetch_pool.prefetch(
+            repo_name, lambda: self._create_repo(repo_name, repo_data), token
+        )
+
+    def _create_repo(self, repo_name, repo_data):
+        con = self.connections[repo_data["connection_name"]]
+        repo_class = REPOS.get(con.provider)
+        return repo_class(repo_name, con)
+
+    def fetch(self, repo_name, repo_data, paths=None):
+        """Check out the repository.
+
+        The files are fetched lazily when iterating over result.items.
+        """
+        con = self.connections[repo_data["connection_name"]]
+        repo = None
+        if self.fetch_pool is not None:
+            repo = self.fetch_pool.take(repo_name)
+        if repo is not None and not repo._repo:
+            # The prefetch might have failed temporarily, so try it again
+            LOGGER.info("Prefetching repo '%s' failed, fetching it again", repo_name)
+            repo.close()
+            repo = None
+        if repo is None:
+            repo = self._create_repo(repo_name, repo_data)
+
+        # Check if the repo was created successfully, if not, skip it.
+        # Possible reasons are e.g: No access (via GitHub app or Gerrit user),
+        # Clone/checkout failures for plain git repos or similar.
+        if not repo._repo:
+            LOGGER.error(
+                "Repo '%s' could not be initialized. Skip scraping.", repo_name
+            )
+            repo.close()
+            return None
+
+        tenants = repo_data["tenants"]
+        known_job_files, known_roles = self._get_known_shas(repo_name)
+        # The documents of unchanged files would keep the outdated settings
+        if (known_job_files or known_roles) and self._settings_changed(repo):
+            LOGGER.info("Settings of repo '%s' changed, scraping all files", repo_name)
+            known_job_files, known_roles = {}, {}
+            paths = None
+        # Documents without SHA (or summary) can't be carried over, so the
+        # changed paths are not sufficient to update them.
+        if paths is not None and not self._has_all_shas(repo_name):
+            LOGGER.info("Not all SHAs of repo '%s' are known yet", repo_name)
+            paths = None
+        scraper = Scraper(
+            repo,
+            tenants.get("extra_config_paths", {}),
+            known_job_files=known_job_files,
+            known_roles=known_roles,
+            item_info=RepoParser.required_info,
+        )
+        result = ScrapeResult(repo, con.provider, tenants, None)
+        result.connection_name = repo_data["connection_name"]
+        result.items = self._iter_items(result, scraper, paths)
+        result.head_sha = repo.head_sha()
+        return result
+
+    @staticmethod
+    def _iter_items(result, scraper, paths):
+        for kind, name, info in scraper.iter_files(paths):
+            # NOTE (felix): Repositories which don't provide the SHA of a file
+            # or role (e.g. in tests) fall back to hashing the scraped content.
+            sha = info.get("sha")
+            if not sha:
+                sha = _hash(info["content"] if kind == JOB_FILE else info)
+            result.content_shas["{}:{}".format(kind, name)] = sha
+            yield kind, name, info
+
+        # The unchanged files and roles are known once the scraper is done
+        result.unchanged_job_files = scraper.unchanged_job_files
+        result.unchanged_roles = scraper.unchanged_roles
+        result.limited = scraper.limited
+        for path, sha in scraper.unchanged_job_files.items():
+            result.content_shas["{}:{}".format(JOB_FILE, path)] = sha
+        for role_name, sha in scraper.unchanged_roles.items():
+            result.content_shas["{}:{}".format(ROLE, role_name)] = sha
+
+    def parse(self, result, items, scrape_time):
+        """Parse the scraped items and yield the resulting documents."""
+        repo = result.repo
+        parser = RepoParser(
+            repo,
+            result.tenants,
+            {},
+            {},
+            scrape_time,
+            repo.repo_name in self.reusable_repos,
+        )
+        for kind, name, info in items:
+            try:
+                documents = parser.parse_item(kind, name, info)
+            except Exception:
+                LOGGER.exception(
+                    "Unable to parse %s definitions in '%s' of repo '%s'",
+                    kind,
+                    name,
+                    repo,
+                )
+                continue
+            result.documents += len(documents)
+            yield from documents
+
+    def index(self, documents):
+        """Store the documents of one or more repositories in Elasticsearch."""
+        ZubbiDoc.bulk_save(documents, chunk_size=INDEX_CHUNK_SIZE)
+
+    def finish(self, result, scrape_time):
+        """Update the remaining data once all documents of a repo are indexed."""
+        repo_name = result.repo.repo_name
+        LOGGER.info(
+            "Updated %d job and role definitions of repo '%s' in Elasticsearch",
+            result.documents,
+            repo_name,
+        )
+        if result.unchanged_job_files:
+            LOGGER.info(
+                "Keeping job definitions of %d unchanged files",
+                len(result.unchanged_job_files),
+            )
+            ZuulJob.carry_over(
+                repo_name, result.unchanged_job_files, result.tenants, scrape_time
+            )
+        if result.unchanged_roles:
+            LOGGER.info(
+                "Keeping %d unchanged role definitions", len(result.unchanged_roles)
+            )
+            AnsibleRole.carry_over(
+                repo_name, result.unchanged_roles, result.tenants, scrape_time
+            )
+
+        # Build the data for the repo itself to be stored in Elasticsearch
+        uuid = hashlib.sha1(str.encode(repo_name)).hexdigest()
+        es_repo = GitRepo(meta={"id": uuid})
+        es_repo.repo_name = repo_name
+        es_repo.scrape_time = scrape_time
+        es_repo.provider = result.provider
+        es_repo.content_hash = _hash(result.content_shas)
+        es_repo.private = result.repo.private
+        es_repo.reusable = repo_name in self.reusable_repos
+        es_repo.url = result.repo.url
+        es_repo.tenant_config = {
+            "tenants": result.tenants,
+            "connection_name": result.connection_name,
+        }
+
+        previous = self._get_previous(uuid)
+        # NOTE (felix): A scrape of the changed paths misses the changes of
+        # pushes we didn't receive. Keeping the previous HEAD ensures that
+        # the next periodic scrape looks at the whole repo.
+        if result.limited:
+            result.head_sha = previous.head_sha if previous is not None else None
+        es_repo.head_sha = result.head_sha
+
+        # Check if the repo changed since the last scraping to adapt its
+        # scrape interval.
+        if (
+            previous is None
+            or previous.changed_at is None
+            or previous.head_sha != es_repo.head_sha
+            or previous.content_hash != es_repo.content_hash
+        ):
+            es_repo.changed_at = scrape_time
+        else:
+            es_repo.changed_at = previous.changed_at
+        interval = self.interval_policy.interval(scrape_time - es_repo.changed_at)
+        es_repo.scrape_interval = int(interval.total_seconds())
+        result.changed_at = es_repo.changed_at
+        result.scrape_interval = interval
+
+        # Store the information for the repository itself, if it was scraped successfully
+        LOGGER.info("Updating repo definition for '%s' in Elasticsearch", repo_name)
+        GitRepo.bulk_save([es_repo])
+
+        # The hashes are not needed anymore, so don't keep them in memory
+        result.items = result.content_shas = None
+        result.repo.close()
+
+    def _settings_changed(self, repo):
+        """Check if the settings of the repo changed since the last scraping."""
+        previous = self._get_previous(
+            hashlib.sha1(str.encode(repo.repo_name)).hexdigest()
+        )
+        if previous is None:
+            return True
+        # NOTE (felix): Repos which were stored before we kept track of their
+        # settings are considered changed.
+        return (
+            previous.private != repo.private
+            or previous.reusable != (repo.repo_name in self.reusable_repos)
+            or previous.url != repo.url
+        )
+
+    @staticmethod
+    def _get_previous(uuid):
+        try:
+            return GitRepo.get(id=uuid)
+        except NotFoundError:
+            return None
+
+    @staticmethod
+    def _get_known_shas(repo_name):
+        try:
+            return ZuulJob.known_shas(repo_name), AnsibleRole.known_shas(repo_name)
+        except ApiError:
+            # Without the known SHAs, we simply scrape everything
+            LOGGER.exception("Could not get known SHAs of repo '%s'", repo_name)
+            return {}, {}
+
+    @staticmethod
+    def _has_all_shas(repo_name):
+        try:
+            return (
+                ZuulJob.count_without(repo_name, "file_sha", "summary") == 0
+                and AnsibleRole.count_without(repo_name, "tree_sha", "summary") == 0
+            )
+        except ApiError:
+            LOGGER.exception("Could not check SHAs of repo '%s'", repo_name)
+            return False
+
+
+def _hash(content):
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(str.encode(content)).hexdigest()
+
+
+# Markers in the queues of the async engine
+_ITEM = "item"
+_END_OF_REPO = "end"
+_FAILED = "failed"
+
+
+class AsyncScrapeEngine(ScrapeEngine):
+    """Scrape repositories concurrently based on asyncio.
+
+    The stages are connected via bounded queues which pass single files
+    (or documents), so a slow stage applies backpressure on the previous
+    ones instead of piling up results in memory. Multiple repositories are
+    fetched concurrently, while parsing (Sphinx is not thread-safe) and
+    indexing are done by a single worker each. The indexer collects the
+    documents of all repositories into bulk requests of INDEX_CHUNK_SIZE.
+
+    As the underlying clients (github3, GitPython, Elasticsearch) are
+    blocking, their calls are delegated to worker threads. The event loop
+    itself only coordinates the stages.
+    """
+
+    def __init__(
+        self,
+        connections,
+        reusable_repos,
+        concurrency=None,
+        interval_policy=None,
+        prefetch=0,
+    ):
+        super().__init__(connections, reusable_repos, interval_policy, prefetch)
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        # Take as many repositories as can be fetched concurrently
+        self.batch_size = self.concurrency
+
+    def scrape(self, repo_map, scrape_time, paths=None):
+        results = {}
+        asyncio.run(self._scrape(repo_map, scrape_time, results, paths or {}))
+        return results
+
+    async def _scrape(self, repo_map, scrape_time, results, paths):
+        repo_queue = asyncio.Queue()
+        for repo_name, repo_data in repo_map.items():
+            repo_queue.put_nowait((repo_name, repo_data, paths.get(repo_name)))
+
+        queue_size = self.concurrency * QUEUE_SIZE_PER_WORKER
+        parse_queue = asyncio.Queue(maxsize=queue_size)
+        index_queue = asyncio.Queue(maxsize=queue_size)
+
+        fetch_executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="zubbi-fetch"
+        )
+        # Parsing and indexing use a dedicated thread each, so they don't
+        # have to wait for a free slot in the fetch executor.
+        parse_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="zubbi-parse"
+        )
+        index_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="zubbi-index"
+        )
+
+        try:
+            fetchers = [
+                asyncio.create_task(
+                    self._fetch_worker(repo_queue, parse_queue, fetch_executor)
+                )
+                for _ in range(min(self.concurrency, len(repo_map)))
+            ]
+            parser = asyncio.create_task(
+                self._parse_worker(
+                    parse_queue, index_queue, parse_executor, scrape_time
+                )
+            )
+            indexer = asyncio.create_task(
+                self._index_worker(index_queue, index_executor, scrape_time, results)
+            )
+
+            await asyncio.gather(*fetchers)
+            # Signal the end of the stream to the subsequent stages
+            await parse_queue.put(None)
+            await parser
+            await index_queue.put(None)
+            await indexer
+        finally:
+            fetch_executor.shutdown()
+            parse_executor.shutdown()
+            index_executor.shutdown()
+
+    async def _fetch_worker(self, repo_queue, parse_queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                repo_name, repo_data, paths = repo_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = None
+            try:
+                result = await loop.run_in_executor(
+                    executor, self.fetch, repo_name, repo_data, paths
+                )
+                if result is None:
+                    continue
+                # Fetch the files one by one, so the parser can start with
+                # the first ones while the others are still fetched.
+                while True:
+                    item = await loop.run_in_executor(
+                        executor, next, result.items, None
+                    )
+                    if item is None:
+                        break
+                    await parse_queue.put((_ITEM, result, item))
+            except Exception:
+                LOGGER.exception("Unable to fetch repo '%s'", repo_name)
+                # The repo must not be finished, but its checkout released
+                if result is not None:
+                    await parse_queue.put((_FAILED, result, None))
+                continue
+            await parse_queue.put((_END_OF_REPO, result, None))
+
+    async def _parse_worker(self, parse_queue, index_queue, executor, scrape_time):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await parse_queue.get()
+            if entry is None:
+                return
+            marker, result, item = entry
+            if marker == _ITEM:
+                documents = await loop.run_in_executor(
+                    executor, self._parse_item, result, item, scrape_time
+                )
+                for document in documents:
+                    await index_queue.put((_ITEM, result, document))
+            else:
+                await index_queue.put(entry)
+
+    def _parse_item(self, result, item, scrape_time):
+        return list(self.parse(result, [item], scrape_time))
+
+    async def _index_worker(self, index_queue, executor, scrape_time, results):
+        loop = asyncio.get_running_loop()
+        # (repo_name, document) pairs of the next bulk request
+        chunk = []
+        # Repos whose documents couldn't be indexed are not finished, so their
+        # previous data is kept.
+        failed = set()
+        while True:
+            entry = await index_queue.get()
+            if entry is None:
+                return
+            marker, result, document = entry
+            repo_name = result.repo.repo_name
+            if marker == _ITEM:
+                if repo_name not in failed:
+                    chunk.append((repo_name, document))
+                if len(chunk) < INDEX_CHUNK_SIZE:
+                    continue
+            # All documents of a repository must be indexed before it's
+            # finished, so the chunk is also flushed at its end.
+            if chunk:
+                failed.update(
+                    await loop.run_in_executor(executor, self._index_chunk, chunk)
+                )
+                chunk = []
+            if marker == _FAILED:
+                failed.add(repo_name)
+            elif marker != _END_OF_REPO:
+                continue
+            if repo_name in failed:
+                result.repo.close()
+                continue
+            try:
+                await loop.run_in_executor(executor, self.finish, result, scrape_time)
+            except Exception:
+                LOGGER.exception("Unable to index repo '%s'", repo_name)
+                result.repo.close()
+                continue
+            results[repo_name] = result
+
+    def _index_chunk(self, chunk):
+        """Index a chunk of documents and return the repos which failed.
+
+        If the bulk request fails, the documents of each repo are indexed on
+        their own, so a single repo can't fail the other ones in the chunk.
+        """
+        try:
+            self.index([document for _, document in chunk])
+            return set()
+        except Exception:
+            LOGGER.warning("Bulk request failed, indexing each repo on its own")
+
+        repo_documents = {}
+        for repo_name, document in chunk:
+            repo_documents.setdefault(repo_name, []).append(document)
+        failed = set()
+        for repo_name, documents in repo_documents.items():
+            try:
+                self.index(documents)
+            except Exception:
+                LOGGER.exception("Unable to index repo '%s'", repo_name)
+                failed.add(repo_name)
+        return failed
+
+
+ENGINES = {"sync": ScrapeEngine, "async": AsyncScrapeEngine}
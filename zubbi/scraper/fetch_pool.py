@@ -0,0 +1,91 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FetchPool:
+    """Check out the next repositories while the current one is scraped.
+
+    Creating a repository object clones or fetches the repository (or at
+    least talks to its API), which is the slowest part of scraping a
+    repository. The pool does this in the background for up to size
+    repositories, so they are ready once the engine gets to them.
+
+    Each prefetch can be tagged with a token (e.g. the revision of the scrape
+    request). If a repository is prefetched again with another token, the
+    outdated repository object is discarded, as it might miss some changes.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="zubbi-prefetch"
+        )
+        # repo_name -> (token, future)
+        self._pending = {}
+
+    def prefetch(self, repo_name, create, token=None):
+        """Create a repository in the background by calling create()."""
+        pending = self._pending.get(repo_name)
+        if pending is not None:
+            if pending[0] == token:
+                return
+            self._discard(repo_name)
+        if len(self._pending) >= self.size:
+            return
+        LOGGER.debug("Prefetching repo '%s'", repo_name)
+        self._pending[repo_name] = (token, self._executor.submit(create))
+
+    def take(self, repo_name):
+        """Get the prefetched repository (waiting for it if necessary).
+
+        Returns None if the repository wasn't prefetched or the prefetch
+        failed, so the caller has to create the repository itself.
+        """
+        pending = self._pending.pop(repo_name, None)
+        if pending is None:
+            return None
+        try:
+            return pending[1].result()
+        except Exception:
+            LOGGER.exception("Prefetching repo '%s' failed", repo_name)
+            return None
+
+    def retain(self, repo_names):
+        """Discard all prefetched repositories except for the given ones."""
+        for repo_name in list(self._pending):
+            if repo_name not in repo_names:
+                self._discard(repo_name)
+
+    def shutdown(self):
+        self.retain(())
+        self._executor.shutdown()
+
+    def _discard(self, repo_name):
+        _, future = self._pending.pop(repo_name)
+        # Repositories which are (being) created must release their resources
+        if not future.cancel():
+            future.add_done_callback(_close_repo)
+
+    def __contains__(self, repo_name):
+        return repo_name in self._pending
+
+
+def _close_repo(future):
+    if future.exception() is None and future.result() is not None:
+        future.result().close()
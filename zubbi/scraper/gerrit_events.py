@@ -0,0 +1,144 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import subprocess
+import threading
+
+import zmq
+
+LOGGER = logging.getLogger(__name__)
+
+# Address on which the scraper receives the events of its own event streams
+LOCAL_EVENTS_ADDRESS = "inproc://zubbi-local-events"
+# Name of the events which are forwarded to the scraper
+EVENT_REF_UPDATED = "gerrit_ref_updated"
+
+
+class GerritEventStream:
+    """Forward the ref updates of a Gerrit connection to the scraper.
+
+    The command (usually 'ssh ... gerrit stream-events') prints one JSON
+    event per line. Each 'ref-updated' event is published to the scraper's
+    ZMQ socket in the same way as the GitHub events sent by Zubbi web. The
+    scraper decides which of those updates must be scraped.
+
+    If the command exits (e.g. due to a connection loss), it's restarted
+    after retry_delay seconds.
+    """
+
+    def __init__(
+        self,
+        connection_name,
+        command,
+        context=None,
+        address=LOCAL_EVENTS_ADDRESS,
+        retry_delay=10,
+    ):
+        self.connection_name = connection_name
+        self.command = command
+        self.context = context or zmq.Context.instance()
+        self.address = address
+        self.retry_delay = retry_delay
+        self._stopped = threading.Event()
+        self._process = None
+        self._thread = None
+
+    def start(self):
+        LOGGER.info(
+            "Listening to the event stream of Gerrit connection '%s'",
+            self.connection_name,
+        )
+        self._thread = threading.Thread(
+            target=self._run,
+            name="zubbi-gerrit-events-{}".format(self.connection_name),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        # NOTE (felix): ZMQ sockets must only be used by the thread which
+        # created them.
+        socket = self.context.socket(zmq.XPUB)
+        socket.setsockopt(zmq.LINGER, 0)
+        try:
+            socket.connect(self.address)
+            # Events are dropped until the scraper subscribed, so we must not
+            # read the stream before.
+            while not self._stopped.is_set():
+                if socket.poll(1000):
+                    socket.recv()
+                    break
+
+            while not self._stopped.is_set():
+                self._stream(socket)
+                if self._stopped.wait(self.retry_delay):
+                    break
+                LOGGER.info(
+                    "Reconnecting to the event stream of Gerrit connection '%s'",
+                    self.connection_name,
+                )
+        finally:
+            socket.close()
+
+    def _stream(self, socket):
+        try:
+            self._process = subprocess.Popen(
+                self.command,
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                encoding="utf-8",
+                errors="replace",
+            )
+        except OSError as e:
+            LOGGER.error(
+                "Could not start the event stream of Gerrit connection '%s': %s",
+                self.connection_name,
+                e,
+            )
+            return
+        if self._stopped.is_set():
+            self._process.terminate()
+
+        with self._process:
+            for line in self._process.stdout:
+                self._forward(line, socket)
+        LOGGER.warning(
+            "Event stream of Gerrit connection '%s' exited with code %s",
+            self.connection_name,
+            self._process.returncode,
+        )
+
+    def _forward(self, line, socket):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            LOGGER.warning("Skipping invalid Gerrit event: %s", line.strip())
+            return
+        if not isinstance(event, dict) or event.get("type") != "ref-updated":
+            return
+
+        event["connection_name"] = self.connection_name
+        socket.send_multipart(
+            (EVENT_REF_UPDATED.encode("utf-8"), json.dumps(event).encode("utf-8"))
+        )
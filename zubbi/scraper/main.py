@@ -24,7 +24,8 @@ from datetime import datetime, timedelta, timezone
 import click
 import zmq
 from elasticsearch.dsl import Q
-from elasticsearch.exceptions import ConflictError
+from elasticsearch.dsl import connections as es_connections
+from elasticsearch.exceptions import ApiError, ConflictError
 from flask.config import Config
 from tabulate import tabulate
 
@@ -41,13 +42,25 @@ from zubbi.models import (
 from zubbi.scraper.connections.gerrit import GerritConnection
 from zubbi.scraper.connections.git import GitConnection
 from zubbi.scraper.connections.github import GitHubConnection
+from zubbi.scraper.engine import (
+    ENGINES,
+    REPOS,
+    AsyncScrapeEngine,
+    ScrapeEngine,
+    ScrapeIntervalPolicy,
+)
 from zubbi.scraper.exceptions import ScraperConfigurationError
-from zubbi.scraper.repo_parser import RepoParser
-from zubbi.scraper.repos.gerrit import GerritRepository
-from zubbi.scraper.repos.git import GitRepository
-from zubbi.scraper.repos.github import GitHubRepository
-from zubbi.scraper.scraper import Scraper
-from zubbi.scraper.tenant_parser import TenantParser
+from zubbi.scraper.gerrit_events import LOCAL_EVENTS_ADDRESS, GerritEventStream
+from zubbi.scraper.repo_cache import RepoCache
+from zubbi.scraper.repos.git import DEFAULT_BRANCH
+from zubbi.scraper.shard import Shard
+from zubbi.scraper.tenant_parser import TenantDiff, TenantParser
+from zubbi.scraper.work_queue import (
+    PRIORITY_INSTALLATION,
+    PRIORITY_PERIODIC,
+    PRIORITY_PUSH,
+    ScrapeQueue,
+)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -56,8 +69,16 @@ CONNECTIONS = {
     "github": GitHubConnection,
     "gerrit": GerritConnection,
 }
-REPOS = {"git": GitRepository, "github": GitHubRepository, "gerrit": GerritRepository}
-RepoItem = namedtuple("RepoItem", "name scraped provider")
+RepoItem = namedtuple("RepoItem", "name scraped provider shard")
+
+# Seconds between the reports of the pending scrape requests
+QUEUE_DEPTH_INTERVAL = 60
+
+# Seconds between the progress checks of a migration
+MIGRATE_POLL_INTERVAL = 5
+
+# GitHub lists at most this number of commits in the payload of a push event
+PUSH_PAYLOAD_COMMIT_LIMIT = 20
 
 
 def configure_logger(verbosity):
@@ -103,21 +124,22 @@ def _initialize_tenant_parser(tenant_sources_repo, tenant_sources_file, connecti
     else:
         tenant_parser = TenantParser(sources_file=tenant_sources_file)
 
-    tenant_parser.parse()
+    tenant_parser.refresh()
     return tenant_parser
 
 
-def _initialize_repo_cache():
+def _initialize_repo_cache(shard=None, config=None):
     """Initialize the repository cache used for scraping.
 
     Retrieves a list of repositories with their provider and last scraping time
     from Elasticsearch.
     This list can be used to check which repos need to be scraped (e.g. after
     a specific amount of time).
+    If a shard is given, only the repositories owned by this shard are cached.
     """
     LOGGER.info("Initializing repository cache")
     # Initialize Repo Cache
-    repo_cache = {}
+    repo_cache = RepoCache.from_config(config) if config else RepoCache()
 
     # Get all repos from Elasticsearch
     for hit in GitRepo.search().query("match_all").scan():
@@ -125,7 +147,17 @@ def _initialize_repo_cache():
         # scraper-webhook part.
         # This way, we could reduce the amount of operations needed for GitHub
         # and ElasticSearch
-        repo_cache[hit.repo_name] = hit.to_dict(skip_empty=False)
+        if shard is not None and not shard.owns(hit.repo_name):
+            continue
+        scrape_interval = getattr(hit, "scrape_interval", None)
+        repo_cache.update(
+            hit.repo_name,
+            hit.scrape_time,
+            getattr(hit, "provider", None),
+            timedelta(seconds=scrape_interval) if scrape_interval else None,
+            head_sha=getattr(hit, "head_sha", None),
+            changed_at=getattr(hit, "changed_at", None),
+        )
 
     return repo_cache
 
@@ -137,8 +169,20 @@ def _initialize_repo_cache():
     default="info",
     type=click.Choice(["debug", "info", "warning", "error"]),
 )
+@click.option(
+    "--shard-index",
+    help="Index of the shard handled by this scraper instance (starting at 0)",
+    type=int,
+    envvar="ZUBBI_SHARD_INDEX",
+)
+@click.option(
+    "--shard-count",
+    help="Total number of shards (scraper instances)",
+    type=int,
+    envvar="ZUBBI_SHARD_COUNT",
+)
 @click.pass_context
-def main(ctx, verbosity):
+def main(ctx, verbosity, shard_index, shard_count):
     configure_logger(verbosity)
 
     # Load the configurations from file
@@ -161,8 +205,15 @@ def main(ctx, verbosity):
             "but not both."
         )
 
+    # Command line options take precedence over the settings file
+    if shard_index is None:
+        shard_index = config["SHARD_INDEX"]
+    if shard_count is None:
+        shard_count = config["SHARD_COUNT"]
+    shard = Shard(shard_index, shard_count)
+
     # Store the config in click's context object to be available for subcommands
-    ctx.obj = {"config": config}
+    ctx.obj = {"config": config, "shard": shard}
 
     if ctx.invoked_subcommand is None:
         ctx.invoke(scrape)
@@ -174,11 +225,13 @@ def list_repos(ctx):
     repos = []
 
     config = ctx.obj["config"]
+    shard = ctx.obj["shard"]
     tenant_sources_repo = config.get("TENANT_SOURCES_REPO")
     tenant_sources_file = config.get("TENANT_SOURCES_FILE")
 
     # Initialize objects that are needed by all subcommands
     connections = init_connections(ctx.obj["config"])
+    # List the repositories of all shards
     repo_cache = _initialize_repo_cache()
     tenant_parser = _initialize_tenant_parser(
         tenant_sources_repo, tenant_sources_file, connections
@@ -191,11 +244,14 @@ def list_repos(ctx):
         if cached_repo is not None:
             list_item = RepoItem(
                 key,
-                datetime.strftime(cached_repo["scrape_time"], "%Y-%m-%dT%H:%M:%SZ"),
-                cached_repo["provider"],
+                datetime.strftime(cached_repo.scrape_time, "%Y-%m-%dT%H:%M:%SZ"),
+                cached_repo.provider,
+                shard.owner(key),
             )
         else:
-            list_item = RepoItem(key, "<not scraped yet>", "<unknown>")
+            list_item = RepoItem(
+                key, "<not scraped yet>", "<unknown>", shard.owner(key)
+            )
 
         repos.append(list_item)
 
@@ -208,11 +264,62 @@ def list_repos(ctx):
         tabulate(
             repos,
             tablefmt="orgtbl",
-            headers=["Repository", "Last scraped at", "Provider"],
+            headers=["Repository", "Last scraped at", "Provider", "Shard"],
         )
     )
 
 
+@main.command()
+@click.pass_context
+def maintain(ctx):
+    """Repack the local clones of all connections."""
+    # NOTE (felix): This doesn't need any connection to GitHub, Gerrit or
+    # Elasticsearch, so the connections are not initialized.
+    workspaces = []
+    for con in create_connections(ctx.obj["config"]).values():
+        workspace = getattr(con, "workspace", None)
+        # Connections might share a workspace
+        if workspace is not None and workspace not in workspaces:
+            workspaces.append(workspace)
+
+    for workspace in workspaces:
+        workspace.maintain()
+
+
+@main.command()
+@click.pass_context
+def migrate(ctx):
+    """Update the indices created by an older version of Zubbi.
+
+    The indices are closed during the update, so searches fail in the
+    meantime. Afterwards, their documents are indexed again, which is waited
+    for.
+    """
+    # NOTE (felix): This is only done on demand, as the web workers and
+    # scrapers would otherwise close the indices concurrently on each start.
+    es_config = get_elasticsearch_parameters_from_config(ctx.obj["config"])
+    init_elasticsearch_con(**es_config)
+    es = es_connections.get_connection()
+
+    for block_class in (ZuulJob, AnsibleRole):
+        task_id = block_class.migrate()
+        if task_id is None:
+            LOGGER.info("Index '%s' is up to date", block_class._default_index())
+            continue
+        while True:
+            task = es.tasks.get(task_id=task_id)
+            if task["completed"]:
+                break
+            status = task["task"]["status"]
+            LOGGER.info(
+                "Indexed %d of %d documents again",
+                status["updated"],
+                status["total"],
+            )
+            time.sleep(MIGRATE_POLL_INTERVAL)
+        LOGGER.info("Migrated index '%s'", block_class._default_index())
+
+
 @main.command()
 @click.option("--full", "-f", help="Scrape all repositories immediately", is_flag=True)
 @click.option("--repo", "-r", help="Scrape only the specified repo", multiple=True)
@@ -221,66 +328,100 @@ def scrape(ctx, full, repo):
     LOGGER.info("Hello, Zubbi!")
 
     config = ctx.obj["config"]
+    shard = ctx.obj["shard"]
     tenant_sources_repo = config.get("TENANT_SOURCES_REPO")
     tenant_sources_file = config.get("TENANT_SOURCES_FILE")
 
+    if shard.count > 1:
+        LOGGER.info("Scraping repositories of shard %s", shard)
+
     # Initialize objects that are needed by all subcommands
     connections = init_connections(ctx.obj["config"])
     reusable_repos = ctx.obj["config"].get("REUSABLE_PROJECTS", [])
-    repo_cache = _initialize_repo_cache()
+    repo_cache = _initialize_repo_cache(shard, config)
     tenant_parser = _initialize_tenant_parser(
         tenant_sources_repo, tenant_sources_file, connections
     )
+    engine = init_engine(config, connections, reusable_repos)
 
     if full:
-        scrape_full(connections, reusable_repos, tenant_parser)
+        scrape_full(
+            connections, reusable_repos, tenant_parser, engine=engine, shard=shard
+        )
     elif repo:
-        scrape_full(connections, reusable_repos, tenant_parser, repos=repo)
+        scrape_full(
+            connections,
+            reusable_repos,
+            tenant_parser,
+            repos=repo,
+            engine=engine,
+            shard=shard,
+        )
     else:
         # Listen to ZMQ messages
         socket_addr = config.get("ZMQ_SUB_SOCKET_ADDRESS")
         timeout = config.get("ZMQ_SUB_TIMEOUT")
-        socket = create_zmq_socket(socket_addr, timeout)
+        event_streams = create_event_streams(connections)
+        socket = create_zmq_socket(
+            socket_addr, timeout, local_events=bool(event_streams)
+        )
+        for event_stream in event_streams:
+            event_stream.start()
+        scrape_queue = ScrapeQueue(shard=shard)
+        heads_list_times = {}
+        last_depth_report = None
+        # Pick up the changes of the tenant sources while we were down
+        apply_tenant_diff(
+            stored_tenant_diff(tenant_parser), tenant_parser, scrape_queue
+        )
 
         while True:
+            # Pick up changes of the tenant sources (file)
+            apply_tenant_diff(tenant_parser.refresh(), tenant_parser, scrape_queue)
+
             # Check if a periodic run is necessary
             LOGGER.debug("Checking for outdated repos")
-            scrape_outdated(
-                config, connections, reusable_repos, tenant_parser, repo_cache
+            queue_outdated(config, repo_cache, scrape_queue)
+            # Pick up the repos whose HEAD moved (if it can be listed in bulk)
+            queue_moved(
+                connections, tenant_parser, repo_cache, scrape_queue, heads_list_times
             )
 
-            # Listen to ZMQ messages (if configured) or wait
-            if socket is None:
-                LOGGER.debug(
-                    "No ZMQ socket configured. Just going to wait for %d seconds.",
-                    timeout,
-                )
-                time.sleep(timeout)
-            else:
-                # Check for incoming messages on ZMQ
-                LOGGER.debug("Checking for incoming ZMQ messages")
-                try:
-                    event, payload = socket.recv_multipart()
-                    handle_event(
-                        event.decode("utf-8"),
-                        json.loads(payload.decode("utf-8")),
-                        connections,
-                        reusable_repos,
-                        tenant_parser,
-                        repo_cache,
-                    )
-                except zmq.error.Again:
-                    # If no message was received until the timeout, ZMQ throws
-                    # zmq.error.Again: Resource temporarily unavailable
-                    LOGGER.debug("Did not receive any ZMQ message")
-
-
-def create_zmq_socket(socket_addr, timeout):
+            # Only wait for new events if there is nothing left to do, but
+            # not longer than until the next periodic scrape is due.
+            # Otherwise, just collect the events which were already received,
+            # so they can be prioritized against the pending requests.
+            wait_timeout = 0 if scrape_queue else timeout
+            next_due = repo_cache.seconds_until_due()
+            if next_due is not None and timeout:
+                wait_timeout = min(wait_timeout, next_due)
+            receive_events(
+                socket, wait_timeout, connections, tenant_parser, scrape_queue
+            )
+
+            last_depth_report = report_queue_depth(scrape_queue, last_depth_report)
+            process_scrape_queue(
+                scrape_queue,
+                connections,
+                reusable_repos,
+                tenant_parser,
+                repo_cache,
+                engine,
+                shard,
+            )
+
+
+def create_zmq_socket(socket_addr, timeout, local_events=False):
     socket = None
-    if socket_addr and timeout:
-        context = zmq.Context()
+    if (socket_addr or local_events) and timeout:
+        # NOTE (felix): The event streams of the scraper itself use the same
+        # context, as inproc sockets can't be shared across contexts.
+        context = zmq.Context.instance()
         socket = context.socket(zmq.SUB)
-        socket.connect(socket_addr)
+        if socket_addr:
+            socket.connect(socket_addr)
+        if local_events:
+            socket.bind(LOCAL_EVENTS_ADDRESS)
         socket.setsockopt_string(zmq.SUBSCRIBE, "")
         # Timeout is in seconds, but ZMQ uses milliseconds
         socket.setsockopt(zmq.RCVTIMEO, timeout * 1000)
@@ -293,12 +434,20 @@ def init_connections(config):
     init_elasticsearch_con(**es_config)
     init_elasticsearch_documents()
 
+    connections = create_connections(config)
+    for con in connections.values():
+        con.init()
+    return connections
+
+
+def create_connections(config):
     connections = {}
     for con_name, con_data in config["CONNECTIONS"].items():
         # Look up the connection provider and initialize it with the remaining
         # config keys. Abstraction for e.g. the following:
         # gh_con = GitHubConnection(**con_data)
         # connections['github'] = gh_con
+        con_data = dict(con_data)
         provider = con_data.pop("provider")
         con_class = CONNECTIONS.get(provider)
         if not con_class:
@@ -307,22 +456,51 @@ def init_connections(config):
                 " available.".format(con_name, provider)
             )
 
-        con = con_class(**con_data)
-        con.init()
-        connections[con_name] = con
+        connections[con_name] = con_class(**con_data)
     return connections
 
 
-def scrape_outdated(config, connections, reusable_repos, tenant_parser, repo_cache):
+def create_event_streams(connections):
+    """Create a listener for each connection which provides an event stream."""
+    event_streams = []
+    for con_name, con in connections.items():
+        get_events_command = getattr(con, "get_events_command", None)
+        command = get_events_command() if get_events_command else None
+        if command:
+            event_streams.append(GerritEventStream(con_name, command))
+    return event_streams
+
+
+def init_engine(config, connections, reusable_repos):
+    engine_type = config.get("SCRAPE_ENGINE", "sync")
+    engine_class = ENGINES.get(engine_type)
+    if not engine_class:
+        raise ScraperConfigurationError(
+            "Could not init scrape engine. Specified engine '{}' is not "
+            "available.".format(engine_type)
+        )
+
+    interval_policy = ScrapeIntervalPolicy.from_config(config)
+    if engine_class is AsyncScrapeEngine:
+        return AsyncScrapeEngine(
+            connections,
+            reusable_repos,
+            concurrency=config.get("SCRAPE_CONCURRENCY"),
+            interval_policy=interval_policy,
+            prefetch=config.get("SCRAPE_PREFETCH", 0),
+        )
+    return engine_class(
+        connections,
+        reusable_repos,
+        interval_policy=interval_policy,
+        prefetch=config.get("SCRAPE_PREFETCH", 0),
+    )
+
+
+def queue_outdated(config, repo_cache, scrape_queue):
     scrape_interval = config["FORCE_SCRAPE_INTERVAL"]
-    repo_list = []
-    now = datetime.now(timezone.utc)
-    threshold = now - timedelta(hours=scrape_interval)
-    # Check the repo cache for entries older than 24 hours
-    for key, val in repo_cache.items():
-        # TODO We should clean up repos containing 'None' providers some time
-        if val["scrape_time"] < threshold and val.get("provider") is not None:
-            repo_list.append(key)
+    # Repos which are already queued will be scraped anyway
+    repo_list = [r for r in repo_cache.pop_due() if r not in scrape_queue]
 
     if repo_list:
         LOGGER.info(
@@ -330,23 +508,279 @@ def scrape_outdated(config, connections, reusable_repos, tenant_parser, repo_cac
             scrape_interval,
             repo_list,
         )
-        scrape_repo_list(
-            repo_list, connections, reusable_repos, tenant_parser, repo_cache=repo_cache
-        )
+        scrape_queue.put(repo_list, PRIORITY_PERIODIC)
     else:
-        LOGGER.info(
-            "Found no repos which weren't scraped for %d hours: %s",
-            scrape_interval,
+        LOGGER.debug(
+            "Found no repos which weren't scraped for %d hours", scrape_interval
+        )
+
+
+def queue_moved(connections, tenant_parser, repo_cache, scrape_queue, list_times):
+    """Queue the repos whose HEAD differs from the last scraped one.
+
+    This is only done for connections which list the HEADs of all their repos
+    at once (see GerritConnection.get_head_shas()), so no repo must be
+    fetched for this.
+
+    list_times keeps the time of the last checked listing per connection, so
+    the repos are only checked again once the HEADs were listed anew.
+    """
+    for con_name, con in connections.items():
+        get_head_shas = getattr(con, "get_head_shas", None)
+        heads = get_head_shas() if get_head_shas else None
+        if heads is None or list_times.get(con_name) == heads.list_time:
+            continue
+        # NOTE (felix): Repos which are skipped below (because they are queued
+        # or were scraped after the listing) don't need another check, as
+        # their scraping updates the cached HEAD anyway.
+        list_times[con_name] = heads.list_time
+
+        repo_list = []
+        for repo_name, repo_data in tenant_parser.repo_map.items():
+            if (
+                repo_data.get("connection_name") != con_name
+                or repo_name in scrape_queue
+            ):
+                continue
+            cached_repo = repo_cache.get(repo_name)
+            # NOTE (felix): Unknown repos are scraped anyway. If the repo was
+            # scraped after the listing, its HEAD might be newer.
+            if (
+                cached_repo is None
+                or cached_repo.head_sha is None
+                or cached_repo.scrape_time >= heads.list_time
+            ):
+                continue
+            head_sha = heads.shas.get(repo_name)
+            if head_sha is not None and head_sha != cached_repo.head_sha:
+                repo_list.append(repo_name)
+
+        if repo_list:
+            LOGGER.info("Found repos whose HEAD moved: %s", repo_list)
+            scrape_queue.put(repo_list, PRIORITY_PUSH)
+
+
+def apply_tenant_diff(diff, tenant_parser, scrape_queue):
+    """Queue or update the repositories which changed in the tenant sources."""
+    if not diff:
+        return
+
+    # Only the tenants of the changed repositories are different, so we can
+    # update them in place instead of scraping the repositories again.
+    rescrape = update_tenants(diff.changed, tenant_parser.repo_map, scrape_queue.shard)
+    scrape_queue.put(diff.added + diff.rescrape + rescrape, PRIORITY_INSTALLATION)
+    # Delete all data of the repositories which are no longer part of our
+    # tenant sources.
+    scrape_queue.put(diff.removed, PRIORITY_INSTALLATION, delete_only=True)
+
+
+def stored_tenant_diff(tenant_parser):
+    """Compare the tenant sources with the ones of the last scraping.
+
+    The tenant config of each repo is stored with the repo in Elasticsearch,
+    so this also covers the changes which were made while the scraper was
+    not running.
+    """
+    stored_repo_map = GitRepo.stored_repo_map()
+    for repo_name, repo_data in stored_repo_map.items():
+        # NOTE (felix): Repos which were stored before we kept track of their
+        # tenant config are considered unchanged.
+        if repo_data is None:
+            stored_repo_map[repo_name] = tenant_parser.repo_map.get(repo_name, {})
+    diff = TenantDiff(
+        stored_repo_map,
+        tenant_parser.repo_map,
+        tenant_parser.tenants,
+        tenant_parser.tenants,
+    )
+    if diff:
+        LOGGER.info("Tenant sources changed since the last scraping: %s", diff)
+    return diff
+
+
+def update_tenants(repo_names, repo_map, shard=None):
+    """Update the tenants of all jobs and roles of the given repositories.
+
+    Returns the repositories which must be scraped instead.
+    """
+    if shard is not None:
+        repo_names = shard.filter(repo_names)
+
+    rescrape = []
+    for repo_name in repo_names:
+        repo_tenants = repo_map[repo_name]["tenants"]
+        # NOTE (felix): Jobs which were stored before we kept track of their
+        # file path can't be assigned to the tenants of an extra config path.
+        if repo_tenants.get("extra_config_paths") and ZuulJob.count_without_file_path(
+            repo_name
+        ):
+            LOGGER.info(
+                "Jobs of repo '%s' have no file path, scraping it instead", repo_name
+            )
+            rescrape.append(repo_name)
+            continue
+
+        LOGGER.info("Updating tenants of repo '%s'", repo_name)
+        try:
+            updated_jobs = ZuulJob.update_tenants(repo_name, repo_tenants)
+            updated_roles = AnsibleRole.update_tenants(repo_name, repo_tenants)
+        except ApiError:
+            LOGGER.exception(
+                "Updating tenants of repo '%s' failed, scraping it instead", repo_name
+            )
+            rescrape.append(repo_name)
+            continue
+        uuid = hashlib.sha1(str.encode(repo_name)).hexdigest()
+        try:
+            GitRepo(meta={"id": uuid}).update_tenant_config(repo_map[repo_name])
+        except ApiError:
+            # The repo is compared with its outdated config on the next start,
+            # which only updates its tenants once more.
+            LOGGER.exception("Could not store tenant config of repo '%s'", repo_name)
+        LOGGER.debug(
+            "Updated %d jobs and %d roles of repo '%s'",
+            updated_jobs,
+            updated_roles,
+            repo_name,
+        )
+    return rescrape
+
+
+def receive_events(socket, timeout, connections, tenant_parser, scrape_queue):
+    """Wait up to timeout seconds for events and handle all available ones."""
+    if socket is None:
+        if timeout:
+            LOGGER.debug(
+                "No ZMQ socket configured. Just going to wait for %d seconds.",
+                timeout,
+            )
+            time.sleep(timeout)
+        return
+
+    # Check for incoming messages on ZMQ
+    LOGGER.debug("Checking for incoming ZMQ messages")
+    # Timeout is in seconds, but ZMQ uses milliseconds
+    if not socket.poll(timeout * 1000):
+        LOGGER.debug("Did not receive any ZMQ message")
+        return
+
+    while True:
+        try:
+            frames = socket.recv_multipart(zmq.NOBLOCK)
+        except zmq.error.Again:
+            # If no further message is available, ZMQ throws
+            # zmq.error.Again: Resource temporarily unavailable
+            return
+
+        event, payload = frames
+        payload = json.loads(payload.decode("utf-8"))
+        # The delivery ID is only provided by newer versions of Zubbi web
+        delivery_id = payload.pop("delivery_id", None)
+        if scrape_queue.is_duplicate(delivery_id):
+            LOGGER.info("Skipping already received event delivery %s", delivery_id)
+            continue
+
+        handle_event(
+            event.decode("utf-8"), payload, connections, tenant_parser, scrape_queue
+        )
+
+
+def report_queue_depth(scrape_queue, last_report):
+    """Log the pending scrape requests once per QUEUE_DEPTH_INTERVAL.
+
+    Returns the time of the last report.
+    """
+    now = time.monotonic()
+    if last_report is not None and now - last_report < QUEUE_DEPTH_INTERVAL:
+        return last_report
+    LOGGER.info("Pending scrape requests: %s", scrape_queue.depth())
+    return now
+
+
+def process_scrape_queue(
+    scrape_queue,
+    connections,
+    reusable_repos,
+    tenant_parser,
+    repo_cache,
+    engine,
+    shard=None,
+):
+    """Handle the next batch of requests from the scrape queue."""
+    batch = scrape_queue.pop_batch(engine.batch_size)
+    if not batch:
+        return
+    prefetch_upcoming(batch, scrape_queue, tenant_parser, engine)
+
+    repo_list = [request.repo_name for request in batch]
+    # Some requests might be limited to the changed paths of a repository
+    paths = {
+        request.repo_name: request.paths
+        for request in batch
+        if request.paths is not None
+    }
+    try:
+        scrape_repo_list(
             repo_list,
+            connections,
+            reusable_repos,
+            tenant_parser,
+            repo_cache=repo_cache,
+            delete_only=batch[0].delete_only,
+            engine=engine,
+            shard=shard,
+            # Periodic scrapes are only necessary if the repos changed.
+            # Events or tenant changes always require a scraping.
+            skip_unchanged=batch[0].priority == PRIORITY_PERIODIC,
+            paths=paths,
+        )
+    except Exception:
+        LOGGER.exception("Error while scraping repos %s", repo_list)
+
+
+def prefetch_upcoming(batch, scrape_queue, tenant_parser, engine):
+    """Let the engine check out the next repositories in the background."""
+    if engine.fetch_pool is None:
+        return
+    requests = [
+        request
+        for request in batch + scrape_queue.upcoming(engine.fetch_pool.size)
+        if not request.delete_only and request.repo_name in tenant_parser.repo_map
+    ]
+    # Drop the prefetched repos which are not needed anymore
+    engine.fetch_pool.retain({request.repo_name for request in requests})
+    for request in requests:
+        # A repo which was prefetched before another request was coalesced
+        # into its request (e.g. for a push) must be fetched again.
+        engine.prefetch(
+            request.repo_name,
+            tenant_parser.repo_map[request.repo_name],
+            token=(request.sequence, request.revision),
         )
 
 
-def scrape_full(connections, reusable_repos, tenant_parser, repos=None):
+def scrape_full(
+    connections, reusable_repos, tenant_parser, repos=None, engine=None, shard=None
+):
     if repos is None:
         # If we don't have any repos provided, we get all available once from the
         # tenant configuration
-        tenant_parser.parse()
+        tenant_parser.refresh()
+        # The repos which were removed from the tenant sources since the last
+        # scraping won't be part of the repo_map, so they are deleted.
+        removed = stored_tenant_diff(tenant_parser).removed
+        if removed:
+            scrape_repo_list(
+                removed,
+                connections,
+                reusable_repos,
+                tenant_parser,
+                delete_only=True,
+                shard=shard,
+            )
         repo_map = tenant_parser.repo_map
+        if shard is not None:
+            repo_map = {k: v for k, v in repo_map.items() if shard.owns(k)}
         tenant_list = tenant_parser.tenants
         scrape_time = datetime.now(timezone.utc)
         _scrape_repo_map(
@@ -355,11 +789,19 @@ def scrape_full(connections, reusable_repos, tenant_parser, repos=None):
             connections,
             reusable_repos,
             scrape_time,
-            repo_cache={},
+            repo_cache=RepoCache(),
             delete_only=False,
+            engine=engine,
         )
     else:
-        scrape_repo_list(repos, connections, reusable_repos, tenant_parser)
+        scrape_repo_list(
+            repos,
+            connections,
+            reusable_repos,
+            tenant_parser,
+            engine=engine,
+            shard=shard,
+        )
 
 
 def scrape_repo_list(
@@ -369,23 +811,35 @@ def scrape_repo_list(
     tenant_parser,
     repo_cache=None,
     delete_only=False,
+    engine=None,
+    shard=None,
+    skip_unchanged=False,
+    paths=None,
 ):
     scrape_time = datetime.now(timezone.utc)
 
     # Simplify the usage of a non-existing repo cache
     if repo_cache is None:
-        repo_cache = {}
+        repo_cache = RepoCache()
+
+    # Only handle repositories of our own shard. The other ones are scraped
+    # (or deleted) by the scraper instance owning them.
+    if shard is not None:
+        foreign_repos = [r for r in repo_list if not shard.owns(r)]
+        if foreign_repos:
+            LOGGER.info(
+                "Skipping repositories which are owned by other shards: %s",
+                foreign_repos,
+            )
+        repo_list = shard.filter(repo_list)
 
     # Keep track on repositories that are no longer part of our tenant config
     # and thus should be deleted from Elasticsearch. Otherwise, Zubbi will loop
     # over them each time once they become outdated (older than 24 hours).
     invalid_repo_map = {}
 
-    # Update tenant sources
-    # TODO (fschmidt): This should not be necessary for each scraping. But, as we
-    # don't have a mechanism yet to filter for the necessary events, we keep it
-    # like this.
-    tenant_parser.parse()
+    # NOTE (felix): The tenant sources are kept up to date by the caller, so
+    # we don't have to parse them for every scraping.
     repo_map = tenant_parser.repo_map
     tenant_list = tenant_parser.tenants
     filtered_repo_map = {}
@@ -439,11 +893,23 @@ def scrape_repo_list(
         scrape_time,
         repo_cache,
         delete_only,
+        engine,
+        skip_unchanged,
+        paths,
     )
 
 
 def _scrape_repo_map(
-    repo_map, tenants, connections, reusable_repos, scrape_time, repo_cache, delete_only
+    repo_map,
+    tenants,
+    connections,
+    reusable_repos,
+    scrape_time,
+    repo_cache,
+    delete_only,
+    engine=None,
+    skip_unchanged=False,
+    paths=None,
 ):
     # TODO It would be great if the tenant_list contains only the relevant tenants based
     # on the repository map (or whatever is the correct source). In other words:
@@ -473,30 +939,30 @@ def _scrape_repo_map(
         # This would also mean, that the tenant_configuration needs to be kept
         # in memory, e.g. in the TenantScraper itself (something like the prime
         # and reprime of the installations in the GitHub connection)
-        # We also need to identify the repos that were added to / removed from
-        # the tenant configuration in the push event.
 
         # Update tenant sources
 
         # First, store the tenants in Elasticsearch
         LOGGER.info("Updating %d tenant definitions in Elasticsearch", len(tenant_list))
-        ZuulTenant.bulk_save(tenant_list)
+        try:
+            ZuulTenant.bulk_save(tenant_list)
+        except ApiError:
+            LOGGER.exception("Unable to store the tenant definitions")
 
         LOGGER.info("Scraping the following repositories: %s", repo_list)
 
+        scrape_map = {}
         for repo_name, repo_data in repo_map.items():
-            # Extract the data from the repo_data
-            tenants = repo_data["tenants"]
+            # Update the scrape time in cache, this also schedules the next
+            # periodic scrape for this repo.
             connection_name = repo_data["connection_name"]
-
-            cached_repo = repo_cache.setdefault(repo_name, repo_data)
-
-            # Update the scrape time in cache
-            cached_repo["scrape_time"] = scrape_time
-
-            # Initialize the repository for scraping
             con = connections.get(connection_name)
-            if not con:
+            repo_cache.update(
+                repo_name, scrape_time, con.provider if con is not None else None
+            )
+
+            # Check if the repository can be initialized for scraping
+            if con is None:
                 LOGGER.error(
                     "Checkout of repo '%s' failed. No connection named '%s' found. "
                     "Please check your configuration file.",
@@ -507,36 +973,42 @@ def _scrape_repo_map(
                 # data (which would be all data in this case) won't be deleted.
                 repo_list.remove(repo_name)
                 continue
-            provider = con.provider
-            repo_class = REPOS.get(provider)
-            repo = repo_class(repo_name, con)
-
-            # Check if the repo was created successfully, if not, skip it.
-            # Possible reasons are e.g: No access (via GitHub app or Gerrit user),
-            # Clone/checkout failures for plain git repos or similar.
-            if not repo._repo:
-                LOGGER.error(
-                    "Repo '%s' could not be initialized. Skip scraping.", repo_name
-                )
-                continue
-
-            # Build the data for the repo itself to be stored in Elasticsearch
-            uuid = hashlib.sha1(str.encode(repo_name)).hexdigest()
-            es_repo = GitRepo(meta={"id": uuid})
-            es_repo.repo_name = repo_name
-            es_repo.scrape_time = scrape_time
-            es_repo.provider = provider
-
-            # scrape the repo if is part of the tenant config
-            scrape_repo(repo, tenants, reusable_repos, scrape_time)
+            scrape_map[repo_name] = repo_data
 
-            # Store the information for the repository itself, if it was scraped successfully
-            LOGGER.info("Updating repo definition for '%s' in Elasticsearch", repo_name)
-            GitRepo.bulk_save([es_repo])
+        if engine is None:
+            engine = ScrapeEngine(connections, reusable_repos)
+        if skip_unchanged:
+            _touch_unchanged_repos(
+                scrape_map, connections, repo_cache, engine, scrape_time
+            )
+        results = engine.scrape(scrape_map, scrape_time, paths=paths) or {}
+        failed_repos = [r for r in scrape_map if r not in results]
+        if failed_repos:
+            LOGGER.warning(
+                "Keeping the data of repos which couldn't be scraped: %s",
+                failed_repos,
+            )
+            # NOTE (felix): The failure might be temporary (e.g. a connection
+            # error), so the outdated data of those repos must not be deleted.
+            for repo_name in failed_repos:
+                repo_list.remove(repo_name)
+        # Schedule the next periodic scrape based on how often the repo changes
+        for repo_name, result in results.items():
+            repo_cache.update(
+                repo_name,
+                scrape_time,
+                interval=result.scrape_interval,
+                head_sha=result.head_sha,
+                changed_at=result.changed_at,
+            )
     else:
-        # Delete the repositories from the repo_cache
+        # Delete the repositories from the repo_cache and their local clones
         for repo_name in repo_list:
-            repo_cache.pop(repo_name, None)
+            repo_cache.remove(repo_name)
+            for con in connections.values():
+                workspace = getattr(con, "workspace", None)
+                if workspace is not None:
+                    workspace.remove(repo_name)
 
     # In both cases we want to delete outdated data.
     # In case of delete_only, this will be everything!
@@ -555,32 +1027,38 @@ def _scrape_repo_map(
     )
 
 
-def scrape_repo(repo, tenants, reusable_repos, scrape_time):
-    job_files, role_files = Scraper(
-        repo,
-        tenants.get("extra_config_paths", {}),
-    ).scrape()
-
-    is_reusable_repo = repo.repo_name in reusable_repos
-    jobs = []
-    roles = []
-    try:
-        jobs, roles = RepoParser(
-            repo,
-            tenants,
-            job_files,
-            role_files,
-            scrape_time,
-            is_reusable_repo,
-        ).parse()
-    except Exception:
-        LOGGER.exception("Unable to parse job or role definitions in repo '%s'", repo)
-
-    LOGGER.info("Updating %d job definitions in Elasticsearch", len(jobs))
-    ZuulJob.bulk_save(jobs)
+def _touch_unchanged_repos(scrape_map, connections, repo_cache, engine, scrape_time):
+    """Only update the scrape time of repos whose HEAD didn't move.
 
-    LOGGER.info("Updating %d role definitions in Elasticsearch", len(roles))
-    AnsibleRole.bulk_save(roles)
+    The repos are removed from the scrape_map, so they are not scraped.
+    """
+    for repo_name, repo_data in list(scrape_map.items()):
+        cached_repo = repo_cache.get(repo_name)
+        if (
+            cached_repo is None
+            or cached_repo.head_sha is None
+            or cached_repo.changed_at is None
+        ):
+            continue
+
+        con = connections[repo_data["connection_name"]]
+        head_sha = con.get_head_sha(repo_name)
+        if head_sha is None or head_sha != cached_repo.head_sha:
+            continue
+
+        # NOTE (felix): If the scrape time can't be updated, the repo is
+        # scraped. Otherwise, its data would be deleted as outdated.
+        try:
+            interval = engine.touch(repo_name, scrape_time, cached_repo.changed_at)
+        except Exception:
+            LOGGER.exception(
+                "Unable to update unchanged repo '%s', scraping it instead", repo_name
+            )
+            continue
+        if interval is None:
+            continue
+        repo_cache.update(repo_name, scrape_time, interval=interval)
+        del scrape_map[repo_name]
 
 
 def delete_outdated(scrape_time, indices, extra_filter=None):
@@ -604,9 +1082,7 @@ def delete_outdated(scrape_time, indices, extra_filter=None):
 # TODO (fschmidt): Maybe it's worth to move the event_* methods to a GitHubEventHandler
 # class or similar. This way, we could encapsulate different events in their respective
 # environment (e.g. GitHub, Gerrit, ...)
-def handle_event(
-    event, payload, connections, reusable_repos, tenant_parser, repo_cache
-):
+def handle_event(event, payload, connections, tenant_parser, scrape_queue):
     LOGGER.info("Handling event '%s'", event)
     try:
         # TODO (fschmidt): Maybe we should change this file/module to be a class
@@ -623,14 +1099,14 @@ def handle_event(
         # TODO (fschmidt): What about 'repository' events?
         # To get updates for public/private?
         # https://developer.github.com/v3/activity/events/types/#repositoryevent
-        method(payload, connections, reusable_repos, tenant_parser, repo_cache)
+        method(payload, connections, tenant_parser, scrape_queue)
     except Exception:
         # TODO (fschmidt): Does it make sense to catch an Exception here?
         # Could we catch anything more specific?
         LOGGER.exception("Error while handling event '%s'", event)
 
 
-def event_installation(payload, connections, reusable_repos, tenant_parser, repo_cache):
+def event_installation(payload, connections, tenant_parser, scrape_queue):
     action = payload.get("action")
     installation_id = payload.get("installation", {}).get("id")
     repositories = payload.get("repositories", [])
@@ -646,13 +1122,7 @@ def event_installation(payload, connections, reusable_repos, tenant_parser, repo
         # Get list of repos from the payload
         repo_names = [r["full_name"] for r in repositories]
         # Scrape them
-        scrape_repo_list(
-            repo_names,
-            connections,
-            reusable_repos,
-            tenant_parser,
-            repo_cache=repo_cache,
-        )
+        scrape_queue.put(repo_names, PRIORITY_INSTALLATION)
 
     if action == "deleted":
         LOGGER.info("Deleting data for installation %d", installation_id)
@@ -676,21 +1146,12 @@ def event_installation(payload, connections, reusable_repos, tenant_parser, repo
             )
             return
         # Delete all data for those repos
-        scrape_repo_list(
-            repositories,
-            connections,
-            reusable_repos,
-            tenant_parser,
-            repo_cache=repo_cache,
-            delete_only=True,
-        )
+        scrape_queue.put(repositories, PRIORITY_INSTALLATION, delete_only=True)
 
         # TODO (fschmidt): Should we remove them also from the installatino map?
 
 
-def event_installation_repositories(
-    payload, connections, reusable_repos, tenant_parser, repo_cache
-):
+def event_installation_repositories(payload, connections, tenant_parser, scrape_queue):
     installation_id = payload.get("installation", {}).get("id")
     repos_added = payload.get("repositories_added")
     repos_removed = payload.get("repositories_removed")
@@ -713,13 +1174,7 @@ def event_installation_repositories(
         # Get list of repos from the payload
         repo_names = [r["full_name"] for r in repos_added]
         # Scrape them
-        scrape_repo_list(
-            repo_names,
-            connections,
-            reusable_repos,
-            tenant_parser,
-            repo_cache=repo_cache,
-        )
+        scrape_queue.put(repo_names, PRIORITY_INSTALLATION)
 
     # Just delete the data for these repos
     if repos_removed is not None:
@@ -731,17 +1186,10 @@ def event_installation_repositories(
         # Get list of repos from the payload
         repo_names = [r["full_name"] for r in repos_removed]
         # Delete all data for those repos
-        scrape_repo_list(
-            repo_names,
-            connections,
-            reusable_repos,
-            tenant_parser,
-            repo_cache=repo_cache,
-            delete_only=True,
-        )
+        scrape_queue.put(repo_names, PRIORITY_INSTALLATION, delete_only=True)
 
 
-def event_push(payload, connections, reusable_repos, tenant_parser, repo_cache):
+def event_push(payload, connections, tenant_parser, scrape_queue):
     repo_name = payload.get("repository", {}).get("full_name")
     LOGGER.info("Handling push event for repo '%s'", repo_name)
     # NOTE (felix): We could use the installation_id later on, to update the
@@ -791,9 +1239,70 @@ def event_push(payload, connections, reusable_repos, tenant_parser, repo_cache):
 
     LOGGER.info("Handling push event for repo %s with ref %s", repo_name, ref)
 
-    scrape_repo_list(
-        [repo_name], connections, reusable_repos, tenant_parser, repo_cache=repo_cache
-    )
+    # A push to the tenant sources repo might change the tenant configuration
+    sources_repo = tenant_parser.sources_repo
+    if sources_repo is not None and sources_repo.repo_name == repo_name:
+        LOGGER.info("Tenant sources repo '%s' was updated", repo_name)
+        apply_tenant_diff(
+            tenant_parser.refresh(fetch=True), tenant_parser, scrape_queue
+        )
+
+    # Only the files changed by this push must be scraped
+    paths = _get_changed_paths(payload)
+    if paths is None:
+        LOGGER.info("Changed files of repo '%s' are not known", repo_name)
+    scrape_queue.put([repo_name], PRIORITY_PUSH, paths=paths)
+
+
+def event_gerrit_ref_updated(payload, connections, tenant_parser, scrape_queue):
+    ref_update = payload.get("refUpdate", {})
+    repo_name = ref_update.get("project")
+    ref = ref_update.get("refName", "")
+    # NOTE (felix): Older Gerrit versions send the branch name without the
+    # refs/heads/ prefix.
+    branch = ref[len("refs/heads/") :] if ref.startswith("refs/heads/") else ref
+    if branch != DEFAULT_BRANCH:
+        LOGGER.debug("Skipping update of ref %s in repo '%s'", ref, repo_name)
+        return
+
+    # A ref update in the tenant sources repo might change the tenant configuration
+    sources_repo = tenant_parser.sources_repo
+    if sources_repo is not None and sources_repo.repo_name == repo_name:
+        LOGGER.info("Tenant sources repo '%s' was updated", repo_name)
+        apply_tenant_diff(
+            tenant_parser.refresh(fetch=True), tenant_parser, scrape_queue
+        )
+
+    # Only repos from the tenant sources which are scraped via the connection
+    # providing the event are of interest.
+    repo_data = tenant_parser.repo_map.get(repo_name)
+    if repo_data is None or repo_data.get("connection_name") != payload.get(
+        "connection_name"
+    ):
+        LOGGER.debug("Repo '%s' is not part of the tenant sources", repo_name)
+        return
+
+    LOGGER.info("Handling ref update for repo '%s' with ref %s", repo_name, ref)
+    scrape_queue.put([repo_name], PRIORITY_PUSH)
+
+
+def _get_changed_paths(payload):
+    """Collect the paths changed by a push or None if they are incomplete."""
+    commits = payload.get("commits") or []
+    # NOTE (felix): GitHub only lists up to 20 commits in the payload. A force
+    # push might also remove commits which are not listed at all. An empty
+    # list is sent e.g. for a new branch.
+    if (
+        payload.get("forced")
+        or not commits
+        or len(commits) >= PUSH_PAYLOAD_COMMIT_LIMIT
+    ):
+        return None
+    paths = set()
+    for commit in commits:
+        for key in ("added", "modified", "removed"):
+            paths.update(commit.get(key) or [])
+    return paths
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+
+from zubbi import default_settings
+
+LOGGER = logging.getLogger(__name__)
+
+# Origin of the periodic scrape slots
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class CachedRepo:
+    __slots__ = (
+        "repo_name",
+        "provider",
+        "scrape_time",
+        "interval",
+        "head_sha",
+        "changed_at",
+        "due",
+    )
+
+    def __init__(self, repo_name, provider, scrape_time, interval=None):
+        self.repo_name = repo_name
+        self.provider = provider
+        self.scrape_time = scrape_time
+        # Individual scrape interval of this repo, if known
+        self.interval = interval
+        # HEAD SHA and time of the last change as of the last scraping
+        self.head_sha = None
+        self.changed_at = None
+        # Point in time when this repo must be scraped again
+        self.due = None
+
+    def __repr__(self):
+        return "CachedRepo({}, {}, {})".format(
+            self.repo_name, self.provider, self.scrape_time
+        )
+
+
+class RepoCache:
+    """Scrape times of all known repositories.
+
+    Besides the cached data, this keeps a min-heap of the points in time when
+    each repository must be scraped again. This way, we always know when the
+    next periodic scrape is due without checking all repositories.
+
+    Each repository can have its own scrape interval (e.g. based on how often
+    it changes). Otherwise, the default scrape_interval is used.
+
+    To not scrape all repositories at once (e.g. one scrape interval after a
+    full scrape), each repository is scraped up to jitter * scrape_interval
+    earlier. For this, the periodic scrapes are aligned to slots every
+    jitter * scrape_interval, with a phase derived from the repository name.
+    A repository is scheduled in the last of its slots within the scrape
+    interval, so it keeps its phase for each scrape and across restarts. In
+    addition, the number of periodic scrapes can be limited per time window.
+    """
+
+    def __init__(self, scrape_interval=None, jitter=0.0, limit=None, window=None):
+        if scrape_interval is None:
+            scrape_interval = timedelta(hours=default_settings.FORCE_SCRAPE_INTERVAL)
+        self.scrape_interval = scrape_interval
+        self.jitter = jitter
+        self.limit = limit
+        self.window = window or timedelta(seconds=default_settings.FORCE_SCRAPE_WINDOW)
+        self._repos = {}
+        # Heap of (due, repo_name) tuples. Entries which don't match the due
+        # time of the cached repo anymore are outdated and skipped.
+        self._heap = []
+        # Start of the current window and number of due repos in there
+        self._window_start = None
+        self._window_count = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            scrape_interval=timedelta(hours=config["FORCE_SCRAPE_INTERVAL"]),
+            jitter=config.get("FORCE_SCRAPE_JITTER", 0.0),
+            limit=config.get("FORCE_SCRAPE_LIMIT"),
+            window=timedelta(
+                seconds=config.get(
+                    "FORCE_SCRAPE_WINDOW", default_settings.FORCE_SCRAPE_WINDOW
+                )
+            ),
+        )
+
+    def update(
+        self,
+        repo_name,
+        scrape_time,
+        provider=None,
+        interval=None,
+        head_sha=None,
+        changed_at=None,
+    ):
+        """Store the scrape time of a repo and schedule its next scrape."""
+        cached_repo = self._repos.get(repo_name)
+        if cached_repo is None:
+            cached_repo = CachedRepo(repo_name, provider, scrape_time, interval)
+            self._repos[repo_name] = cached_repo
+        else:
+            cached_repo.scrape_time = scrape_time
+            if provider is not None:
+                cached_repo.provider = provider
+            if interval is not None:
+                cached_repo.interval = interval
+        if head_sha is not None:
+            cached_repo.head_sha = head_sha
+        if changed_at is not None:
+            cached_repo.changed_at = changed_at
+
+        # TODO We should clean up repos containing 'None' providers some time
+        if cached_repo.provider is None:
+            cached_repo.due = None
+            return
+        self._schedule(cached_repo, self._next_due(cached_repo, scrape_time))
+
+    def remove(self, repo_name):
+        # The heap entry becomes outdated and is skipped later on
+        self._repos.pop(repo_name, None)
+
+    def pop_due(self, now=None):
+        """Get the names of all repos whose periodic scrape is due.
+
+        The returned repos are scheduled again after another scrape interval,
+        in case they are not scraped successfully in the meantime.
+        """
+        now = now or datetime.now(timezone.utc)
+        self._update_window(now)
+        due_repos = []
+        while self._heap and self._heap[0][0] <= now:
+            if self.limit and self._window_count >= self.limit:
+                LOGGER.debug(
+                    "Reached limit of %d periodic scrapes, postponing the "
+                    "remaining ones to the next window",
+                    self.limit,
+                )
+                break
+            due, repo_name = heapq.heappop(self._heap)
+            cached_repo = self._repos.get(repo_name)
+            if cached_repo is None or cached_repo.due != due:
+                continue
+            due_repos.append(repo_name)
+            self._window_count += 1
+            self._schedule(cached_repo, self._next_due(cached_repo, now))
+        return due_repos
+
+    def seconds_until_due(self, now=None):
+        """Get the seconds until the next periodic scrape or None."""
+        now = now or datetime.now(timezone.utc)
+        while self._heap:
+            due, repo_name = self._heap[0]
+            cached_repo = self._repos.get(repo_name)
+            if cached_repo is not None and cached_repo.due == due:
+                self._update_window(now)
+                if self.limit and self._window_count >= self.limit:
+                    # Nothing can be scraped before the next window starts
+                    due = max(due, self._window_start + self.window)
+                return max((due - now).total_seconds(), 0)
+            # Drop the outdated entry
+            heapq.heappop(self._heap)
+        return None
+
+    def _interval(self, cached_repo):
+        return cached_repo.interval or self.scrape_interval
+
+    def _next_due(self, cached_repo, scrape_time):
+        latest = scrape_time + self._interval(cached_repo)
+        if not self.jitter:
+            return latest
+        period = self._interval(cached_repo) * self.jitter
+        phase = period * self._phase(cached_repo.repo_name)
+        # Last slot of the repo which is not later than one interval
+        return EPOCH + phase + period * ((latest - EPOCH - phase) // period)
+
+    @staticmethod
+    def _phase(repo_name):
+        # NOTE (felix): Python's hash() is salted per process, so we have to
+        # use a stable hash function to get the same phase after a restart.
+        digest = hashlib.sha1(str.encode(repo_name)).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32
+
+    def _update_window(self, now):
+        if self._window_start is None or now >= self._window_start + self.window:
+            self._window_start = now
+            self._window_count = 0
+
+    def _schedule(self, cached_repo, due):
+        cached_repo.due = due
+        heapq.heappush(self._heap, (due, cached_repo.repo_name))
+
+    def get(self, repo_name):
+        return self._repos.get(repo_name)
+
+    def __contains__(self, repo_name):
+        return repo_name in self._repos
+
+    def __iter__(self):
+        return iter(self._repos)
+
+    def __len__(self):
+        return len(self._repos)
@@ -23,12 +23,21 @@ from yaml.scanner import ScannerError
 
 from zubbi.doc import SphinxBuildError, render_file, render_sphinx
 from zubbi.models import AnsibleRole, ZuulJob
+from zubbi.scraper.scraper import JOB_FILE, ROLE
 from zubbi.utils import last_changed_from_blame_range
 
 LOGGER = logging.getLogger(__name__)
 
 
 class RepoParser:
+    # Information the parser uses per kind of scraped item, so the scraper
+    # doesn't have to collect anything else. The last change of a job is
+    # taken from the blame information of its lines.
+    required_info = {
+        JOB_FILE: ("blame", "content"),
+        ROLE: ("last_changed", "readme_file", "changelog_file"),
+    }
+
     def __init__(
         self,
         repo,
@@ -52,6 +61,13 @@ class RepoParser:
         repo_roles = self.parse_roles_dir()
         return repo_jobs, repo_roles
 
+    def parse_item(self, kind, name, info):
+        """Parse a single item yielded by Scraper.iter_files()."""
+        if kind == JOB_FILE:
+            LOGGER.debug("Checking for job definitions in %s", name)
+            return self.parse_job_definitions(name, info)
+        return [self.parse_role(name, info)]
+
     def parse_job_files(self):
         """Check for job definitions in known zuul files."""
         repo_jobs = []
@@ -70,13 +86,7 @@ class RepoParser:
         return repo_jobs
 
     def _get_job_tenants(self, file_path):
-        extra_config_paths = self.tenants.get("extra_config_paths", {})
-        tenants = self.tenants["jobs"]
-        for extra_config_path in extra_config_paths.keys():
-            if file_path.startswith(extra_config_path):
-                tenants = extra_config_paths[extra_config_path]
-                break
-        return tenants
+        return ZuulJob.tenants_for_file(self.tenants, file_path)
 
     def parse_job_definitions(self, file_path, job_info):
         try:
@@ -98,6 +108,10 @@ class RepoParser:
                 job.job_name = job_name
                 job.repo = self.repo.name
                 job.tenants = self._get_job_tenants(file_path)
+                # Needed to update the tenants of this job without scraping it
+                job.file_path = file_path
+                if "sha" in job_info:
+                    job.file_sha = job_info["sha"]
                 job.private = self.repo.private
                 job.scrape_time = self.scrape_time
                 job.line_start = job_def["__line_start__"]
@@ -136,46 +150,10 @@ class RepoParser:
         return jobs
 
     def parse_roles_dir(self):
-        repo_roles = []
-
-        for role_name, role_info in self.role_files.items():
-            # We will build the role data structure with or without description
-            uuid = hashlib.sha1(
-                str.encode("{}{}".format(self.repo, role_name))
-            ).hexdigest()
-            role = AnsibleRole(meta={"id": uuid})
-            role.role_name = role_name
-            role.repo = self.repo.name
-            role.tenants = self.tenants["roles"]
-            role.private = self.repo.private
-            role.url = self.repo.url_for_directory("roles/{}".format(role_name))
-            role.scrape_time = self.scrape_time
-            role.last_updated = role_info["last_changed"]
-
-            readme_file = role_info.get("readme_file")
-            if readme_file:
-                # Always store the raw description (can be rendered as fallback)
-                role.description = readme_file["content"]
-                rendered_content = render_file(readme_file)
-                if rendered_content:
-                    role.description_html = rendered_content.pop("html")
-                    # We might have gotten more results from the parsing (like platforms)
-                    # Thus, we simply store those return values directly in the role
-                    for k, v in rendered_content.items():
-                        setattr(role, k, v)
-
-            changelog_file = role_info.get("changelog_file")
-            if changelog_file:
-                # Always store the raw description (can be rendered as fallback)
-                role.changelog = changelog_file["content"]
-                rendered_content = render_file(changelog_file)
-                if rendered_content:
-                    role.changelog_html = rendered_content.pop("html")
-
-            # If the repo is configured as reusable, all roles are considered reusable
-            role.reusable = self.is_reusable_repo or bool(role.reusable)
-
-            repo_roles.append(role)
+        repo_roles = [
+            self.parse_role(role_name, role_info)
+            for role_name, role_info in self.role_files.items()
+        ]
 
         if not repo_roles:
             LOGGER.info("No role definitions found in repo '%s'", self.repo)
@@ -186,6 +164,45 @@ class RepoParser:
             # LOGGER.debug(json.dumps(repo_roles, indent=4))
         return repo_roles
 
+    def parse_role(self, role_name, role_info):
+        # We will build the role data structure with or without description
+        uuid = hashlib.sha1(str.encode("{}{}".format(self.repo, role_name))).hexdigest()
+        role = AnsibleRole(meta={"id": uuid})
+        role.role_name = role_name
+        role.repo = self.repo.name
+        role.tenants = self.tenants["roles"]
+        role.private = self.repo.private
+        role.url = self.repo.url_for_directory("roles/{}".format(role_name))
+        role.scrape_time = self.scrape_time
+        role.last_updated = role_info["last_changed"]
+        if "sha" in role_info:
+            role.tree_sha = role_info["sha"]
+
+        readme_file = role_info.get("readme_file")
+        if readme_file:
+            # Always store the raw description (can be rendered as fallback)
+            role.description = readme_file["content"]
+            rendered_content = render_file(readme_file)
+            if rendered_content:
+                role.description_html = rendered_content.pop("html")
+                # We might have gotten more results from the parsing (like platforms)
+                # Thus, we simply store those return values directly in the role
+                for k, v in rendered_content.items():
+                    setattr(role, k, v)
+
+        changelog_file = role_info.get("changelog_file")
+        if changelog_file:
+            # Always store the raw description (can be rendered as fallback)
+            role.changelog = changelog_file["content"]
+            rendered_content = render_file(changelog_file)
+            if rendered_content:
+                role.changelog_html = rendered_content.pop("html")
+
+        # If the repo is configured as reusable, all roles are considered reusable
+        role.reusable = self.is_reusable_repo or bool(role.reusable)
+
+        return role
+
 
 # Source: https://github.com/openstack-infra/zuul-sphinx/commit/3ef1afe17ee74f5420247463652efd71e6f1e406
 class ZuulSafeLoader(yaml.SafeLoader):
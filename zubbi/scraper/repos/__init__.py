@@ -14,6 +14,9 @@
 
 import abc
 
+# Map git object types to the content types used by GitHub
+CONTENT_TYPES = {"blob": "file", "tree": "dir", "commit": "submodule"}
+
 
 class Repository(abc.ABC):
     @abc.abstractmethod
@@ -52,5 +55,25 @@ class Repository(abc.ABC):
     def name(self):
         """Property for the name of the repository."""
 
+    def head_sha(self):
+        """Get the SHA of the default branch's HEAD commit.
+
+        Returns None if the repository can't provide this information.
+        """
+        return None
+
+    def refresh(self):
+        """Update the local state of this repository (if there is any)."""
+
+    def close(self):
+        """Release local resources once the repository was scraped."""
+
+    def prefetch(self, files):
+        """Make the contents of these files available for reading in one go.
+
+        The files are entries of a directory listing. This is only a hint, so
+        all files can still be read even if this does nothing.
+        """
+
     def __str__(self):
         return self.name
@@ -0,0 +1,124 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import tarfile
+import tempfile
+from pathlib import PurePosixPath
+
+from zubbi.scraper.exceptions import CheckoutError
+from zubbi.scraper.repos import CONTENT_TYPES
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ArchiveEntry:
+    """Minimalistic class that provides the same API as GitHub's Contents class."""
+
+    __slots__ = ("path", "name", "type", "sha")
+
+    def __init__(self, path, object_type, sha):
+        self.path = path
+        self.name = PurePosixPath(path).name
+        self.type = CONTENT_TYPES.get(object_type, object_type)
+        self.sha = sha
+
+
+class RepoArchive:
+    """Serve the contents of a repository's branch locally.
+
+    The listing of all files and directories (incl. their git SHAs) is
+    provided up front, e.g. from a single recursive tree request. The file
+    contents are read from a tarball of the same commit. The tarball is
+    downloaded to a temporary file on first access, so it's neither kept in
+    memory nor downloaded at all if no file content is needed.
+
+    download_tarball is a callable which writes the tarball to the given
+    file object and returns if this was successful.
+    """
+
+    def __init__(self, entries, download_tarball):
+        # Directory path (without leading or trailing slash) -> {name: entry}
+        self._directories = {"": {}}
+        for path, object_type, sha in entries:
+            entry = ArchiveEntry(path, object_type, sha)
+            parent = str(PurePosixPath(path).parent)
+            self._directories.setdefault(_normalize(parent), {})[entry.name] = entry
+            if entry.type == "dir":
+                self._directories.setdefault(path, {})
+        self._download_tarball = download_tarball
+        self._tarball = None
+        self._tar = None
+        self._members = None
+
+    @property
+    def file_count(self):
+        return sum(
+            1
+            for entries in self._directories.values()
+            for entry in entries.values()
+            if entry.type == "file"
+        )
+
+    def directory_contents(self, directory_path):
+        try:
+            return self._directories[_normalize(directory_path)]
+        except KeyError:
+            raise CheckoutError(directory_path, "Directory not found.")
+
+    def file_contents(self, file_path):
+        members = self._get_members()
+        member = members.get(_normalize(file_path))
+        if member is None:
+            raise CheckoutError(file_path, "File not found.")
+        if member.size == 0:
+            raise CheckoutError(file_path, "File is empty.")
+        with self._tar.extractfile(member) as f:
+            return f.read().decode("utf-8")
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+        if self._tarball is not None:
+            self._tarball.close()
+        self._tar = self._tarball = self._members = None
+
+    def _get_members(self):
+        if self._members is not None:
+            return self._members
+
+        LOGGER.debug("Downloading tarball")
+        tarball = tempfile.TemporaryFile(prefix="zubbi-")
+        if not self._download_tarball(tarball):
+            tarball.close()
+            raise CheckoutError("/", "Could not download tarball.")
+        tarball.seek(0)
+        self._tarball = tarball
+        self._tar = tarfile.open(fileobj=tarball, mode="r:*")
+
+        # NOTE (felix): The paths in the tarball are prefixed with a single
+        # top-level directory named after the repository and commit.
+        self._members = {}
+        for member in self._tar:
+            if not member.isfile():
+                continue
+            parts = member.name.split("/", 1)
+            if len(parts) == 2:
+                self._members[parts[1]] = member
+        return self._members
+
+
+def _normalize(path):
+    path = path.strip("/")
+    return "" if path == "." else path
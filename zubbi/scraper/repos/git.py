@@ -13,13 +13,15 @@
 # limitations under the License.
 
 import logging
+import shutil
+from datetime import datetime, timezone
 from pathlib import Path
 
 from git import Repo
-from git.exc import GitCommandError, InvalidGitRepositoryError
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 
 from zubbi.scraper.exceptions import CheckoutError
-from zubbi.scraper.repos import Repository
+from zubbi.scraper.repos import CONTENT_TYPES, Repository
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,57 +30,115 @@ LOGGER = logging.getLogger(__name__)
 # default branches, we have to find a way to implement this.
 DEFAULT_BRANCH = "master"
 
+# Partial clones only contain the commits and trees. The files (blobs) are
+# fetched when they are read.
+PARTIAL_CLONE_FILTER = "blob:none"
+
 
 class GitRepository(Repository):
-    def __init__(self, repo_name, git_con):
+    """Repository read from a bare clone in the connection's workspace.
+
+    By default, only the latest commit of the branch is cloned. With
+    depth=None, the whole history is cloned, which allows to get the last
+    changes and blame information locally. Each further scraping only
+    fetches the new commits of the branch.
+
+    With partial=True, the clone doesn't contain any files initially. Only
+    the files which are actually read are fetched (see prefetch()). If the
+    server doesn't support partial clones, git falls back to a full clone.
+    """
+
+    def __init__(
+        self, repo_name, git_con, branch=DEFAULT_BRANCH, depth=1, partial=True
+    ):
         self.repo_name = repo_name
-        self.workspace_dir = Path(git_con.workspace_dir)
-        # Build the remote url based on the gerrit connection parameters
-        self.remote_url = git_con.get_remote_url(repo_name)
-        self._repo = self._get_repo_object(retry=True)
+        self.git_con = git_con
+        self.workspace = git_con.workspace
+        self.workspace_dir = self.workspace.path
+        self.branch = branch
+        self.depth = depth
+        self.partial = partial
+        self.remote_url = None
+        # Don't let the workspace remove our clone while we are using it
+        self.workspace.acquire(repo_name)
+        self._closed = False
+        try:
+            self._repo = self._get_repo_object(retry=True)
+        except BaseException:
+            # Nobody can close us anymore, so the clone would stay in use
+            self.close()
+            raise
 
     def _get_repo_object(self, retry=False):
+        # Build the remote url based on the connection parameters. This is
+        # done for each clone/fetch as the credentials might have changed
+        # (e.g. an expired GitHub installation token).
+        self.remote_url = self.git_con.get_remote_url(self.repo_name)
+
+        # Other threads or scrapers must not modify the clone at the same time
+        with self.workspace.lock(self.repo_name):
+            repo = self._clone_or_fetch()
+
+        if repo is None and retry:
+            LOGGER.info("Retrying clone/fetch once")
+            return self._get_repo_object()
+
+        if repo is not None:
+            self.workspace.update(self.repo_name)
+        return repo
+
+    def _clone_or_fetch(self):
         # Clone the repository if it does not exist, otherwise just fetch it
         # and reset the HEAD.
         repo_src_path = self.workspace_dir / self.repo_name
-        repo = None
         if repo_src_path.exists():
             try:
                 repo = Repo(repo_src_path)
-                # TODO fetch and reset HEAD
-                # TODO Which remote?
-                repo.remotes["origin"].fetch(DEFAULT_BRANCH)
-            except GitCommandError as e:
-                LOGGER.error("Fetching repo '%s' failed: %s" % (self.repo_name, e))
-            except InvalidGitRepositoryError as e:
+            except (InvalidGitRepositoryError, NoSuchPathError) as e:
+                # E.g. an interrupted clone, so we better start from scratch
                 LOGGER.error(
-                    "Could not use existing repository in '%s': %s" % (repo_src_path, e)
-                )
-        else:
-            try:
-                repo = Repo.clone_from(
-                    self.remote_url, repo_src_path, bare=True, depth=1
+                    "Could not use existing repository in '%s', cloning it "
+                    "again: %s" % (repo_src_path, e)
                 )
-            except GitCommandError as e:
-                LOGGER.error("Cloning repo '%s' failed: %s" % (self.repo_name, e))
-
-        if repo is None and retry:
-            LOGGER.info("Retrying clone/fetch once")
-            return self._get_repo_object()
+                shutil.rmtree(repo_src_path, ignore_errors=True)
+            else:
+                try:
+                    # TODO Which remote?
+                    origin = repo.remotes["origin"]
+                    origin.set_url(self.remote_url)
+                    # NOTE (felix): A bare clone has no fetch refspec, so we
+                    # have to update the branch explicitly. Otherwise, only
+                    # FETCH_HEAD would point to the new commit.
+                    origin.fetch("+{0}:{0}".format(self.branch), depth=self.depth)
+                except GitCommandError as e:
+                    # Keep using the last fetched state of the repository
+                    LOGGER.error("Fetching repo '%s' failed: %s" % (self.repo_name, e))
+                return repo
 
-        return repo
+        try:
+            return Repo.clone_from(
+                self.remote_url,
+                repo_src_path,
+                bare=True,
+                depth=self.depth,
+                branch=self.branch,
+                filter=PARTIAL_CLONE_FILTER if self.partial else None,
+            )
+        except GitCommandError as e:
+            LOGGER.error("Cloning repo '%s' failed: %s" % (self.repo_name, e))
+            return None
 
     def file_contents(self, file_path):
         try:
             LOGGER.debug("Checking out '%s'", file_path)
-            content = self._repo.git.show("{}:{}".format(DEFAULT_BRANCH, file_path))
+            content = self._repo.git.show("{}:{}".format(self.branch, file_path))
             return content
         except GitCommandError as e:
             raise CheckoutError(file_path, e.stderr)
 
     def directory_contents(self, directory_path):
         LOGGER.debug("Listing contents of '%s' directory", directory_path)
-        command = ["git", "ls-tree", "--name-only", DEFAULT_BRANCH]
+        command = ["git", "ls-tree", self.branch]
         # git ls-tree uses the root of the repository automatically, if no path is provided
         # If we provide '/' instead, it will fail.
         if directory_path != "/":
@@ -89,21 +149,115 @@ class GitRepository(Repository):
             command.append(directory_path)
 
         try:
-            files = self._repo.git.execute(command).split()
+            output = self._repo.git.execute(command)
             # To be compatible with the current GitHub implementation, the resulting
             # dictionary must provide the filename as key and a Contents-like object
             # as value.
-            return {Path(f).name: FileContent(f) for f in files}
+            contents = {}
+            for line in output.splitlines():
+                # Each line has the format '<mode> <type> <sha>\t<path>'
+                info, path = line.split("\t", 1)
+                _, object_type, sha = info.split()
+                contents[Path(path).name] = FileContent(path, object_type, sha)
+            return contents
         except GitCommandError as e:
             raise CheckoutError(directory_path, e.stderr)
 
+    def prefetch(self, files):
+        if not self.partial or self._repo is None:
+            return
+        shas = [f.sha for f in files if f.sha]
+        if not shas:
+            return
+        LOGGER.debug("Fetching %d files of repo '%s'", len(shas), self.repo_name)
+        # NOTE (felix): This is the same command git uses to fetch a single
+        # missing file of a partial clone, but for all files at once. The
+        # negotiation is skipped as we only want these blobs.
+        command = [
+            "git",
+            "-c",
+            "fetch.negotiationAlgorithm=noop",
+            "fetch",
+            "origin",
+            "--no-tags",
+            "--no-write-fetch-head",
+            "--recurse-submodules=no",
+            "--filter={}".format(PARTIAL_CLONE_FILTER),
+            *shas,
+        ]
+        try:
+            with self.workspace.lock(self.repo_name):
+                self._repo.git.execute(command)
+        except GitCommandError as e:
+            # The files are still fetched one by one when they are read
+            LOGGER.warning(
+                "Could not fetch files of repo '%s': %s", self.repo_name, e.stderr
+            )
+
+    def head_sha(self):
+        try:
+            return self._repo.git.rev_parse(self.branch)
+        except GitCommandError as e:
+            LOGGER.warning(
+                "Could not get HEAD of repo '%s': %s", self.repo_name, e.stderr
+            )
+            return None
+
+    def refresh(self):
+        self._repo = self._get_repo_object(retry=True)
+
+    def close(self):
+        if not self._closed:
+            self.workspace.release(self.repo_name)
+            self._closed = True
+
     def last_changed(self, path):
-        # TODO Implement...
-        pass
+        # NOTE (felix): A shallow clone only knows the latest commit, which
+        # is not necessarily the one that changed this path.
+        if self.depth is not None:
+            return None
+        LOGGER.debug("Getting last changes for '%s'", path)
+        try:
+            timestamp = self._repo.git.log(
+                "-1", "--format=%ct", self.branch, "--", path
+            )
+        except GitCommandError as e:
+            LOGGER.warning("Could not get last changes for '%s': %s", path, e.stderr)
+            return None
+        return _commit_date(timestamp) if timestamp else None
 
     def blame(self, path):
-        # TODO Implement...
-        pass
+        if self.depth is not None:
+            return None
+        LOGGER.debug("Getting blame info for '%s'", path)
+        try:
+            output = self._repo.git.blame("--porcelain", self.branch, "--", path)
+        except GitCommandError as e:
+            LOGGER.warning("Could not get blame info for '%s': %s", path, e.stderr)
+            return []
+
+        # The porcelain format starts each group of lines from the same commit
+        # with '<sha> <orig_line> <final_line> <num_lines>'. The commit's
+        # details (e.g. 'committer-time <timestamp>') follow only the first
+        # group of each commit. The lines themselves are prefixed by a tab.
+        groups = []
+        commit_dates = {}
+        sha = None
+        for line in output.splitlines():
+            if line.startswith("\t"):
+                continue
+            fields = line.split(" ")
+            if len(fields) == 4 and len(fields[0]) == 40:
+                sha = fields[0]
+                groups.append((sha, int(fields[2]), int(fields[3])))
+            elif fields[0] == "committer-time":
+                commit_dates[sha] = _commit_date(fields[1])
+
+        # Use the same format as the GitHub blame
+        return [
+            {"start": start, "end": start + num_lines - 1, "date": commit_dates[sha]}
+            for sha, start, num_lines in groups
+        ]
 
     def url_for_file(self, file_path, highlight_start=None, highlight_end=None):
         # NOTE (fschmidt): This does not make sense for plain git repositories.
@@ -139,5 +293,13 @@ class GitRepository(Repository):
 class FileContent:
     """Minimalistic class that provides the same API as GitHub's Contents class."""
 
-    def __init__(self, path):
+    def __init__(self, path, object_type="blob", sha=None):
         self.path = path
+        self.name = Path(path).name
+        self.type = CONTENT_TYPES.get(object_type, object_type)
+        self.sha = sha
+
+
+def _commit_date(timestamp):
+    date = datetime.fromtimestamp(int(timestamp), timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -19,6 +19,8 @@ import requests
 
 from zubbi.scraper.exceptions import CheckoutError
 from zubbi.scraper.repos import Repository
+from zubbi.scraper.repos.archive import RepoArchive
+from zubbi.scraper.repos.git import GitRepository
 from zubbi.utils import urljoin
 
 LOGGER = logging.getLogger(__name__)
@@ -49,15 +51,44 @@ query ($owner: String!, $repo: String!, $path: String!) {
 
 
 class GitHubRepository(Repository):
+    """Repository accessed via the GitHub API.
+
+    The contents are either read via the contents API (one request per file
+    and directory) or from an archive of the default branch. The archive
+    mode needs one request for the listing of the whole repository and a
+    single tarball download. Depending on the connection's archive_mode, it
+    is used for all repositories or only for those with at least
+    archive_min_files files. Smaller repositories still use the listing, so
+    only their files are read via the contents API.
+
+    In the mirror mode, a bare clone of the repository is kept in the
+    connection's workspace and everything (incl. blame information and the
+    last changes) is read locally. After the initial clone, each scraping
+    only fetches the new commits of the default branch.
+    """
+
     def __init__(self, repo_name, gh_con):
         self.repo_name = repo_name
         self.gh_con = gh_con
+        self._head_sha = None
+        # Listing of the whole repository at _head_sha (see _get_archive())
+        self._listing = None
         self._repo = self._get_repo_object()
+        self._mirror = self._get_mirror()
+        self._archive = self._get_archive()
 
     def file_contents(self, file_path):
+        if self._mirror is not None:
+            return self._mirror.file_contents(file_path)
+        if self._archive is not None:
+            LOGGER.debug("Reading file content for '%s' from archive", file_path)
+            return self._archive.file_contents(file_path)
         try:
             LOGGER.debug("Getting file content for '%s'", file_path)
-            remote_file_content = self._repo.file_contents(file_path)
+            # Read the same commit as the listing (if any)
+            remote_file_content = self._repo.file_contents(
+                file_path, ref=self._head_sha
+            )
             if remote_file_content.size == 0:
                 raise CheckoutError(file_path, "File is empty.")
             return remote_file_content.decoded.decode("utf-8")
@@ -69,6 +100,10 @@ class GitHubRepository(Repository):
             raise CheckoutError(file_path, "Path is not a file.")
 
     def directory_contents(self, directory_path):
+        if self._mirror is not None:
+            return self._mirror.directory_contents(directory_path)
+        if self._listing is not None:
+            return self._listing.directory_contents(directory_path)
         try:
             LOGGER.debug("Listing contents of '%s' directory", directory_path)
             remote_directory = self._repo.directory_contents(
@@ -81,6 +116,8 @@ class GitHubRepository(Repository):
             raise CheckoutError(directory_path, "Path is not a directory")
 
     def last_changed(self, path):
+        if self._mirror is not None:
+            return self._mirror.last_changed(path)
         LOGGER.debug("Getting last changes for '%s'", path)
         # We are only interested in the first (newest) commit
         commits = self._repo.commits(path=path, per_page=1)
@@ -91,6 +128,8 @@ class GitHubRepository(Repository):
         return last_changed
 
     def blame(self, path):
+        if self._mirror is not None:
+            return self._mirror.blame(path)
         LOGGER.debug("Getting blame info for '%s'", path)
         # TODO (fschmidt): When blame is available in GitHub's V4 API, we should
         # switch to this. Until then, we could use the GraphQL to retrieve the
@@ -141,6 +180,86 @@ class GitHubRepository(Repository):
             LOGGER.exception("Unable to retrieve blame info for file %s", path)
         return flat_blame
 
+    def head_sha(self):
+        if self._mirror is not None:
+            return self._mirror.head_sha()
+        # The listing is bound to a single commit
+        if self._head_sha is not None:
+            return self._head_sha
+        try:
+            branch = self._repo.branch(self._repo.default_branch)
+            return branch.commit.sha
+        except github3.exceptions.GitHubException as e:
+            LOGGER.warning("Could not get HEAD of repo '%s': %s", self.repo_name, e)
+            return None
+
+    def refresh(self):
+        # Installation tokens expire after some time, so we better get a new
+        # client for this repo.
+        self.close()
+        self._repo = self._get_repo_object()
+        self._mirror = self._get_mirror()
+        self._archive = self._get_archive()
+
+    def close(self):
+        if self._mirror is not None:
+            self._mirror.close()
+            self._mirror = None
+        if self._archive is not None:
+            self._archive.close()
+        self._archive = self._listing = None
+        self._head_sha = None
+
+    def _get_mirror(self):
+        if self._repo is None or not self.gh_con.mirror:
+            return None
+        mirror = GitRepository(
+            self.repo_name,
+            self.gh_con,
+            branch=self._repo.default_branch,
+            depth=None,
+            partial=False,
+        )
+        if mirror._repo is None:
+            LOGGER.warning(
+                "Could not mirror repo '%s', falling back to the API", self.repo_name
+            )
+            mirror.close()
+            return None
+        return mirror
+
+    def _get_archive(self):
+        mode = self.gh_con.archive_mode
+        if self._repo is None or self._mirror is not None or mode == "never":
+            return None
+
+        head_sha = self.head_sha()
+        if head_sha is None:
+            return None
+        try:
+            tree = self._repo.tree(head_sha, recursive=True)
+        except github3.exceptions.GitHubException as e:
+            LOGGER.warning("Could not list repo '%s': %s", self.repo_name, e)
+            return None
+        # NOTE (felix): GitHub truncates the listing of very large
+        # repositories, so we can't rely on it in this case.
+        if tree.as_dict().get("truncated"):
+            LOGGER.info("Listing of repo '%s' is truncated", self.repo_name)
+            return None
+
+        archive = RepoArchive(
+            [(h.path, h.type, h.sha) for h in tree.tree or []],
+            lambda f: self._repo.archive("tarball", f, ref=head_sha),
+        )
+        # NOTE (felix): The HEAD and listing are used even if the files are
+        # read via the contents API, so they are not requested again.
+        self._head_sha = head_sha
+        self._listing = archive
+        if mode == "auto" and archive.file_count < self.gh_con.archive_min_files:
+            return None
+        LOGGER.info("Reading repo '%s' from archive", self.repo_name)
+        return archive
+
     def _get_repo_object(self):
         try:
             owner, repo_name = self.repo_name.split("/")
@@ -154,7 +273,11 @@ class GitHubRepository(Repository):
         return repo
 
     def url_for_file(self, file_path, highlight_start=None, highlight_end=None):
-        file_url = self._repo.file_contents(file_path).html_url
+        if self._listing is not None or self._mirror is not None:
+            # Avoid an API request per file, as the URL is well-known
+            file_url = urljoin(self.url, "blob", self._repo.default_branch, file_path)
+        else:
+            file_url = self._repo.file_contents(file_path).html_url
 
         if highlight_start is not None:
             file_url = "{}#L{}".format(file_url, highlight_start)
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import logging
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
 from zubbi.scraper.exceptions import CheckoutError
 
@@ -44,31 +44,95 @@ ROLE_MANDATORY_DIRS = [
 
 REPO_ROOT = "/"
 
+# Kinds of items yielded by Scraper.iter_files()
+JOB_FILE = "job"
+ROLE = "role"
+
+# Information which can be collected per kind of item. Each information
+# costs at least one request for remote repositories (e.g. GitHub).
+ITEM_INFO = {
+    JOB_FILE: ("last_changed", "blame", "content"),
+    ROLE: ("last_changed", "readme_file", "changelog_file"),
+}
+
 
 class Scraper:
-    def __init__(self, repo, extra_config_paths=None):
+    def __init__(
+        self,
+        repo,
+        extra_config_paths=None,
+        known_job_files=None,
+        known_roles=None,
+        item_info=None,
+    ):
         self.repo = repo
         self.extra_config_paths = (
             list(extra_config_paths.keys()) if extra_config_paths else []
         )
+        # Only the information required by the consumer (e.g. the RepoParser)
+        # is collected. By default, that's everything.
+        self.item_info = item_info or ITEM_INFO
+        # SHAs of the job files (blob) and role directories (tree) as of the
+        # last scraping. Entries whose SHA didn't change are not checked out
+        # again.
+        self.known_job_files = known_job_files or {}
+        self.known_roles = known_roles or {}
+        self.unchanged_job_files = {}
+        self.unchanged_roles = {}
+        # Whether only the files affected by the changed paths were scraped
+        self.limited = False
 
-    def scrape(self):
-        LOGGER.info("Scraping '%s'", self.repo.name)
+    def scrape(self, paths=None):
+        """Scrape the job files and roles of the repository at once."""
+        job_files = {}
+        role_files = {}
+        for kind, name, info in self.iter_files(paths):
+            if kind == JOB_FILE:
+                job_files[name] = info
+            else:
+                role_files[name] = info
+        # sort keys (role names) alphabetically
+        return job_files, {key: value for key, value in sorted(role_files.items())}
+
+    def iter_files(self, paths=None):
+        """Yield the job files and roles of the repository one by one.
+
+        Each item is a (kind, name, info) tuple with kind being JOB_FILE or
+        ROLE. As a job file or role directory is self-contained, it can be
+        parsed and indexed directly without keeping the whole repository in
+        memory.
 
-        # TODO (felix): Currently we are scraping all files of a single
-        # repository before we start parsing them. This might load a lot
-        # of files into memory. Could we change the workflow and fetch +
-        # parse each file directly. I'm not sure if we do some
-        # cross-references between files. I have to check this. At least
-        # for roles this shouldn't be a problem, as a single role
-        # directory is self-contained.
-        job_files = self.scrape_job_files()
-        role_files = self.scrape_role_files()
+        If the changed paths of the repository are known (e.g. from a push
+        event), only the job files and roles affected by them are scraped.
+        All other known ones are considered unchanged.
 
-        return job_files, role_files
+        The unchanged job files and roles are complete once all items were
+        consumed.
+        """
+        if paths is not None:
+            affected = self.affected_by(paths)
+            if affected is not None:
+                LOGGER.info("Scraping changed files of '%s'", self.repo.name)
+                self.limited = True
+                return self._iter_affected(*affected)
+            LOGGER.info(
+                "Changed files of '%s' don't match its known layout", self.repo.name
+            )
+
+        LOGGER.info("Scraping '%s'", self.repo.name)
+        return self._iter_all()
+
+    def _iter_all(self):
+        for path, file_info in self.iter_job_files():
+            yield JOB_FILE, path, file_info
+        for role_name, role_info in self.iter_role_files():
+            yield ROLE, role_name, role_info
 
     def scrape_job_files(self):
-        job_files = self.iterate_directory(
+        return dict(self.iter_job_files())
+
+    def iter_job_files(self):
+        return self.walk_directory(
             REPO_ROOT,
             whitelist=ZUUL_DIRECTORIES + ZUUL_FILES + self.extra_config_paths,
             # NOTE (felix): As we provide this directly to the
@@ -80,19 +144,123 @@ class Scraper:
             # str, not list
             file_extensions=(".yaml"),
         )
-        return job_files
+
+    def affected_by(self, paths):
+        """Get the job files and role names affected by the changed paths.
+
+        Returns None if the changes can't be mapped to the known job files
+        and roles (e.g. a new zuul.d directory or a new role). In this case
+        the whole repository must be scraped.
+        """
+        if not self.known_job_files and not self.known_roles:
+            return None
+
+        job_directories = ZUUL_FILES + ZUUL_DIRECTORIES
+        job_directories += [p.rstrip("/") for p in self.extra_config_paths]
+        known_top_levels = {p.split("/", 1)[0] for p in self.known_job_files}
+
+        job_paths = set()
+        role_names = set()
+        for path in paths:
+            top_level = path.split("/", 1)[0]
+            if top_level in job_directories:
+                if not path.endswith(".yaml"):
+                    continue
+                if top_level not in known_top_levels:
+                    return None
+                job_paths.add(path)
+            elif top_level == ROLES_DIRECTORY:
+                role_name = self._find_known_role(path)
+                if role_name is None:
+                    return None
+                role_names.add(role_name)
+        return job_paths, role_names
+
+    def _iter_affected(self, job_paths, role_names):
+        self.unchanged_job_files = {
+            path: sha
+            for path, sha in self.known_job_files.items()
+            if path not in job_paths
+        }
+        self.unchanged_roles = {
+            role_name: sha
+            for role_name, sha in self.known_roles.items()
+            if role_name not in role_names
+        }
+
+        # Cache the directory listings, as multiple files might be located
+        # in the same directory.
+        listings = {}
+
+        remote_files = []
+        for path in sorted(job_paths):
+            remote_file = self._find_remote(path, listings)
+            if remote_file is None or remote_file.type != "file":
+                LOGGER.debug("File '%s' was removed", path)
+                continue
+            remote_files.append((path, remote_file))
+
+        self.repo.prefetch([remote_file for _, remote_file in remote_files])
+        for path, remote_file in remote_files:
+            file_info = self.get_file_info(path)
+            if file_info:
+                sha = getattr(remote_file, "sha", None)
+                if sha:
+                    file_info["sha"] = sha
+                yield JOB_FILE, path, file_info
+
+        for role_name in sorted(role_names):
+            dir = self._find_remote(
+                "{}/{}".format(ROLES_DIRECTORY, role_name), listings
+            )
+            if dir is None or dir.type != "dir":
+                LOGGER.debug("Role '%s' was removed", role_name)
+                continue
+            try:
+                dir_items = self.repo.directory_contents(dir.path)
+                if not self._is_role(dir_items):
+                    continue
+                role_info = self.get_role_info(dir, dir_items)
+            except CheckoutError as e:
+                LOGGER.exception(e)
+                continue
+            yield ROLE, role_name, role_info
+
+    def _find_known_role(self, path):
+        # Roles might be nested, so the longest matching one wins
+        matches = [
+            role_name
+            for role_name in self.known_roles
+            if path.startswith("{}/{}/".format(ROLES_DIRECTORY, role_name))
+        ]
+        return max(matches, key=len) if matches else None
+
+    def _find_remote(self, path, listings):
+        parent = str(PurePosixPath(path).parent)
+        if parent == ".":
+            parent = REPO_ROOT
+        if parent not in listings:
+            try:
+                listings[parent] = self.repo.directory_contents(parent)
+            except CheckoutError:
+                listings[parent] = {}
+        return listings[parent].get(PurePosixPath(path).name)
 
     def iterate_directory(
         self, path, file_infos=None, whitelist=None, file_extensions=None
     ):
+        if file_infos is None:
+            file_infos = {}
+        file_infos.update(self.walk_directory(path, whitelist, file_extensions))
+        return file_infos
+
+    def walk_directory(self, path, whitelist=None, file_extensions=None):
+        """Yield the (path, file_info) tuples of all files in a directory."""
         if file_extensions is None:
             # By default, we don't want to filter any files, so we use
             # an empty string as default "extension".
             file_extensions = ""
 
-        if file_infos is None:
-            file_infos = {}
-
         try:
             remote_files = self.repo.directory_contents(path)
         except CheckoutError:
@@ -101,8 +269,10 @@ class Scraper:
             )
             # As this is the initial directory, it doesn't make much sense
             # to go any further.
-            return file_infos
+            return
 
+        dirs = []
+        files = []
         for file_name, remote_file in remote_files.items():
             # Skip files/directories that do not match the whitelist.
             # NOTE (felix): The whitelist is not forwarded and only
@@ -111,16 +281,7 @@ class Scraper:
                 continue
 
             if remote_file.type == "dir":
-                try:
-                    self.iterate_directory(
-                        remote_file.path, file_infos, file_extensions=file_extensions
-                    )
-                except CheckoutError as e:
-                    LOGGER.exception(
-                        "Unable to get check out directory '%s': %s",
-                        remote_file.path,
-                        e,
-                    )
+                dirs.append(remote_file)
             elif remote_file.type == "file":
                 # Skip files that don't match the required extension
                 if not file_name.endswith(file_extensions):
@@ -130,9 +291,14 @@ class Scraper:
                         file_extensions,
                     )
                     continue
-                file_info = self.get_file_info(remote_file.path)
-                if file_info:
-                    file_infos[remote_file.path] = file_info
+                # NOTE (felix): Not all repository implementations provide
+                # the SHA of a file.
+                sha = getattr(remote_file, "sha", None)
+                if sha and self.known_job_files.get(remote_file.path) == sha:
+                    LOGGER.debug("Skipping unchanged file '%s'", remote_file.path)
+                    self.unchanged_job_files[remote_file.path] = sha
+                    continue
+                files.append(remote_file)
             else:
                 # There are other file types like symlink or submodule,
                 # but we ignore them for now.
@@ -141,15 +307,37 @@ class Scraper:
                     remote_file.type,
                     remote_file.path,
                 )
-        return file_infos
+
+        # Get the contents of all files in this directory at once
+        self.repo.prefetch(files)
+        for remote_file in files:
+            file_info = self.get_file_info(remote_file.path)
+            if file_info:
+                sha = getattr(remote_file, "sha", None)
+                if sha:
+                    file_info["sha"] = sha
+                yield remote_file.path, file_info
+
+        for remote_dir in dirs:
+            try:
+                yield from self.walk_directory(
+                    remote_dir.path, file_extensions=file_extensions
+                )
+            except CheckoutError as e:
+                LOGGER.exception(
+                    "Unable to get check out directory '%s': %s", remote_dir.path, e
+                )
 
     def get_file_info(self, path):
+        getters = {
+            "last_changed": self.repo.last_changed,
+            "blame": self.repo.blame,
+            "content": self.repo.file_contents,
+        }
         file_info = {}
         try:
             file_info = {
-                "last_changed": self.repo.last_changed(path),
-                "blame": self.repo.blame(path),
-                "content": self.repo.file_contents(path),
+                field: getters[field](path) for field in self.item_info[JOB_FILE]
             }
         except CheckoutError as e:
             LOGGER.debug("Unable to get file info for '%s': %s", path, e)
@@ -157,7 +345,10 @@ class Scraper:
         return file_info
 
     def scrape_role_files(self):
-        role_files = {}
+        # sort keys (role names) alphabetically
+        return dict(sorted(self.iter_role_files()))
+
+    def iter_role_files(self):
         # Roles might be grouped in some parent directory, so we need to
         # recursively check nested directories.
 
@@ -171,42 +362,62 @@ class Scraper:
                 for item in self.repo.directory_contents(ROLES_DIRECTORY).values()
                 if item.type == "dir"
             ]
-            while dirs_to_search:
-                try:
-                    dir = dirs_to_search.pop(0)
-                    dir_items = self.repo.directory_contents(dir.path)
-
-                    subdirs = [
-                        item for item in dir_items.values() if item.type == "dir"
-                    ]
-                    # When directory does not contain one of role mandatory directories
-                    # it is not a role and its subdirectories (if any) should be further
-                    # scanned.
-                    # This is done by appending those subdirectories to 'dirs_to_search'
-                    # search list (this implements the recursive search)
-                    if set([d.name for d in subdirs]).isdisjoint(ROLE_MANDATORY_DIRS):
-                        dirs_to_search.extend(subdirs)
-                        continue
-
-                    # Once the role is found, we are only interested in the timestamp of
-                    # the latest update (the last git change), README and CHANGELOG files
-                    # Those files should be on the top-level per role.
-                    last_changed = self.repo.last_changed(dir.path)
-                    readme_file = self.find_matching_file(README_FILES, dir_items)
-                    changelog_file = self.find_matching_file(CHANGELOG_FILES, dir_items)
-                    # role name is the directory path relative to ROLES_DIRECTORY
-                    role_files[str(Path(dir.path).relative_to(ROLES_DIRECTORY))] = {
-                        "last_changed": last_changed,
-                        "readme_file": readme_file,
-                        "changelog_file": changelog_file,
-                    }
-                except CheckoutError as e:
-                    LOGGER.exception(e)
         except CheckoutError as e:
             LOGGER.debug(e)
+            return
 
-        # sort keys (role names) alphabetically
-        return {key: value for key, value in sorted(role_files.items())}
+        while dirs_to_search:
+            try:
+                dir = dirs_to_search.pop(0)
+                # role name is the directory path relative to ROLES_DIRECTORY
+                role_name = str(Path(dir.path).relative_to(ROLES_DIRECTORY))
+                # If the tree SHA didn't change, nothing in the role did
+                sha = getattr(dir, "sha", None)
+                if sha and self.known_roles.get(role_name) == sha:
+                    LOGGER.debug("Skipping unchanged role '%s'", role_name)
+                    self.unchanged_roles[role_name] = sha
+                    continue
+
+                dir_items = self.repo.directory_contents(dir.path)
+
+                # When directory does not contain one of role mandatory directories
+                # it is not a role and its subdirectories (if any) should be further
+                # scanned.
+                # This is done by appending those subdirectories to 'dirs_to_search'
+                # search list (this implements the recursive search)
+                if not self._is_role(dir_items):
+                    dirs_to_search.extend(
+                        item for item in dir_items.values() if item.type == "dir"
+                    )
+                    continue
+
+                role_info = self.get_role_info(dir, dir_items)
+            except CheckoutError as e:
+                LOGGER.exception(e)
+                continue
+            yield role_name, role_info
+
+    def get_role_info(self, dir, dir_items):
+        # Once the role is found, we are only interested in the timestamp of
+        # the latest update (the last git change), README and CHANGELOG files
+        # Those files should be on the top-level per role.
+        getters = {
+            "last_changed": lambda: self.repo.last_changed(dir.path),
+            "readme_file": lambda: self.find_matching_file(README_FILES, dir_items),
+            "changelog_file": lambda: self.find_matching_file(
+                CHANGELOG_FILES, dir_items
+            ),
+        }
+        role_info = {field: getters[field]() for field in self.item_info[ROLE]}
+        sha = getattr(dir, "sha", None)
+        if sha:
+            role_info["sha"] = sha
+        return role_info
+
+    @staticmethod
+    def _is_role(dir_items):
+        subdirs = {item.name for item in dir_items.values() if item.type == "dir"}
+        return not subdirs.isdisjoint(ROLE_MANDATORY_DIRS)
 
     def find_matching_file(self, file_filter, existing_files):
         for filename, file_content in existing_files.items():
@@ -0,0 +1,55 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from zubbi.scraper.exceptions import ScraperConfigurationError
+
+
+class Shard:
+    """The part of all repositories a single scraper instance is responsible for.
+
+    Each repository is assigned to exactly one shard based on the hash of
+    its name. This allows running multiple scraper instances side by side
+    without scraping (or deleting) the same repositories.
+    """
+
+    def __init__(self, index=0, count=1):
+        if count < 1 or not 0 <= index < count:
+            raise ScraperConfigurationError(
+                "Invalid shard configuration: The shard index must be between "
+                "0 and {}, but is {}.".format(count - 1, index)
+            )
+        self.index = index
+        self.count = count
+
+    @staticmethod
+    def shard_for(repo_name, count):
+        # NOTE (felix): Python's hash() is salted per process, so we have to
+        # use a stable hash function to get the same result on each instance.
+        digest = hashlib.sha1(str.encode(repo_name)).hexdigest()
+        return int(digest, 16) % count
+
+    def owner(self, repo_name):
+        """Get the index of the shard owning the given repository."""
+        return self.shard_for(repo_name, self.count)
+
+    def owns(self, repo_name):
+        return self.owner(repo_name) == self.index
+
+    def filter(self, repo_names):
+        return [repo_name for repo_name in repo_names if self.owns(repo_name)]
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.count)
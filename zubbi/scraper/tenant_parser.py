@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import logging
 import os
 from collections import defaultdict
@@ -25,25 +26,148 @@ TENANTS_DIRECTORY = "tenants"
 LOGGER = logging.getLogger(__name__)
 
 
+class TenantDiff:
+    """Changes of the repo_map between two parsings of the tenant sources."""
+
+    __slots__ = (
+        "added",
+        "removed",
+        "changed",
+        "rescrape",
+        "tenants_added",
+        "tenants_removed",
+    )
+
+    def __init__(self, old_repo_map, new_repo_map, old_tenants, new_tenants):
+        self.added = sorted(new_repo_map.keys() - old_repo_map.keys())
+        self.removed = sorted(old_repo_map.keys() - new_repo_map.keys())
+        # Repos which are still part of the tenant sources, but with different
+        # tenants. Only the tenants of their jobs and roles must be updated.
+        self.changed = []
+        # Repos for which other files must be scraped (e.g. due to changed
+        # extra config paths) or which use another connection now.
+        self.rescrape = []
+        for repo_name in sorted(new_repo_map.keys() & old_repo_map.keys()):
+            old_data = old_repo_map[repo_name]
+            new_data = new_repo_map[repo_name]
+            if old_data == new_data:
+                continue
+            if self._needs_rescrape(old_data, new_data):
+                self.rescrape.append(repo_name)
+            else:
+                self.changed.append(repo_name)
+        self.tenants_added = sorted(set(new_tenants) - set(old_tenants))
+        self.tenants_removed = sorted(set(old_tenants) - set(new_tenants))
+
+    @staticmethod
+    def _needs_rescrape(old_data, new_data):
+        if old_data.get("connection_name") != new_data.get("connection_name"):
+            return True
+        old_paths = old_data.get("tenants", {}).get("extra_config_paths", {})
+        new_paths = new_data.get("tenants", {}).get("extra_config_paths", {})
+        return list(old_paths.keys()) != list(new_paths.keys())
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.rescrape)
+
+    def __str__(self):
+        return (
+            "{} added, {} removed, {} changed, {} to rescrape repos; "
+            "tenants added: {}, tenants removed: {}".format(
+                len(self.added),
+                len(self.removed),
+                len(self.changed),
+                len(self.rescrape),
+                self.tenants_added,
+                self.tenants_removed,
+            )
+        )
+
+
 class TenantParser:
     def __init__(self, sources_file=None, sources_repo=None):
+        self.sources_file = sources_file
+        self.sources_repo = sources_repo
         self.sources = None
         self.repo_map = {}
         self.tenants = []
+        # Fingerprint of the currently loaded sources and whether the
+        # repo_map is still up to date with them.
+        self._fingerprint = None
+        self._file_stat = None
+        self._parsed = False
         # Initial call to load the sources file/repo
         self.reload_sources(sources_file, sources_repo)
 
     def reload_sources(self, sources_file=None, sources_repo=None):
+        self.sources_file = sources_file
+        self.sources_repo = sources_repo
+        self._file_stat = None
+        self._fingerprint = self._get_fingerprint()
         if sources_file:
             self.sources = self._load_tenant_sources_from_file(sources_file)
         else:
             self.sources = self._load_tenant_sources_from_repo(sources_repo)
+        self._parsed = False
 
     def update(self, sources_file=None, sources_repo=None):
         self.reload_sources(sources_file, sources_repo)
         self.parse()
 
+    def refresh(self, fetch=False):
+        """Re-parse the tenant sources, but only if they have changed.
+
+        For a sources file, the file is checked on each call. For a sources
+        repo, the repo is only checked if fetch is set (e.g. when we receive
+        a push event for this repo), as this requires fetching the repo or an
+        API call.
+
+        Returns the TenantDiff if the repo_map was (re-)parsed, otherwise None.
+        """
+        if fetch and self.sources_repo is not None:
+            self.sources_repo.refresh()
+
+        if self.sources_file or fetch:
+            fingerprint = self._get_fingerprint()
+            if fingerprint is None or fingerprint != self._fingerprint:
+                LOGGER.info("Tenant sources have changed, reloading them")
+                self.reload_sources(self.sources_file, self.sources_repo)
+
+        if self._parsed:
+            LOGGER.debug("Tenant sources are unchanged, skip parsing")
+            return None
+
+        return self.parse()
+
+    def _get_fingerprint(self):
+        if self.sources_file:
+            return self._get_file_fingerprint(self.sources_file)
+        if self.sources_repo is not None:
+            # NOTE (felix): If the repo can't provide its HEAD, we get None
+            # and the sources are always reloaded.
+            return self.sources_repo.head_sha()
+        return None
+
+    def _get_file_fingerprint(self, sources_file):
+        try:
+            stat = os.stat(sources_file)
+        except OSError:
+            return None
+        # Only hash the file content if the file was touched. This keeps the
+        # check cheap, while a touch without any change won't cause a re-parse.
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        if file_stat == self._file_stat and self._fingerprint is not None:
+            return self._fingerprint
+        self._file_stat = file_stat
+        with open(sources_file, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
     def parse(self):
+        # Keep the previous state to compute the changes. The entries itself
+        # are not modified, so a shallow copy is sufficient.
+        old_repo_map = dict(self.repo_map)
+        old_tenants = list(self.tenants)
+
         # Clear repo_map and tenant list first
         self.repo_map.clear()
         self.tenants.clear()
@@ -61,6 +185,13 @@ class TenantParser:
 
             self.tenants.append(tenant_name)
 
+        self._parsed = True
+
+        diff = TenantDiff(old_repo_map, self.repo_map, old_tenants, self.tenants)
+        if diff:
+            LOGGER.info("Tenant sources changed: %s", diff)
+        return diff
+
     def _update_repo_map(self, project, connection_name, tenant):
         result = self._extract_project(project)
         if result is None:
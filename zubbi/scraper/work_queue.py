@@ -0,0 +1,201 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import itertools
+import logging
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+# Lower values are handled first
+PRIORITY_PUSH = 0
+PRIORITY_INSTALLATION = 1
+PRIORITY_PERIODIC = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_PUSH: "push",
+    PRIORITY_INSTALLATION: "installation",
+    PRIORITY_PERIODIC: "periodic",
+}
+
+# Number of GitHub delivery IDs to remember for deduplication
+DEFAULT_DELIVERY_CACHE_SIZE = 1000
+
+
+class ScrapeRequest:
+    __slots__ = (
+        "repo_name",
+        "priority",
+        "delete_only",
+        "sequence",
+        "paths",
+        "revision",
+    )
+
+    def __init__(self, repo_name, priority, delete_only, sequence, paths=None):
+        self.repo_name = repo_name
+        self.priority = priority
+        self.delete_only = delete_only
+        self.sequence = sequence
+        # Changed paths of the repository or None to scrape all of it
+        self.paths = paths
+        # Incremented whenever another request is coalesced into this one
+        self.revision = 0
+
+    def __repr__(self):
+        return "ScrapeRequest({}, {}, delete_only={})".format(
+            self.repo_name, PRIORITY_NAMES.get(self.priority), self.delete_only
+        )
+
+
+class ScrapeQueue:
+    """Priority queue for pending scrape requests.
+
+    There is at most one pending request per repository. Further requests
+    for the same repository are coalesced into the pending one, which keeps
+    the highest priority of both and the action (scrape or delete) of the
+    latest request. Requests with the same priority are handled in the
+    order they were queued.
+
+    A request might be limited to some paths of the repository (e.g. the
+    ones changed by a push). Coalesced requests cover the paths of both, or
+    the whole repository if one of them does.
+    """
+
+    def __init__(self, shard=None, delivery_cache_size=DEFAULT_DELIVERY_CACHE_SIZE):
+        self.shard = shard
+        self._pending = {}
+        # Heap of (priority, sequence, repo_name) tuples. Entries which don't
+        # match the pending request of a repository anymore are outdated and
+        # skipped when they are popped.
+        self._heap = []
+        self._sequence = itertools.count()
+        self._deliveries = OrderedDict()
+        self._delivery_cache_size = delivery_cache_size
+
+    def put(self, repo_names, priority, delete_only=False, paths=None):
+        # A deletion always covers the whole repository
+        if paths is not None and not delete_only:
+            paths = frozenset(paths)
+        else:
+            paths = None
+        for repo_name in repo_names:
+            # Repositories of other shards are handled by other scraper instances
+            if self.shard is not None and not self.shard.owns(repo_name):
+                continue
+
+            request = self._pending.get(repo_name)
+            if request is None:
+                request = ScrapeRequest(
+                    repo_name, priority, delete_only, next(self._sequence), paths
+                )
+                self._pending[repo_name] = request
+                heapq.heappush(self._heap, (priority, request.sequence, repo_name))
+                continue
+
+            LOGGER.debug("Coalescing scrape requests for repo '%s'", repo_name)
+            requeue = priority < request.priority or delete_only != request.delete_only
+            request.priority = min(priority, request.priority)
+            request.delete_only = delete_only
+            request.revision += 1
+            if delete_only or request.paths is None or paths is None:
+                request.paths = None
+            else:
+                request.paths = request.paths | paths
+            if requeue:
+                request.sequence = next(self._sequence)
+                heapq.heappush(
+                    self._heap, (request.priority, request.sequence, repo_name)
+                )
+
+    def pop(self):
+        """Get the next request or None if the queue is empty."""
+        while self._heap:
+            _, sequence, repo_name = heapq.heappop(self._heap)
+            request = self._pending.get(repo_name)
+            if request is not None and request.sequence == sequence:
+                del self._pending[repo_name]
+                return request
+        return None
+
+    def pop_batch(self, size):
+        """Get up to size requests with the same priority and action."""
+        first = self.pop()
+        if first is None:
+            return []
+
+        batch = [first]
+        while len(batch) < size:
+            request = self.peek()
+            if (
+                request is None
+                or request.priority != first.priority
+                or request.delete_only != first.delete_only
+            ):
+                break
+            batch.append(self.pop())
+        return batch
+
+    def upcoming(self, count):
+        """Get the next count requests (in order) without removing them."""
+        entries = heapq.nsmallest(
+            count,
+            (
+                (priority, sequence, repo_name)
+                for priority, sequence, repo_name in self._heap
+                if repo_name in self._pending
+                and self._pending[repo_name].sequence == sequence
+            ),
+        )
+        return [self._pending[repo_name] for _, _, repo_name in entries]
+
+    def peek(self):
+        while self._heap:
+            _, sequence, repo_name = self._heap[0]
+            request = self._pending.get(repo_name)
+            if request is not None and request.sequence == sequence:
+                return request
+            # Drop the outdated entry
+            heapq.heappop(self._heap)
+        return None
+
+    def is_duplicate(self, delivery_id):
+        """Check if an event with this delivery ID was already received.
+
+        GitHub might deliver the same event multiple times (e.g. on manual
+        redeliveries). As those events share the same delivery ID, we can
+        use it to skip the ones we already know.
+        """
+        if delivery_id is None:
+            return False
+        if delivery_id in self._deliveries:
+            return True
+        self._deliveries[delivery_id] = None
+        if len(self._deliveries) > self._delivery_cache_size:
+            self._deliveries.popitem(last=False)
+        return False
+
+    def depth(self):
+        """Get the number of pending requests per priority."""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for request in self._pending.values():
+            depth[PRIORITY_NAMES[request.priority]] += 1
+        return depth
+
+    def __contains__(self, repo_name):
+        return repo_name in self._pending
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,359 @@
+# Copyright 2018 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import fcntl
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+from git import Repo
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
+
+LOGGER = logging.getLogger(__name__)
+
+# Name of the shared object store within the workspace. The leading dot
+# ensures that it can't clash with a repository name.
+SHARED_OBJECTS_DIR = ".shared.git"
+# Directory of the lock files for each clone
+LOCKS_DIR = ".locks"
+
+# Workspaces by their (resolved) directory
+_WORKSPACES = {}
+_WORKSPACES_LOCK = threading.Lock()
+
+
+class _CloneLock:
+    """Lock state of a single clone, shared by all threads of a process."""
+
+    __slots__ = ("mutex", "file", "users")
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        # Lock file holding the shared lock while the clone is in use
+        self.file = None
+        self.users = 0
+
+
+def get_workspace(path, shared_objects=False, max_size=None):
+    """Get the workspace of a directory, shared by all its connections.
+
+    If the connections use different settings for the same directory, the
+    objects are shared if any connection asks for it, and the smallest
+    max_size applies.
+    """
+    key = os.path.realpath(path)
+    with _WORKSPACES_LOCK:
+        workspace = _WORKSPACES.get(key)
+        if workspace is None:
+            workspace = _WORKSPACES[key] = Workspace(path, shared_objects, max_size)
+            return workspace
+        workspace.shared_objects = workspace.shared_objects or shared_objects
+        if max_size is not None:
+            workspace.max_size = min(max_size, workspace.max_size or max_size)
+        return workspace
+
+
+class Workspace:
+    """Directory containing the bare clones of a connection's repositories.
+
+    With shared_objects, the objects of all clones are moved to a single
+    object store in the workspace (which is used by each clone as git
+    alternate). This way, objects which are part of several repositories
+    (e.g. forks) are only stored once.
+
+    Moving the objects is done in maintain(), which also repacks the clones
+    and should be called outside of the scraping.
+
+    With max_size (in bytes), the least recently used clones are removed
+    once the workspace grows beyond this size. The last usage of a clone is
+    stored as modification time of its directory, so it survives restarts.
+    Clones which are in use (see acquire()) are never removed.
+
+    Modifications of a clone (clone, fetch, repack or removal) are guarded by
+    an exclusive file lock per repository (see lock()), while reading a clone
+    holds a shared one. This way, neither multiple threads nor multiple
+    scrapers sharing the workspace modify the same clone at once or remove
+    it while it's read.
+
+    Connections using the same directory must share their workspace (see
+    get_workspace()), as the usage of the clones is tracked per object.
+    """
+
+    def __init__(self, path, shared_objects=False, max_size=None):
+        self.path = Path(path)
+        self.shared_objects = shared_objects
+        self.max_size = max_size
+        self._clone_locks = {}
+        # Size of each clone, calculated on first usage
+        self._sizes = None
+        # Guards the locks and sizes, as clones might be fetched in parallel
+        self._state_lock = threading.RLock()
+
+    @property
+    def shared_objects_path(self):
+        return self.path / SHARED_OBJECTS_DIR / "objects"
+
+    def repo_path(self, repo_name):
+        return self.path / repo_name
+
+    @contextlib.contextmanager
+    def lock(self, repo_name, blocking=True):
+        """Lock the clone of a repository for modifications.
+
+        Yields whether the lock was acquired, which is always the case if
+        blocking is set.
+        """
+        clone_lock = self._get_clone_lock(repo_name)
+        if not clone_lock.mutex.acquire(blocking):
+            yield False
+            return
+        try:
+            # NOTE (felix): Locks of different lock files conflict even within
+            # the same process. Thus, if the clone is in use, its shared lock
+            # is converted instead of locking a second lock file.
+            lock_file = clone_lock.file or self._open_lock_file(repo_name)
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+                locked = True
+            except BlockingIOError:
+                locked = False
+            try:
+                yield locked
+            finally:
+                if clone_lock.file is None:
+                    lock_file.close()
+                else:
+                    # Keep protecting the clone while it's in use
+                    fcntl.flock(lock_file, fcntl.LOCK_SH)
+        finally:
+            clone_lock.mutex.release()
+
+    def _get_clone_lock(self, repo_name):
+        with self._state_lock:
+            if repo_name not in self._clone_locks:
+                self._clone_locks[repo_name] = _CloneLock()
+            return self._clone_locks[repo_name]
+
+    def _open_lock_file(self, repo_name):
+        locks_path = self.path / LOCKS_DIR
+        locks_path.mkdir(parents=True, exist_ok=True)
+        lock_path = locks_path / "{}.lock".format(quote(repo_name, safe=""))
+        return open(lock_path, "a")
+
+    def _in_use(self, repo_name):
+        clone_lock = self._clone_locks.get(repo_name)
+        return clone_lock is not None and clone_lock.users > 0
+
+    def repo_names(self):
+        """Get the names of all repositories cloned into this workspace."""
+        if not self.path.is_dir():
+            return []
+        repo_names = []
+        dirs = [self.path]
+        while dirs:
+            dir = dirs.pop()
+            for child in dir.iterdir():
+                if not child.is_dir() or child.name in (SHARED_OBJECTS_DIR, LOCKS_DIR):
+                    continue
+                # Repository names might contain slashes, so we have to look
+                # for the bare clones in nested directories.
+                if (child / "HEAD").is_file() and (child / "objects").is_dir():
+                    repo_names.append(child.relative_to(self.path).as_posix())
+                else:
+                    dirs.append(child)
+        return sorted(repo_names)
+
+    def acquire(self, repo_name):
+        """Protect the clone of a repository from being removed.
+
+        Until release(), the clone is locked shared, so neither this nor
+        another scraper sharing the workspace removes (or modifies) it while
+        it's read.
+        """
+        clone_lock = self._get_clone_lock(repo_name)
+        with clone_lock.mutex:
+            if clone_lock.users == 0:
+                lock_file = self._open_lock_file(repo_name)
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                clone_lock.file = lock_file
+            clone_lock.users += 1
+
+    def release(self, repo_name):
+        clone_lock = self._get_clone_lock(repo_name)
+        with clone_lock.mutex:
+            clone_lock.users -= 1
+            if clone_lock.users <= 0:
+                clone_lock.users = 0
+                if clone_lock.file is not None:
+                    clone_lock.file.close()
+                    clone_lock.file = None
+
+    def update(self, repo_name):
+        """Mark the clone of a repository as used after a clone or fetch.
+
+        If this exceeds the workspace's max_size, the least recently used
+        other clones are removed.
+        """
+        repo_path = self.repo_path(repo_name)
+        if not repo_path.is_dir():
+            return
+        os.utime(repo_path)
+        if self.max_size is None:
+            return
+        with self._state_lock:
+            sizes = self._get_sizes()
+            sizes[repo_name] = _dir_size(repo_path)
+            self._evict(keep=repo_name)
+
+    def remove(self, repo_name):
+        """Remove the clone of a repository (e.g. if it's no longer scraped)."""
+        with self.lock(repo_name):
+            self._remove(repo_name)
+
+    def _remove(self, repo_name):
+        repo_path = self.repo_path(repo_name)
+        with self._state_lock:
+            if self._sizes is not None:
+                self._sizes.pop(repo_name, None)
+        if not repo_path.is_dir():
+            return
+        LOGGER.info("Removing clone of repo '%s'", repo_name)
+        shutil.rmtree(repo_path, ignore_errors=True)
+        # Clean up the parent directories (e.g. the organization) if empty
+        for parent in repo_path.parents:
+            if parent == self.path or not parent.is_relative_to(self.path):
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
+    def _get_sizes(self):
+        if self._sizes is None:
+            self._sizes = {
+                repo_name: _dir_size(self.repo_path(repo_name))
+                for repo_name in self.repo_names()
+            }
+        return self._sizes
+
+    def _evict(self, keep):
+        sizes = self._get_sizes()
+        # The shared object store can't be evicted, but counts to the budget
+        total = sum(sizes.values()) + _dir_size(self.path / SHARED_OBJECTS_DIR)
+        if total <= self.max_size:
+            return
+
+        candidates = []
+        for repo_name in sizes:
+            if repo_name == keep or self._in_use(repo_name):
+                continue
+            try:
+                last_used = self.repo_path(repo_name).stat().st_mtime
+            except OSError:
+                last_used = 0
+            candidates.append((last_used, repo_name))
+
+        for _, repo_name in sorted(candidates):
+            if total <= self.max_size:
+                break
+            # Clones which are read or modified right now by another scraper
+            # are locked as well.
+            with self.lock(repo_name, blocking=False) as locked:
+                if not locked or self._in_use(repo_name):
+                    continue
+                total -= sizes[repo_name]
+                self._remove(repo_name)
+
+        if total > self.max_size:
+            LOGGER.warning(
+                "Workspace '%s' exceeds its max size of %d bytes, but all "
+                "remaining clones are in use",
+                self.path,
+                self.max_size,
+            )
+
+    def maintain(self):
+        """Repack all clones and move their objects to the shared store."""
+        repo_names = self.repo_names()
+        if not repo_names:
+            return
+        LOGGER.info(
+            "Maintaining %d repos in workspace '%s'", len(repo_names), self.path
+        )
+        shared_repo = self._get_shared_repo() if self.shared_objects else None
+
+        for repo_name in repo_names:
+            try:
+                with self.lock(repo_name):
+                    repo = Repo(self.repo_path(repo_name))
+                    if shared_repo is None:
+                        repo.git.gc("--quiet")
+                    else:
+                        self._share_objects(repo)
+            except (GitCommandError, InvalidGitRepositoryError, NoSuchPathError) as e:
+                LOGGER.error("Maintaining repo '%s' failed: %s", repo_name, e)
+
+        if shared_repo is not None:
+            # NOTE (felix): The shared store has no refs, so all of its
+            # objects are unreachable. Thus, we must never prune it (which
+            # would also break the clones using it), but only merge its packs.
+            shared_repo.git.repack("-a", "-d", "-q", "--keep-unreachable")
+
+    def _get_shared_repo(self):
+        shared_path = self.path / SHARED_OBJECTS_DIR
+        if shared_path.exists():
+            return Repo(shared_path)
+        LOGGER.info("Creating shared object store in '%s'", shared_path)
+        return Repo.init(shared_path, bare=True)
+
+    def _share_objects(self, repo):
+        objects_path = Path(repo.git_dir) / "objects"
+        # Pack all objects of the clone, so we only have to copy the packs
+        repo.git.repack("-a", "-d", "-q")
+
+        shared_pack_path = self.shared_objects_path / "pack"
+        for pack in (objects_path / "pack").glob("*.pack"):
+            index = pack.with_suffix(".idx")
+            if not index.exists() or (shared_pack_path / index.name).exists():
+                continue
+            # A pack is only used once its index exists, so the index must be
+            # copied last.
+            shutil.copyfile(pack, shared_pack_path / pack.name)
+            shutil.copyfile(index, shared_pack_path / index.name)
+
+        alternates = objects_path / "info" / "alternates"
+        shared = str(self.shared_objects_path.resolve())
+        if not alternates.exists() or shared not in alternates.read_text().split():
+            alternates.parent.mkdir(exist_ok=True)
+            with alternates.open("a") as f:
+                f.write("{}\n".format(shared))
+
+        # Drop all objects which are available in the shared store
+        repo.git.repack("-a", "-d", "-q", "-l")
+
+
+def _dir_size(path):
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                size += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                pass
+    return size
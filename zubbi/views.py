@@ -32,7 +32,7 @@ from flask import (
 )
 from flask.views import MethodView
 
-from .extensions import get_zmq_socket
+from .extensions import get_autocomplete_cache, get_zmq_socket
 from .helpers import calculate_pagination
 from .models import BlockSearch, block_type, class_from_block_type
 from .utils import get_version
@@ -71,6 +71,17 @@ class ZubbiMethodView(MethodView):
     def register_url(cls, app, **options):
         app.add_url_rule(cls.rule, view_func=cls.as_view(cls.endpoint), **options)
 
+    # Fields of the documents which are loaded by this view (all by default)
+    source_includes = None
+    source_excludes = None
+
+    def filter_source(self, search):
+        if self.source_includes is None and self.source_excludes is None:
+            return search
+        return search.source(
+            includes=self.source_includes or [], excludes=self.source_excludes or []
+        )
+
     def get_context(self, **kwargs):
         # Initialize context with meta fields that should be available on all pages
         context = {"meta": {"version": get_version()}}
@@ -94,6 +105,15 @@ class SearchView(ZubbiMethodView):
     endpoint = "search"
     rule = "/search"
     template_name = "search.html"
+    # Only the fields which are shown on the result cards
+    source_includes = [
+        "role_name",
+        "job_name",
+        "repo",
+        "reusable",
+        "last_updated",
+        "summary",
+    ]
 
     def get(self):
         query = request.args.get("query")
@@ -151,7 +171,8 @@ class SearchView(ZubbiMethodView):
         search = BlockSearch(block_class=block_class).search_query(
             query, field_set, exact, extra_filter
         )
-        result = search[filter_from:filter_to].execute()
+        search = self.filter_source(search)
+        total, result = search[filter_from:filter_to].execute_hits()
 
         if len(result) == 1 and filter_from == 0:
             block = result[0]
@@ -167,11 +188,12 @@ class SearchView(ZubbiMethodView):
 
         current_page = filter_from // filter_size
         # The last results fit on the second last page. E.g. If we have 9/18/... results
-        last_page = max(math.ceil(result.hits.total.value / filter_size) - 1, 0)
+        last_page = max(math.ceil(total / filter_size) - 1, 0)
         pagination = calculate_pagination(current_page, last_page)
 
         context = {
             "result": result,
+            "total": total,
             "query": query,
             "exact": exact,
             "fields": fields,
@@ -192,6 +214,8 @@ class DetailView(ZubbiMethodView):
     endpoint = "details"
     rule = "/detail/<path:repo>/<block_type>/<name>"
     template_name = "details.html"
+    # The name suggestion is never rendered
+    source_excludes = ["name_suggest"]
 
     def get(self, repo, block_type, name):
         try:
@@ -204,6 +228,7 @@ class DetailView(ZubbiMethodView):
         search = BlockSearch(block_class=BlockClass).detail_query(
             name, repo, extra_filter
         )
+        search = self.filter_source(search)
         result = search.execute()
 
         if not result:
@@ -227,6 +252,7 @@ class AutoCompleteView(ZubbiMethodView):
     endpoint = "auto-complete"
     rule = "/api/search/autocomplete"
     template_name = None
+    source_includes = ["role_name", "job_name"]
 
     def get(self):
         term = request.args.get("term")
@@ -234,27 +260,32 @@ class AutoCompleteView(ZubbiMethodView):
         if not term:
             json_abort(404)
 
+        # The suggestions don't depend on the case or surrounding whitespace
+        cache = get_autocomplete_cache()
+        cache_key = " ".join(term.lower().split())
+        names = cache.get(cache_key)
+        if names is None:
+            names = self.suggest_names(term)
+            cache.set(cache_key, names)
+        return jsonify(names)
+
+    def suggest_names(self, term, size=10):
         # TODO: This could later be extended to filter also for tenants
-        # contexts = {
-        #     "tenants": ["<tenant>"],
-        #     "private": [False]
-        # }
+        # extra_filter = [Q("term", tenants="<tenant>") | Q("term", private=False)]
         # if we have the tenant information via an Apache Mellon header.
-        contexts = {"private": [False]}
-        search = BlockSearch().suggest_query(term, size=10, contexts=contexts)
-        result = search.execute()
-
-        json_response = set()
-
-        for suggester in result.suggest.suggester:
-            for option in suggester.options:
-                # NOTE (fschmidt): If we need the result as block class (AnsibleRole,
-                # ZuulJob), we could activate the following line
-                # block = search._get_result(option.to_dict())
-                # json_response.append(block.name)
-                json_response.add(option.text)
+        extra_filter = Q("term", private=False)
+        # NOTE (felix): A job might be defined in multiple repos, so we have to
+        # look at more results to get enough distinct names.
+        search = BlockSearch().autocomplete_query(
+            term, size=2 * size, extra_filter=extra_filter
+        )
+        result = self.filter_source(search).execute()
 
-        return jsonify(list(json_response))
+        names = []
+        for block in result:
+            if block.name not in names:
+                names.append(block.name)
+        return names[:size]
 
 
 class WebhookView(ZubbiMethodView):
@@ -270,7 +301,8 @@ class WebhookView(ZubbiMethodView):
             json_abort(400, "Payload is missing or not a valid JSON")
 
         # Check if we received a webhook from GitHub
-        if request.headers.get("x-github-delivery") is None:
+        delivery_id = request.headers.get("x-github-delivery")
+        if delivery_id is None:
             json_abort(400, "X-GitHub-Delivery header missing.")
 
         # Verify that the webhook was sent from our own GitHub app
@@ -280,6 +312,10 @@ class WebhookView(ZubbiMethodView):
         event = self.check_event(request.headers)
 
         if event is not None:
+            # The delivery ID allows the scraper to skip duplicate deliveries.
+            # NOTE (felix): It's part of the payload, as older scrapers expect
+            # exactly two frames per message.
+            payload["delivery_id"] = delivery_id
             get_zmq_socket().send_multipart(
                 (event.encode("utf-8"), json.dumps(payload).encode("utf-8"))
             )